@@ -6,44 +6,70 @@ import os,sys
 from argparse import ArgumentParser
 from utilities.utilities import utilities as utilities
 
-parser = ArgumentParser()
-parser.add_argument('--sources', action='store_true',
-                    help='List currently supported data sources')
-parser.add_argument('--data_source', action='store', dest='data_source', default='ASGS', type=str,
-                    help='choose supported data source: default = ASGS')
-parser.add_argument('--urls', action='store', dest='urls', default=None, type=str,
-                    help='ASGS url to fetcb ADCIRC data')
-parser.add_argument('--data_product', action='store', dest='data_product', default='water_level', type=str,
-                    help='choose supported data product: default is water_level')
-parser.add_argument('--convertToNowcast', action='store_true',
-                    help='Attempts to force input URL into a nowcast url assuming normal ASGS conventions')
-parser.add_argument('--fort63_style', action='store_true',
-                    help='Boolean: Will inform Harvester to use fort.63.methods to get station nodesids')
-#print(sys.argv[1:])
-args = parser.parse_args()
-#argList=sys.argv[1:]
-
-import fetch_adcirc_data
-
-# NOTE we change args name because jobs can run concurrently
-
-try:
-    fetch_adcirc_data.main(args) 
-except Exception as e:
-    utilities.log.error('FORECAST Fail. {}'.format(e))
-
-# Now ADD the --convertToNowcast value to the argList and rerun
-#argList.append("--convertToNowcast") 
-
-args2 = args
-args2.convertToNowcast=True
-
-try:
-    fetch_adcirc_data.main(args2)
-except Exception as e:
-    utilities.log.error('NOWCAST Fail. {}'.format(e))
-    sys.exit(1)
-
-utilities.log.info('Finished')
+# The guard is required: --ensembles runs the ensembles in a process pool, whose workers (spawn/forkserver
+# start methods) import this module again
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--sources', action='store_true',
+                        help='List currently supported data sources')
+    parser.add_argument('--data_source', action='store', dest='data_source', default='ASGS', type=str,
+                        help='choose supported data source: default = ASGS')
+    parser.add_argument('--urls', action='store', dest='urls', default=None, type=str,
+                        help='ASGS url to fetcb ADCIRC data')
+    parser.add_argument('--data_product', action='store', dest='data_product', default='water_level', type=str,
+                        help='choose supported data product: default is water_level')
+    parser.add_argument('--convertToNowcast', action='store_true',
+                        help='Attempts to force input URL into a nowcast url assuming normal ASGS conventions')
+    parser.add_argument('--ensembles', nargs='+', action='store', dest='ensembles', default=None, type=str,
+                        help='Extract these ensembles of the url cycle concurrently (eg namforecast nowcast) instead of the url then its nowcast')
+    parser.add_argument('--fort63_style', action='store_true',
+                        help='Boolean: Will inform Harvester to use fort.63.methods to get station nodesids')
+    parser.add_argument('--nearest_nodes', action='store_true',
+                        help='With --fort63_style use the nearest wet grid node of each station lon/lat instead of the Node column')
+    parser.add_argument('--interpolate', action='store_true',
+                        help='With --fort63_style interpolate each station lon/lat within its mesh element (barycentric weights) like the fort.61 values')
+    parser.add_argument('--node_index', action='store', dest='node_index', default=None, type=str,
+                        help='Directory of the persisted grid node indexes and element weights: default RDIR/adcirc_node_index')
+    parser.add_argument('--bulk_read', action='store_true',
+                        help='Read each url once (time and all of zeta, or with --fort63_style the station nodes as a few hyperslabs) and slice every station from it in memory')
+    parser.add_argument('--read_gap', action='store', dest='read_gap', default=1000, type=int,
+                        help='With --fort63_style --bulk_read: most unrequested nodes read to join two station nodes in one hyperslab: default 1000')
+    parser.add_argument('--probe_workers', action='store', dest='probe_workers', default=0, type=int,
+                        help='Check the urls concurrently (one .dds request each) with this many threads: default 0 (open each in turn)')
+    parser.add_argument('--station_index', action='store', dest='station_index', default=None, type=str,
+                        help='Index file of the fort.61 column of each station: default RDIR/adcirc_station_index.json')
+    parser.add_argument('--no_station_index', action='store_true',
+                        help='Decode the fort.61 station names of every url instead of using the station index file')
+    parser.add_argument('--max_workers', action='store', dest='max_workers', default=1, type=int,
+                        help='Number of stations to fetch concurrently: default 1 (serial)')
+    parser.add_argument('--postprocess_workers', action='store', dest='postprocess_workers', default=0, type=int,
+                        help='Number of processes used to interpolate/resample stations while fetching continues: default 0 (inline)')
+    #print(sys.argv[1:])
+    args = parser.parse_args()
+    #argList=sys.argv[1:]
 
+    import fetch_adcirc_data
 
+    # NOTE we change args name because jobs can run concurrently
+
+    if args.ensembles is not None:
+        sys.exit(fetch_adcirc_data.main_ensembles(args, args.ensembles))
+
+    try:
+        fetch_adcirc_data.main(args) 
+    except Exception as e:
+        utilities.log.error('FORECAST Fail. {}'.format(e))
+
+    # Now ADD the --convertToNowcast value to the argList and rerun
+    #argList.append("--convertToNowcast") 
+
+    args2 = args
+    args2.convertToNowcast=True
+
+    try:
+        fetch_adcirc_data.main(args2)
+    except Exception as e:
+        utilities.log.error('NOWCAST Fail. {}'.format(e))
+        sys.exit(1)
+
+    utilities.log.info('Finished')
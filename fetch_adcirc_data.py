@@ -10,8 +10,11 @@
 import os,sys
 import pandas as pd
 import datetime as dt
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 from fetch_station_data import adcirc_fetch_data
+from utilities.station_index import fort61_station_index
+from utilities.node_index import grid_node_index
 from utilities.utilities import utilities as utilities
 
 main_config = utilities.load_config()
@@ -55,6 +58,16 @@ def format_data_frames(df):
     df_out.set_index('TIME',inplace=True)
     return df_out
 
+def write_run_report(fetcher, fileroot, iometadata):
+    """
+    Write the per station telemetry/run report of a fetcher next to the CSV files. Never fatal
+    """
+    try:
+        reportf=utilities.writeJson(fetcher.run_report, rootdir=rootdir,subdir='',fileroot=fileroot,iometadata=iometadata)
+        utilities.log.info('Run report has been stored {}'.format(reportf))
+    except Exception as e:
+        utilities.log.error('Error: Failed to write run report {}'.format(e))
+
 # The hurricane methods are for the future
 def check_advisory(value):
     """
@@ -71,7 +84,7 @@ def check_advisory(value):
             state_hurricane=True
         except ValueError:
             utilities.log.error('Expected an Advisory value but could not convert to int {}'.format(value))
-            sys.exit(1)
+            raise
     utilities.log.info('URL state_hurricane is {}'.format(state_hurricane))
     return state_hurricane
 
@@ -92,6 +105,20 @@ def check_if_hurricane(urls):
             utilities.log.error('check_if_hurricane Uexpected failure try next:{}'.format(e))
     return state_hurricane
 
+def convert_input_url_to_ensemble(urls, ensemble):
+    """
+    The urls of another ensemble of the same cycle (ASGS layout: the ensemble is in position .split('/')[-2])
+    """
+    if not isinstance(urls, list):
+        utilities.log.error('ensemble: URLs must be in list form')
+        sys.exit(1)
+    newurls=list()
+    for url in urls:
+        urlwords=url.split('/')
+        urlwords[-2]=ensemble
+        newurls.append('/'.join(urlwords))
+    return newurls
+
 def convert_input_url_to_nowcast(urls):
     """
     Though one could call this method using a nowcast url, occasionally we want to be able to
@@ -102,14 +129,7 @@ def convert_input_url_to_nowcast(urls):
     To use this feature:
     We mandate that the url is used to access ASGS data. The "ensemble" information will be in position .split('/')[-2]
     """
-    if not isinstance(urls, list):
-        utilities.log.error('nowcast: URLs must be in list form')
-        sys.exit(1)
-    newurls=list()
-    for url in urls:
-        urlwords=url.split('/')
-        urlwords[-2]='nowcast'
-        newurls.append('/'.join(urlwords))
+    newurls=convert_input_url_to_ensemble(urls, 'nowcast')
     utilities.log.info('Modified input URL to be a nowcast type')
     return newurls
 
@@ -129,17 +149,21 @@ PRODUCT='water_level'
 ## Run stations
 ##
 
-def process_adcirc_stations(urls, adcirc_stations, gridname, ensemble, metadata, data_product='water_level', resample_mins=0, fort63_style=False):
+def process_adcirc_stations(urls, adcirc_stations, gridname, ensemble, metadata, data_product='water_level', resample_mins=0, fort63_style=False, max_workers=1, postprocess_workers=0, bulk_read=False, read_gap=1000, probe_workers=0, station_index=None, node_index=None, interpolate=False):
     # Fetch the data
     try:
         if data_product != 'water_level':
             utilities.log.error('ADCIRC data product can only be: water_level')
-            sys.exit(1)
-        adcirc = adcirc_fetch_data(adcirc_stations, urls, data_product, gridname=gridname, castType=ensemble.rstrip(), resample_mins=resample_mins, fort63_style=fort63_style)
-        df_adcirc_data = adcirc.aggregate_station_data()
-        df_adcirc_meta = adcirc.aggregate_station_metadata()
+            raise ValueError('ADCIRC data product can only be: water_level')
+        adcirc = adcirc_fetch_data(adcirc_stations, urls, data_product, gridname=gridname, castType=ensemble.rstrip(), resample_mins=resample_mins, fort63_style=fort63_style, bulk_read=bulk_read, read_gap=read_gap, probe_workers=probe_workers, station_index=station_index, node_index=node_index, interpolate=interpolate, max_workers=max_workers, postprocess_workers=postprocess_workers)
+        df_adcirc_data, df_adcirc_meta = adcirc.aggregate()
+        adcirc.close()
+        write_run_report(adcirc, 'adcirc_stationdata_report', metadata)
+        if df_adcirc_data.empty:
+            raise ValueError('No ADCIRC station data was found in {}'.format(urls))
     except Exception as e:
         utilities.log.error('Error: ADCIRC: {}'.format(e))
+        raise
     return df_adcirc_data, df_adcirc_meta 
 
 def first_true(iterable, default=False, pred=None):
@@ -263,12 +287,55 @@ def main(args):
         utilities.log.info('Requested conversion to Nowcast')
         urls = convert_input_url_to_nowcast(urls)
 
+    if data_source.upper()=='ASGS':
+        adcirc_stations, station_index, node_index = load_station_inputs(args)
+        try:
+            process_ensemble_urls(urls, args, adcirc_stations, station_index, node_index)
+        except Exception as e:
+            utilities.log.error('Error: ADCIRC: {}'.format(e))
+            sys.exit(1)
+
+    utilities.log.info('Finished with data source {}'.format(data_source))
+    utilities.log.info('Finished')
+
+def load_station_inputs(args):
+    """
+    Read the station list and open the station/node indexes selected by args. Done once per job and
+    shared by every ensemble
+
+    Return:
+        tuple (adcirc_stations, station_index, node_index)
+    """
+    station_index=None
+    node_index=None
+    # Use default station list
+    if args.fort63_style:
+        adcirc_stations=get_adcirc_stations_fort63_style()
+        if args.nearest_nodes or args.interpolate:
+            node_index=grid_node_index(args.node_index if args.node_index is not None else os.path.join(rootdir,'adcirc_node_index'))
+    else:
+        adcirc_stations=get_adcirc_stations_fort61_style()
+        if not args.no_station_index:
+            indexfile=args.station_index if args.station_index is not None else os.path.join(rootdir,'adcirc_station_index.json')
+            station_index=fort61_station_index(indexfile)
+        else:
+            station_index=fort61_station_index() # In memory, still shared by the ensembles
+    return adcirc_stations, station_index, node_index
+
+def process_ensemble_urls(urls, args, adcirc_stations, station_index=None, node_index=None):
+    """
+    Fetch the ADCIRC stations of the urls of one ensemble and write its data and metadata CSV files.
+    Failures raise (never sys.exit) so that main_ensembles() can report them per ensemble
+
+    Return:
+        tuple (data filename, metadata filename)
+    """
     data_product = args.data_product
     if data_product != 'water_level':
         utilities.log.error('ADCIRC: Only available data product is water_level: {}'.format(data_product))
-        sys.exit(1)
+        raise ValueError('ADCIRC: Only available data product is water_level: {}'.format(data_product))
     else:
-        utilities.log.info('Chosen data source {}'.format(data_source))
+        utilities.log.info('Chosen data source {}'.format(args.data_source))
 
     # Check if this is a Hurricane
     if not check_if_hurricane(urls):
@@ -284,6 +351,7 @@ def main(args):
 
     if args.fort63_style:
         utilities.log.info('Fort_63 style station inputs specified')
+        adcirc_stations=adcirc_stations.copy() # The station frame gets a NodeMinusOne column
 
     ensemble = strip_ensemble_from_url(urls)  # Only need to check on of them
     gridname = grab_gridname_from_url(urls)   # ditto
@@ -297,28 +365,51 @@ def main(args):
 
     # metadata are used to augment filename
     #ASGS
-    if data_source.upper()=='ASGS':
-        excludedStations=list()
-        # Use default station list
-        if args.fort63_style:
-            adcirc_stations=get_adcirc_stations_fort63_style()
-        else:
-            adcirc_stations=get_adcirc_stations_fort61_style()
+    adcirc_metadata='_'+ensemble+'_'+gridname.upper()+'_'+runtime.replace(' ','T')
+    data, meta = process_adcirc_stations(urls, adcirc_stations, gridname, ensemble, adcirc_metadata, data_product, resample_mins=0, fort63_style=args.fort63_style, max_workers=args.max_workers, postprocess_workers=args.postprocess_workers, bulk_read=args.bulk_read, read_gap=args.read_gap, probe_workers=args.probe_workers, station_index=station_index, node_index=node_index, interpolate=args.interpolate)
+    df_adcirc_data = format_data_frames(data)
+    # Output 
+    try:
+        dataf=utilities.writeCsv(df_adcirc_data, rootdir=rootdir,subdir='',fileroot='adcirc_stationdata',iometadata=adcirc_metadata)
+        metaf=utilities.writeCsv(meta, rootdir=rootdir,subdir='',fileroot='adcirc_stationdata_meta',iometadata=adcirc_metadata)
+        utilities.log.info('ADCIRC data has been stored {},{}'.format(dataf,metaf))
+    except Exception as e:
+        utilities.log.error('Error: ADCIRC: Failed Write {}'.format(e))
+        raise
+    return dataf, metaf
 
-        adcirc_metadata='_'+ensemble+'_'+gridname.upper()+'_'+runtime.replace(' ','T')
-        data, meta = process_adcirc_stations(urls, adcirc_stations, gridname, ensemble, adcirc_metadata, data_product, resample_mins=0, fort63_style=args.fort63_style)
-        df_adcirc_data = format_data_frames(data)
-        # Output 
-        try:
-            dataf=utilities.writeCsv(df_adcirc_data, rootdir=rootdir,subdir='',fileroot='adcirc_stationdata',iometadata=adcirc_metadata)
-            metaf=utilities.writeCsv(meta, rootdir=rootdir,subdir='',fileroot='adcirc_stationdata_meta',iometadata=adcirc_metadata)
-            utilities.log.info('ADCIRC data has been stored {},{}'.format(dataf,metaf))
-        except Exception as e:
-            utilities.log.error('Error: ADCIRC: Failed Write {}'.format(e))
-            sys.exit(1)
+def main_ensembles(args, ensembles):
+    """
+    Extract several ensembles (eg namforecast, nowcast) of the one cycle given by args.urls concurrently, one process
+    per ensemble (within a process the netCDF reads are serialized, see NETCDF_LOCK). The station list and the
+    station/node indexes are loaded once and passed to every process. Each ensemble writes the same CSV files
+    as a separate main() run would
 
-    utilities.log.info('Finished with data source {}'.format(data_source))
+    Return:
+        0 if every ensemble was written, 1 otherwise
+    """
+    urls = args.urls
+    if urls==None:
+        utilities.log.error('No URL was specified: Abort')
+        sys.exit(1)
+    if not isinstance(urls, list):
+        urls = [urls]
+    if args.data_source.upper() not in SOURCES:
+        utilities.log.error('Invalid data source {}'.format(args.data_source))
+        sys.exit(1)
+    adcirc_stations, station_index, node_index = load_station_inputs(args)
+    failed=0
+    with ProcessPoolExecutor(max_workers=len(ensembles)) as pool:
+        futures = {pool.submit(process_ensemble_urls, convert_input_url_to_ensemble(urls, ensemble), args, adcirc_stations, station_index, node_index): ensemble for ensemble in ensembles}
+        for future in as_completed(futures):
+            try:
+                future.result()
+                utilities.log.info('Ensemble {} has been stored'.format(futures[future]))
+            except Exception as e:
+                utilities.log.error('{} Fail. {}'.format(futures[future].upper(), e))
+                failed+=1
     utilities.log.info('Finished')
+    return 1 if failed > 0 else 0
 
 if __name__ == '__main__':
     from argparse import ArgumentParser
@@ -335,5 +426,25 @@ if __name__ == '__main__':
                         help='Attempts to force input URL into a nowcast url assuming normal ASGS conventions')
     parser.add_argument('--fort63_style', action='store_true', 
                         help='Boolean: Will inform Harvester to use fort.63.methods to get station nodesids')
+    parser.add_argument('--nearest_nodes', action='store_true',
+                        help='With --fort63_style use the nearest wet grid node of each station lon/lat instead of the Node column')
+    parser.add_argument('--interpolate', action='store_true',
+                        help='With --fort63_style interpolate each station lon/lat within its mesh element (barycentric weights) like the fort.61 values')
+    parser.add_argument('--node_index', action='store', dest='node_index', default=None, type=str,
+                        help='Directory of the persisted grid node indexes and element weights: default RDIR/adcirc_node_index')
+    parser.add_argument('--bulk_read', action='store_true',
+                        help='Read each url once (time and all of zeta, or with --fort63_style the station nodes as a few hyperslabs) and slice every station from it in memory')
+    parser.add_argument('--read_gap', action='store', dest='read_gap', default=1000, type=int,
+                        help='With --fort63_style --bulk_read: most unrequested nodes read to join two station nodes in one hyperslab: default 1000')
+    parser.add_argument('--probe_workers', action='store', dest='probe_workers', default=0, type=int,
+                        help='Check the urls concurrently (one .dds request each) with this many threads: default 0 (open each in turn)')
+    parser.add_argument('--station_index', action='store', dest='station_index', default=None, type=str,
+                        help='Index file of the fort.61 column of each station: default RDIR/adcirc_station_index.json')
+    parser.add_argument('--no_station_index', action='store_true',
+                        help='Decode the fort.61 station names of every url instead of using the station index file')
+    parser.add_argument('--max_workers', action='store', dest='max_workers', default=1, type=int,
+                        help='Number of stations to fetch concurrently: default 1 (serial)')
+    parser.add_argument('--postprocess_workers', action='store', dest='postprocess_workers', default=0, type=int,
+                        help='Number of processes used to interpolate/resample stations while fetching continues: default 0 (inline)')
     args = parser.parse_args()
     sys.exit(main(args))
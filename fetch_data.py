@@ -14,11 +14,14 @@
 #
 
 import os,sys
+import asyncio
 import pandas as pd
 import datetime as dt
 
-from fetch_station_data import noaanos_fetch_data, contrails_fetch_data
+from fetch_station_data import noaanos_fetch_data, contrails_fetch_data, spilled_station_data
+from station_pipeline import station_pipeline
 from utilities.utilities import utilities as utilities
+from utilities.negative_cache import negative_cache
 
 main_config = utilities.load_config()
 rootdir=utilities.fetchBasedir(main_config['DEFAULT']['RDIR'], basedirExtra='')
@@ -74,6 +77,48 @@ def format_data_frames(df) -> pd.DataFrame:
     df_out.set_index('TIME',inplace=True)
     return df_out
 
+def write_run_report(fetcher, fileroot, iometadata):
+    """
+    Write the per station telemetry/run report of a fetcher next to the CSV files. Never fatal
+    """
+    try:
+        reportf=utilities.writeJson(fetcher.run_report, rootdir=rootdir,subdir='',fileroot=fileroot,iometadata=iometadata)
+        utilities.log.info('Run report has been stored {}'.format(reportf))
+    except Exception as e:
+        utilities.log.error('Error: Failed to write run report {}'.format(e))
+
+def write_station_data(data, fileroot, iometadata):
+    """
+    Write aggregated station data in the Harvester default (melted) format.
+    A spilled_station_data (from aggregate_spilled) is streamed from its files one station at a time
+    and gives the same file as the in memory path
+    """
+    if isinstance(data, spilled_station_data):
+        dataf=utilities.getSubdirectoryFileName(rootdir, '', fileroot+iometadata+'.csv')
+        data.write_long(dataf, product=PRODUCT)
+        data.close()
+        return dataf
+    return utilities.writeCsv(format_data_frames(data), rootdir=rootdir,subdir='',fileroot=fileroot,iometadata=iometadata)
+
+def stream_stations(fetcher, fileroot, iometadata, clean_workers=1, queue_size=4):
+    """
+    Streaming alternative to the process_*_stations + format_data_frames + writeCsv sequence.
+    Stations go through the staged station_pipeline (fetch -> clean -> write, joined by bounded queues)
+    and each is appended to the long format csv as soon as it is cleaned, so peak memory
+    stays at a few stations of data. The metadata are restricted to the stations written
+
+    Return:
+        tuple (data filename, df_meta)
+    """
+    dataf=utilities.getSubdirectoryFileName(rootdir, '', fileroot+iometadata+'.csv')
+    stations=station_pipeline(fetcher, clean_workers=clean_workers, queue_size=queue_size).run(dataf, product=PRODUCT)
+    write_run_report(fetcher, fileroot+'_report', iometadata)
+    df_meta=fetcher.aggregate_station_metadata()
+    fetcher.close()
+    df_meta=df_meta.loc[df_meta.index.isin(stations)]
+    df_meta.index.name='STATION'
+    return dataf, df_meta
+
 ##
 ## End functions
 ##
@@ -91,31 +136,45 @@ PRODUCT='water_level'
 ##
 
 
-def process_noaa_stations(time_range, noaa_stations, metadata, interval=None, data_product='water_level', resample_mins=15 ):
+def process_noaa_stations(time_range, noaa_stations, metadata, interval=None, data_product='water_level', resample_mins=15, max_workers=1, async_fetch=False, postprocess_workers=0, negative_cache=None, resample_method='first', max_gap_mins=None, memory_budget=None, adaptive_concurrency=False, request_timeout=60, hedge=False, deadline_secs=None, retry_attempts=0, retry_budget_secs=300, max_in_flight=16 ):
     # Fetch the data
     try:
         if data_product != 'water_level' and data_product!='predictions' and data_product!='hourly_height':
             utilities.log.error('New NOAA data product can only be: water_level')
             sys.exit(1)
-        noaanos = noaanos_fetch_data(noaa_stations, time_range, data_product, interval=interval, resample_mins=resample_mins)
-        df_noaa_data = noaanos.aggregate_station_data()
-        df_noaa_meta = noaanos.aggregate_station_metadata()
+        noaanos = noaanos_fetch_data(noaa_stations, time_range, data_product, interval=interval, resample_mins=resample_mins, max_workers=max_workers, postprocess_workers=postprocess_workers, negative_cache=negative_cache, resample_method=resample_method, max_gap_mins=max_gap_mins, memory_budget=memory_budget, adaptive_concurrency=adaptive_concurrency, request_timeout=request_timeout, hedge=hedge, deadline_secs=deadline_secs, retry_attempts=retry_attempts, retry_budget_secs=retry_budget_secs)
+        if async_fetch:
+            df_noaa_data = asyncio.run(noaanos.aggregate_station_data_async(max_in_flight=max_in_flight))
+            df_noaa_meta = noaanos.aggregate_station_metadata()
+        elif memory_budget is not None:
+            df_noaa_data, df_noaa_meta = noaanos.aggregate_spilled()
+        else:
+            df_noaa_data, df_noaa_meta = noaanos.aggregate()
         df_noaa_meta.index.name='STATION'
+        noaanos.close()
+        write_run_report(noaanos, 'noaa_stationdata_report', metadata)
     except Exception as e:
         utilities.log.error('Error: NOAA: {}'.format(e))
     return df_noaa_data, df_noaa_meta
 
-def process_contrails_stations(time_range, contrails_stations, metadata, in_config, data_product='river_water_level', resample_mins=15 ):
+def process_contrails_stations(time_range, contrails_stations, metadata, in_config, data_product='river_water_level', resample_mins=15, max_workers=1, async_fetch=False, postprocess_workers=0, negative_cache=None, resample_method='first', max_gap_mins=None, memory_budget=None, adaptive_concurrency=False, request_timeout=60, hedge=False, deadline_secs=None, retry_attempts=0, retry_budget_secs=300, max_in_flight=16 ):
     # Fetch the data
     dproduct=['river_water_level','coastal_water_level']
     if data_product not in dproduct:
         utilities.log.error('Contrails data product can only be: {} was {}'.format(dproduct,data_product))
         sys.exit(1)
     try:
-        contrails = contrails_fetch_data(contrails_stations, time_range, in_config, product=data_product, owner='NCEM', resample_mins=resample_mins)
-        df_contrails_data = contrails.aggregate_station_data()
-        df_contrails_meta = contrails.aggregate_station_metadata()
+        contrails = contrails_fetch_data(contrails_stations, time_range, in_config, product=data_product, owner='NCEM', resample_mins=resample_mins, max_workers=max_workers, postprocess_workers=postprocess_workers, negative_cache=negative_cache, resample_method=resample_method, max_gap_mins=max_gap_mins, memory_budget=memory_budget, adaptive_concurrency=adaptive_concurrency, request_timeout=request_timeout, hedge=hedge, deadline_secs=deadline_secs, retry_attempts=retry_attempts, retry_budget_secs=retry_budget_secs)
+        if async_fetch:
+            df_contrails_data = asyncio.run(contrails.aggregate_station_data_async(max_in_flight=max_in_flight))
+            df_contrails_meta = contrails.aggregate_station_metadata()
+        elif memory_budget is not None:
+            df_contrails_data, df_contrails_meta = contrails.aggregate_spilled()
+        else:
+            df_contrails_data, df_contrails_meta = contrails.aggregate()
         df_contrails_meta.index.name='STATION'
+        contrails.close()
+        write_run_report(contrails, 'contrails_stationdata_report', metadata)
     except Exception as e:
         utilities.log.error('Error: CONTRAILS: {}'.format(e))
     return df_contrails_data, df_contrails_meta
@@ -154,19 +213,33 @@ def main(args):
 
     utilities.log.info('Selected time range is {} to {}, ndays is {}'.format(starttime,endtime,args.ndays))
 
+    # With --negative_cache, stations that keep returning nothing are skipped until their re-probe time
+    dead_stations=None
+    if args.negative_cache:
+        cachefile=args.negative_cache_file if args.negative_cache_file is not None else os.path.join(rootdir,'station_negative_cache.json')
+        dead_stations=negative_cache(cachefile, reprobe=args.reprobe)
+
     # metadata are used to augment filename
     #NOAA/NOS
     if data_source.upper()=='NOAA':
         excludedStations=list()
+        if args.hedge and (args.streaming or not args.async_fetch):
+            utilities.log.warn('NOAA: --hedge only applies with --async_fetch (noaa_coops issues its own requests): ignored')
         time_range=(starttime,endtime) # Can be directly used by NOAA 
         # Use default station list
         noaa_stations=get_noaa_stations()
         noaa_metadata='_'+endtime.replace(' ','T') # +'_'+starttime.replace(' ','T')
-        data, meta = process_noaa_stations(time_range, noaa_stations, noaa_metadata, data_product)
-        df_noaa_data = format_data_frames(data) # Melt the data :s Harvester default format
-        # Output
+        if args.streaming:
+            noaanos = noaanos_fetch_data(noaa_stations, time_range, data_product, max_workers=args.max_workers, postprocess_workers=args.postprocess_workers, negative_cache=dead_stations, resample_method=args.resample_method, max_gap_mins=args.max_gap_mins, adaptive_concurrency=args.adaptive_concurrency, request_timeout=args.request_timeout, hedge=args.hedge, deadline_secs=args.deadline_secs, retry_attempts=args.retry_attempts, retry_budget_secs=args.retry_budget_secs)
+            dataf, meta = stream_stations(noaanos, 'noaa_stationdata', noaa_metadata, clean_workers=max(1,args.postprocess_workers), queue_size=args.queue_size)
+            metaf=utilities.writeCsv(meta, rootdir=rootdir,subdir='',fileroot='noaa_stationdata_meta',iometadata=noaa_metadata)
+            utilities.log.info('NOAA data has been streamed {},{}'.format(dataf,metaf))
+            utilities.log.info('Finished')
+            return
+        data, meta = process_noaa_stations(time_range, noaa_stations, noaa_metadata, data_product, max_workers=args.max_workers, async_fetch=args.async_fetch, postprocess_workers=args.postprocess_workers, negative_cache=dead_stations, resample_method=args.resample_method, max_gap_mins=args.max_gap_mins, memory_budget=args.memory_budget, adaptive_concurrency=args.adaptive_concurrency, request_timeout=args.request_timeout, hedge=args.hedge, deadline_secs=args.deadline_secs, retry_attempts=args.retry_attempts, retry_budget_secs=args.retry_budget_secs, max_in_flight=args.max_in_flight)
+        # Output. Melt the data :s Harvester default format
         try:
-            dataf=utilities.writeCsv(df_noaa_data, rootdir=rootdir,subdir='',fileroot='noaa_stationdata',iometadata=noaa_metadata)
+            dataf=write_station_data(data, 'noaa_stationdata', noaa_metadata)
             metaf=utilities.writeCsv(meta, rootdir=rootdir,subdir='',fileroot='noaa_stationdata_meta',iometadata=noaa_metadata)
             utilities.log.info('NOAA data has been stored {},{}'.format(dataf,metaf))
         except Exception as e:
@@ -192,13 +265,19 @@ def main(args):
             # Get default station list
             contrails_stations=get_contrails_stations(fname)
             contrails_metadata=meta+'_'+endtime.replace(' ','T') # +'_'+starttime.replace(' ','T')
-            data, meta = process_contrails_stations(time_range, contrails_stations, contrails_metadata, contrails_config, data_product )
-            df_contrails_data = format_data_frames(data) # Melt: Harvester default format
+            if args.streaming:
+                contrails = contrails_fetch_data(contrails_stations, time_range, contrails_config, product=data_product, owner='NCEM', max_workers=args.max_workers, postprocess_workers=args.postprocess_workers, negative_cache=dead_stations, resample_method=args.resample_method, max_gap_mins=args.max_gap_mins, adaptive_concurrency=args.adaptive_concurrency, request_timeout=args.request_timeout, hedge=args.hedge, deadline_secs=args.deadline_secs, retry_attempts=args.retry_attempts, retry_budget_secs=args.retry_budget_secs)
+                dataf, meta = stream_stations(contrails, 'contrails_stationdata', contrails_metadata, clean_workers=max(1,args.postprocess_workers), queue_size=args.queue_size)
+                metaf=utilities.writeCsv(meta, rootdir=rootdir,subdir='',fileroot='contrails_stationdata_meta',iometadata=contrails_metadata)
+                utilities.log.info('CONTRAILS data has been streamed {},{}'.format(dataf,metaf))
+                utilities.log.info('Finished')
+                return
+            data, meta = process_contrails_stations(time_range, contrails_stations, contrails_metadata, contrails_config, data_product, max_workers=args.max_workers, async_fetch=args.async_fetch, postprocess_workers=args.postprocess_workers, negative_cache=dead_stations, resample_method=args.resample_method, max_gap_mins=args.max_gap_mins, memory_budget=args.memory_budget, adaptive_concurrency=args.adaptive_concurrency, request_timeout=args.request_timeout, hedge=args.hedge, deadline_secs=args.deadline_secs, retry_attempts=args.retry_attempts, retry_budget_secs=args.retry_budget_secs, max_in_flight=args.max_in_flight )
         except Exception as ex:
             utilities.log.error('CONTRAILS error {}, {}'.format(template.format(type(ex).__name__, ex.args)))
             sys.exit(1)
         try:
-            dataf=utilities.writeCsv(df_contrails_data, rootdir=rootdir,subdir='',fileroot='contrails_stationdata',iometadata=contrails_metadata)
+            dataf=write_station_data(data, 'contrails_stationdata', contrails_metadata) # Melt: Harvester default format
             metaf=utilities.writeCsv(meta, rootdir=rootdir,subdir='',fileroot='contrails_stationdata_meta',iometadata=contrails_metadata)
             utilities.log.info('NOAA data has been stored {},{}'.format(dataf,metaf))
         except Exception as e:
@@ -221,6 +300,42 @@ if __name__ == '__main__':
                         help='choose supported data source (case independant) eg NOAA or CONTRAILS')
     parser.add_argument('--data_product', action='store', dest='data_product', default=None, type=str,
                         help='choose supported data product eg river_water_level: Only required for Contrails')
+    parser.add_argument('--max_workers', action='store', dest='max_workers', default=1, type=int,
+                        help='Number of stations to fetch concurrently: default 1 (serial)')
+    parser.add_argument('--adaptive_concurrency', action='store_true',
+                        help='Adapt the number of requests in flight (up to --max_workers) to the server latency and 429/5xx errors')
+    parser.add_argument('--request_timeout', action='store', dest='request_timeout', default=60, type=float,
+                        help='Seconds before a single http request is abandoned: default 60')
+    parser.add_argument('--hedge', action='store_true',
+                        help='Duplicate requests still outstanding after the p95 latency and keep the first answer. NOAA: only with --async_fetch')
+    parser.add_argument('--deadline_secs', action='store', dest='deadline_secs', default=None, type=float,
+                        help='Wall clock budget (secs) of the data and of the metadata fetch. Stations not started in time are excluded: default unlimited')
+    parser.add_argument('--retry_attempts', action='store', dest='retry_attempts', default=0, type=int,
+                        help='Rounds of re-fetching the stations that failed, once every station has been tried: default 0 (none)')
+    parser.add_argument('--retry_budget_secs', action='store', dest='retry_budget_secs', default=300, type=float,
+                        help='Wall clock budget of all the retry rounds: default 300')
+    parser.add_argument('--async_fetch', action='store_true',
+                        help='Use the asyncio harvest engine. See --max_in_flight')
+    parser.add_argument('--max_in_flight', action='store', dest='max_in_flight', default=16, type=int,
+                        help='With --async_fetch, the max number of requests outstanding at any time: default 16')
+    parser.add_argument('--postprocess_workers', action='store', dest='postprocess_workers', default=0, type=int,
+                        help='Number of processes used to interpolate/resample stations while fetching continues: default 0 (inline)')
+    parser.add_argument('--resample_method', action='store', dest='resample_method', default='first', type=str,
+                        help='How each 15min bin is reduced: first (default), mean, median, max, min or nearest (to the bin center)')
+    parser.add_argument('--max_gap_mins', action='store', dest='max_gap_mins', default=None, type=int,
+                        help='Linearly interpolate gaps of at most this many minutes. Default fills a single missing sample per gap')
+    parser.add_argument('--memory_budget', action='store', dest='memory_budget', default=None, type=float,
+                        help='MB of station data to hold in memory. Beyond it stations spill to local disk: default unlimited')
+    parser.add_argument('--negative_cache', action='store_true',
+                        help='Skip the stations that recently returned no data and record the failures of this run: default off')
+    parser.add_argument('--negative_cache_file', action='store', dest='negative_cache_file', default=None, type=str,
+                        help='With --negative_cache, the cache file: default RDIR/station_negative_cache.json')
+    parser.add_argument('--reprobe', action='store_true',
+                        help='With --negative_cache, request every station, including those in the cache, and refresh the cache')
+    parser.add_argument('--streaming', action='store_true',
+                        help='Append each station to the output csv as it is fetched instead of aggregating all stations in memory')
+    parser.add_argument('--queue_size', action='store', dest='queue_size', default=4, type=int,
+                        help='With --streaming, the number of stations each pipeline stage may queue for the next: default 4')
 
     args = parser.parse_args()
     sys.exit(main(args))
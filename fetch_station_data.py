@@ -14,12 +14,26 @@
 # Note the df_meta method can be a little tricky to implement a proper format. 
 #
 import os,sys
+import json
 import numpy as np
 import pandas as pd
 import xarray as xr
 import datetime as dt
-from utilities.utilities import utilities
+from utilities.utilities import utilities, GLOBAL_FILL_VALUE
+from utilities.aimd_limiter import aimd_limiter
+from utilities.station_index import fort61_station_index
+from utilities.node_index import grid_node_index
 import math
+import shutil
+import tempfile
+import weakref
+import hashlib
+import time as tm
+import threading
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future, wait, as_completed, FIRST_COMPLETED
+from collections import deque
+from contextlib import contextmanager, asynccontextmanager
 
 
 
@@ -27,6 +41,7 @@ import math
 import urllib
 import urllib.parse
 import requests
+import aiohttp
 from requests.exceptions import ConnectionError
 from requests.exceptions import Timeout
 from requests.exceptions import HTTPError
@@ -46,27 +61,42 @@ from collections import OrderedDict
 
 GLOBAL_TIMEZONE='gmt' # Every source is set or presumed to return times in the zone
 
-GLOBAL_FILL_VALUE='-99999'
 UNITS='meters' # Now the code only applies to WL
 
+##
+## Aggregated frames keep numeric nans in memory (float64). The GLOBAL_FILL_VALUE sentinel is only
+## applied when the frames are written (utilities.writeCsv(na_rep=GLOBAL_FILL_VALUE)). Filling in memory
+## with the string sentinel turns every column into object dtype and slows melt/to_csv considerably.
+##
+
 def replace_and_fill(df):
     """
     Replace all Nans ans 'None" valuesa with GLOBAL_FILL_VALUE
+    No longer called by the aggregation methods. Retained for callers that need a filled frame in memory
     """
     df=df.fillna(GLOBAL_FILL_VALUE)
     return df
 
-def stations_resample(df, sample_mins=None)->pd.DataFrame:
+RESAMPLE_METHODS=['first','mean','median','max','min','nearest']
+
+def stations_resample(df, sample_mins=None, method='first')->pd.DataFrame:
     """
     Resample (all stations) on a 15min (or other) basis
 
     NOTE: Final aggregated data still have flanked nans for some stations because
     The reported times might have been different. 
 
+    The bins are those of df.groupby(pd.Grouper(freq=)) (left closed/labeled, origin at midnight of the first day,
+    empty bins included) but every station is reduced at once: a single bin index is computed from the times
+    and the wide (times x stations) matrix is reduced in a few vectorized numpy calls. nans are ignored by
+    every method and a bin without valid data is nan
+
     Input:
         df: A time series x stations data frame
         sample_min. (Dafaut=15mins) A numerical value for th enumber of mins to resample
             setting to 0 disables any resampling and returns the raw data
+        method: (str) The per bin reduction. One of RESAMPLE_METHODS. 'first' (default) is the
+            first valid value, 'nearest' the valid value closest to the bin center (earlier wins ties)
 
     Output:
         df_out. New time series every 15mins x stations
@@ -74,28 +104,386 @@ def stations_resample(df, sample_mins=None)->pd.DataFrame:
     if sample_mins==0:
         utilities.log.info('resample freq set to 0. return all')
         return df
+    if method not in RESAMPLE_METHODS:
+        raise ValueError('Resample method must be one of {}: got {}'.format(RESAMPLE_METHODS, method))
     timesample='15min'
     if sample_mins is not None:
         timesample=f'{sample_mins}min'
-    utilities.log.info('Resampling freq set to {}'.format(timesample))
-    dx=df.groupby(pd.Grouper(freq=timesample)).first().reset_index()
-    return dx.set_index('TIME')
-
-def stations_interpolate(df)->pd.DataFrame:
+    utilities.log.info('Resampling freq set to {} using {}'.format(timesample, method))
+    if len(df)==0:
+        return df.groupby(pd.Grouper(freq=timesample)).first()
+    freq = int(pd.Timedelta(timesample).total_seconds()*1e9)
+    origin = df.index.min().normalize()
+    offsets = df.index.values.astype('datetime64[ns]').view(np.int64) - origin.to_datetime64().astype('datetime64[ns]').astype(np.int64)
+    bins = offsets//freq
+    values = df.to_numpy(dtype=float)
+    if method=='nearest':
+        # Within each bin order the rows by their distance to the bin center (then time), and take the first valid
+        order = np.lexsort((offsets, np.abs(offsets - (bins*freq + freq//2)), bins))
+        bins, values = bins[order], values[order]
+    elif np.any(offsets[1:] < offsets[:-1]):
+        order = np.argsort(offsets, kind='stable') # As groupby(pd.Grouper) the rows are first sorted by time
+        bins, values = bins[order], values[order]
+    # Lay the rows out as bins x slot x stations (slot is the position of a row within its bin) so every
+    # reduction is a single numpy call along the (short) slot axis. Empty bins/slots are nan
+    starts = np.flatnonzero(np.r_[True, bins[1:]!=bins[:-1]])
+    slots = np.arange(len(bins)) - np.repeat(starts, np.diff(np.r_[starts, len(bins)]))
+    padded = np.empty((bins[-1]-bins[0]+1, slots.max()+1, values.shape[1]))
+    padded[bins-bins[0], slots] = values
+    occupied = np.zeros(padded.shape[:2], dtype=bool)
+    occupied[bins-bins[0], slots] = True
+    padded[~occupied] = np.nan
+    if method in ('first', 'nearest'):
+        data = padded[:,0].copy()
+        for slot in range(1, padded.shape[1]):
+            np.copyto(data, padded[:,slot], where=np.isnan(data))
+    elif method=='mean':
+        valid = ~np.isnan(padded)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            data = np.where(valid, padded, 0.0).sum(axis=1)/valid.sum(axis=1)
+    elif method=='max':
+        data = np.fmax.reduce(padded, axis=1)
+    elif method=='min':
+        data = np.fmin.reduce(padded, axis=1)
+    else: # median. Sorting puts the nans last
+        counts = (~np.isnan(padded)).sum(axis=1)
+        padded.sort(axis=1)
+        lower = np.take_along_axis(padded, (np.maximum(counts-1, 0)//2)[:,None,:], axis=1)[:,0,:]
+        upper = np.take_along_axis(padded, (counts//2)[:,None,:], axis=1)[:,0,:]
+        data = (lower+upper)/2.0
+    index = pd.DatetimeIndex(origin + pd.to_timedelta(np.arange(bins[0], bins[-1]+1)*freq, unit='ns'), name=df.index.name).astype(df.index.dtype)
+    return pd.DataFrame(data, index=index, columns=df.columns)
+
+def stations_interpolate(df, max_gap=None)->pd.DataFrame:
     """
 
     NOTE: Final aggregated data still have flanked nans for some stations because
     The reported times might have been different. 
 
+    With max_gap=None (default) the historical scipy path is used: a first order polynomial
+    that fills at most one missing sample per gap, whatever the sampling interval.
+    Otherwise every gap whose bracketing valid samples are at most max_gap apart (in time) is
+    filled by linear interpolation in time. Longer gaps, and leading/trailing nans, are left alone.
+    The filler is vectorized over the whole (times x stations) matrix.
+
     Input:
         df: A time series x stations data frame
+        max_gap: A duration (pd.Timedelta or a string such as '1h') or None
 
     Output:
         df_out. New time series every 15mins x stations
     """
     utilities.log.info('Interpolating station data' )
-    df.interpolate(method='polynomial', order=1, limit=1, inplace=True)
-    return df
+    if max_gap is None:
+        df.interpolate(method='polynomial', order=1, limit=1, inplace=True)
+        return df
+    # Work on the stations x times layout (the block layout of stations_aggregate, so usually no copy)
+    # flattened, and only touch the missing cells: each is bracketed by its neighbours in the sorted list of valid cells
+    values = np.ascontiguousarray(df.to_numpy(dtype=float).T).ravel()
+    ntimes = len(df.index)
+    missing = np.flatnonzero(np.isnan(values))
+    present = np.flatnonzero(~np.isnan(values))
+    if len(missing)==0 or len(present)==0:
+        return df
+    times = df.index.values.astype('datetime64[ns]').view(np.int64)
+    times = (times - times[0]).astype(float)
+    k = np.searchsorted(present, missing)
+    before = present[np.maximum(k-1, 0)]
+    after = present[np.minimum(k, len(present)-1)]
+    # Both neighbours must exist and belong to the same station
+    fill = (k > 0) & (k < len(present)) & (before//ntimes == missing//ntimes) & (after//ntimes == missing//ntimes)
+    t0, t1 = times[before % ntimes], times[after % ntimes]
+    fill &= (t1-t0) <= pd.Timedelta(max_gap).total_seconds()*1e9
+    missing, before, after, t0, t1 = missing[fill], before[fill], after[fill], t0[fill], t1[fill]
+    values = values.copy()
+    values[missing] = values[before] + (values[after]-values[before])*(times[missing % ntimes]-t0)/(t1-t0)
+    return pd.DataFrame(values.reshape(-1, ntimes).T, index=df.index, columns=df.columns)
+
+def stations_postprocess(df, sample_mins=None, method='first', max_gap=None)->pd.DataFrame:
+    """
+    The per station clean up: interpolate then resample. A module level function so it
+    can be shipped to a process pool (see fetch_station_data(postprocess_workers=))
+
+    Input:
+        df: A time series x station data frame
+        sample_mins: Passed to stations_resample
+        method: Passed to stations_resample
+        max_gap: Passed to stations_interpolate
+
+    Output:
+        df_out. The interpolated and resampled data frame
+    """
+    return stations_resample(stations_interpolate(df, max_gap=max_gap), sample_mins=sample_mins, method=method)
+
+def chain_future(future, func) -> Future:
+    """
+    Return a Future of func(future.result()). func runs (in the thread that completes future) as soon as
+    future is done. An exception of either is set on the returned Future
+    """
+    chained = Future()
+    def done(finished):
+        try:
+            chained.set_result(func(finished.result()))
+        except Exception as ex:
+            chained.set_exception(ex)
+    future.add_done_callback(done)
+    return chained
+
+def stations_aggregate(frames)->pd.DataFrame:
+    """
+    Combine a list of per station dataframes, each on its own time index, into a single
+    time series x stations dataframe. Equivalent to pd.concat(frames, axis=1) followed by
+    dropping duplicated times (keep first), but the union time grid is computed once and
+    a single stations x times float array is preallocated and filled using searchsorted.
+    This avoids the repeated outer-join index alignment done by concat.
+
+    Duplicate times within a station are resolved by keeping the first value.
+
+    Input:
+        frames: A list of dataframes (TIME vs one or more station columns)
+
+    Output:
+        df_out. Time series (union of all input times, sorted) x stations, float64 with nans
+    """
+    if len(frames)==0:
+        raise ValueError('No objects to aggregate')
+    columns=list()
+    station_grids=list() # Per column, a pointer into distinct_times
+    station_values=list()
+    distinct_times=list() # Stations very often share a time grid (eg after resampling). Only keep one copy of each
+    grid_lookup=dict() # (length,first,last) -> candidate distinct_times entries
+    duplicates=False
+    for df in frames:
+        keep = ~df.index.duplicated(keep='first')
+        if not keep.all():
+            duplicates=True
+            df = df.loc[keep]
+        times = df.index.values
+        key = (len(times), times[0], times[-1]) if len(times) > 0 else (0,)
+        grid = next((i for i in grid_lookup.get(key, []) if np.array_equal(distinct_times[i], times)), None)
+        if grid is None:
+            grid = len(distinct_times)
+            distinct_times.append(times)
+            grid_lookup.setdefault(key, []).append(grid)
+        values = df.to_numpy(dtype=float)
+        for position in range(df.shape[1]):
+            columns.append(df.columns[position])
+            station_grids.append(grid)
+            station_values.append(values[:,position])
+    if duplicates:
+        utilities.log.info("Duplicated data times found . will keep first value(s) only")
+    times = np.unique(np.concatenate(distinct_times))
+    positions = [np.searchsorted(times, t) for t in distinct_times]
+    data = np.full((len(columns), len(times)), np.nan) # The only large allocation
+    for row, (grid, values) in enumerate(zip(station_grids, station_values)):
+        data[row, positions[grid]] = values
+    index = pd.Index(times, name=frames[0].index.name)
+    tz = getattr(frames[0].index, 'tz', None)
+    if tz is not None:
+        index = index.tz_localize('UTC').tz_convert(tz)
+    return pd.DataFrame(data.T, index=index, columns=columns)
+
+class spilled_station_data(object):
+    """
+    Accumulates per station frames for stations_aggregate while keeping them under a memory budget.
+    Once the frames held in memory exceed budget_mb they are all spilled, one pair of columnar .npy files
+    (times, values) per frame, to a temporary directory on local disk, as are all later frames.
+
+    The aggregate can then be streamed from disk one station column at a time (iter_columns, write_long)
+    so the full times x stations matrix is never built. write_long() produces the same file as
+    format_data_frames()+utilities.writeCsv() on the in memory aggregate and to_frame() the same dataframe
+    as stations_aggregate(). The temporary files are removed by close() or when the object is garbage collected
+
+    Input:
+        budget_mb: (float) Memory allowed for the frames held in memory
+        spill_dir: (str) Parent of the temporary directory. Default is the system temporary directory
+    """
+    def __init__(self, budget_mb, spill_dir=None):
+        self._budget=budget_mb*1024*1024
+        self._spill_dir=spill_dir
+        self._frames=list() # Either a dataframe or a dict describing the files of a spilled one
+        self._nbytes=0
+        self._tmpdir=None
+
+    @property
+    def spilled(self) -> bool:
+        return self._tmpdir is not None
+
+    def __len__(self):
+        return len(self._frames)
+
+    def append(self, df):
+        if self.spilled:
+            self._frames.append(self._spill(df, len(self._frames)))
+            return
+        self._frames.append(df)
+        self._nbytes += int(df.memory_usage(index=True, deep=False).sum())
+        if self._nbytes > self._budget:
+            self._tmpdir = tempfile.mkdtemp(prefix='harvester_spill_', dir=self._spill_dir)
+            self._cleanup = weakref.finalize(self, shutil.rmtree, self._tmpdir, True)
+            utilities.log.info('Memory budget of {:.1f} MB exceeded by {} stations: spilling to {}'.format(self._budget/1024/1024, len(self._frames), self._tmpdir))
+            self._frames = [self._spill(frame, i) for i,frame in enumerate(self._frames)]
+            self._nbytes = 0
+
+    def _spill(self, df, number) -> dict:
+        root = os.path.join(self._tmpdir, '{:06d}'.format(number))
+        np.save(root+'_times.npy', df.index.values)
+        np.save(root+'_values.npy', df.to_numpy(dtype=float))
+        return {'root': root, 'columns': list(df.columns), 'name': df.index.name, 'tz': getattr(df.index, 'tz', None)}
+
+    def _load(self, frame) -> pd.DataFrame:
+        if isinstance(frame, pd.DataFrame):
+            return frame
+        index = pd.Index(np.load(frame['root']+'_times.npy'), name=frame['name'])
+        if frame['tz'] is not None:
+            index = index.tz_localize('UTC').tz_convert(frame['tz'])
+        return pd.DataFrame(np.load(frame['root']+'_values.npy'), index=index, columns=frame['columns'])
+
+    def reorder(self, order):
+        """
+        Put the accumulated frames in the given order (a permutation of range(len(self))). Nothing is loaded
+        """
+        self._frames = [self._frames[number] for number in order]
+
+    def frames(self):
+        """
+        Generator of the accumulated frames, loading spilled ones one at a time
+        """
+        for frame in self._frames:
+            yield self._load(frame)
+
+    def index(self) -> pd.Index:
+        """
+        The union time grid of stations_aggregate, built without holding more than one frame
+        """
+        if len(self._frames)==0:
+            raise ValueError('No objects to aggregate')
+        times = None
+        for df in self.frames():
+            if times is None:
+                first, times = df, np.unique(df.index.values)
+            else:
+                times = np.union1d(times, df.index.values)
+        index = pd.Index(times, name=first.index.name)
+        tz = getattr(first.index, 'tz', None)
+        if tz is not None:
+            index = index.tz_localize('UTC').tz_convert(tz)
+        return index
+
+    def iter_columns(self, index=None):
+        """
+        Generator of (station, column values on the union time grid), in station order
+        """
+        times = (self.index() if index is None else index).values
+        for df in self.frames():
+            df = df.loc[~df.index.duplicated(keep='first')]
+            positions = np.searchsorted(times, df.index.values)
+            values = df.to_numpy(dtype=float)
+            for position in range(df.shape[1]):
+                column = np.full(len(times), np.nan)
+                column[positions] = values[:,position]
+                yield df.columns[position], column
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        Build the in memory aggregate. Identical to stations_aggregate() over the same frames
+        """
+        return stations_aggregate(list(self.frames()))
+
+    def write_long(self, filename, product='WATER_LEVEL', na_rep=GLOBAL_FILL_VALUE) -> str:
+        """
+        Stream the aggregate to a csv in the long (melted) Harvester format TIME,STATION,<product>
+        one station column at a time
+        """
+        index = self.index()
+        timestr = pd.Index(index.strftime('%Y-%m-%dT%H:%M:%S'), name='TIME')
+        with open(filename, 'w') as fp:
+            for number, (station, column) in enumerate(self.iter_columns(index)):
+                df_out = pd.DataFrame({'STATION': station, product.upper(): column}, index=timestr)
+                df_out.to_csv(fp, header=number==0, na_rep=na_rep)
+        utilities.log.info('Streamed spilled aggregate of {} stations to {}'.format(len(self._frames), filename))
+        return filename
+
+    def close(self):
+        if self.spilled:
+            self._cleanup()
+
+##
+## Adaptive concurrency. One aimd_limiter per source is shared by every fetcher instance in the process,
+## so consecutive products from the same server start from what was learned about it
+##
+SOURCE_LIMITERS=dict()
+SOURCE_LIMITERS_LOCK=threading.Lock()
+
+def source_limiter(source, max_limit, **kwargs) -> aimd_limiter:
+    """
+    Return (creating as needed) the aimd_limiter of a source, with its ceiling set to max_limit
+    kwargs are passed to the aimd_limiter when it is created
+    """
+    with SOURCE_LIMITERS_LOCK:
+        if source not in SOURCE_LIMITERS:
+            SOURCE_LIMITERS[source]=aimd_limiter(source, max_limit, **kwargs)
+        limiter=SOURCE_LIMITERS[source]
+    limiter.start_run(max_limit)
+    return limiter
+
+def congestion_reason(ex) -> str:
+    """
+    Return why an exception raised by a request signals an overloaded server, or None if it does not
+    (eg. a 404 or an empty station is not congestion)
+    """
+    status = getattr(ex, 'status', None) # aiohttp
+    if status is None and getattr(ex, 'response', None) is not None:
+        status = getattr(ex.response, 'status_code', None) # requests
+    if status is not None:
+        return 'http {}'.format(status) if status==429 or status>=500 else None
+    if isinstance(ex, (Timeout, asyncio.TimeoutError)):
+        return 'timeout'
+    if isinstance(ex, (ConnectionError, aiohttp.ClientConnectionError)):
+        return 'connection error'
+    return None
+
+class StationSkipped(Exception):
+    """
+    Raised in place of fetching a station that the negative cache lists as recently dead
+    """
+    pass
+
+class DeadlineExceeded(StationSkipped):
+    """
+    Raised in place of fetching a station once the wall clock budget of the run is spent.
+    Not a station failure, so it is never recorded in the negative cache
+    """
+    pass
+
+def write_station_frames(frames, filename, product='WATER_LEVEL', na_rep=GLOBAL_FILL_VALUE) -> list():
+    """
+    Append a stream of per station frames to a single csv in the long (melted) Harvester format
+    TIME,STATION,<product>. The header is written with the first frame and the file is
+    truncated first, so only one station's data is ever held by the writer.
+
+    Unlike melting an aggregated frame, each station only contributes rows for its own times
+    (no union time grid padded with na_rep) and stations appear in the order they are yielded.
+
+    Input:
+        frames: iterable of tuples (station, frame) eg fetch_station_data.iter_station_frames()
+        filename: (str) full path of the output csv
+        product: (str) name of the value column
+        na_rep: (str) written for nans (default GLOBAL_FILL_VALUE)
+
+    Return:
+        list of the stations written
+    """
+    stations=list()
+    with open(filename, 'w') as fp:
+        for station, df in frames:
+            df_out = pd.DataFrame({'STATION': str(station), product.upper(): df.iloc[:,0].to_numpy()},
+                                  index=pd.Index(df.index.strftime('%Y-%m-%dT%H:%M:%S'), name='TIME'))
+            df_out.to_csv(fp, header=len(stations)==0, na_rep=na_rep)
+            fp.flush()
+            stations.append(station)
+    utilities.log.info('Streamed {} stations to {}'.format(len(stations), filename))
+    return stations
 
 class fetch_station_data(object):
     """
@@ -105,34 +493,667 @@ class fetch_station_data(object):
 
    Default return products wil be on the sampling_mins frequency
     """
-    def __init__(self, stations, periods, resample_mins=15):
+    def __init__(self, stations, periods, resample_mins=15, max_workers=1, postprocess_workers=0, negative_cache=None, resample_method='first', max_gap_mins=None, memory_budget=None, adaptive_concurrency=False, request_timeout=60, hedge=False, deadline_secs=None, retry_attempts=0, retry_budget_secs=300):
         """
         stations:  A list of stations (str) or tuples of (station,adcirc node) (str,int) 
         periods: A list of tuples. [(time1,time2)]
+        max_workers: (int) Number of stations fetched concurrently. 1 (default) fetches serially
+        postprocess_workers: (int) Number of processes used to interpolate/resample the fetched stations.
+            0 (default) does the work inline on the fetching thread
+        negative_cache: A utilities.negative_cache.negative_cache. Stations it lists as dead are not requested
+            and the outcome of every data aggregation is recorded in it. None (default) disables
+        resample_method: (str) How each resampling bin is reduced. One of RESAMPLE_METHODS, default first
+        max_gap_mins: (int) Fill gaps of at most this many minutes by linear interpolation in time.
+            None (default) keeps the historical fill of a single missing sample per gap
+        memory_budget: (float) MB of station frames aggregate_station_data_spilled()/aggregate_spilled() hold in memory.
+            Beyond it the frames spill to local disk. None (default) is unlimited
+        adaptive_concurrency: (bool) Let the source's aimd_limiter decide how many of the max_workers (or async
+            max_in_flight) requests may be in flight, backing off on 429/5xx, timeouts and rising latency
+        request_timeout: (float) Seconds before a single http request is abandoned. None waits forever
+        hedge: (bool) If a request has not returned within the p95 latency of this source, issue a duplicate
+            and keep whichever answers first
+        deadline_secs: (float) Wall clock budget of each aggregate_* call. Stations not started when it runs out
+            are excluded (DeadlineExceeded) and request timeouts are clipped to what is left. None (default) is unlimited
+        retry_attempts: (int) Rounds of re-fetching the stations that failed, run once every station has been tried.
+            0 (default) disables
+        retry_budget_secs: (float) Wall clock budget of all the retry rounds of a data aggregation
         """
         self._stations=stations
         self._periods=periods
         self._resampling_mins=resample_mins
+        self._resample_method=resample_method
+        self._max_gap=pd.Timedelta(minutes=max_gap_mins) if max_gap_mins is not None else None
+        self._memory_budget=memory_budget
+        self._max_workers=max_workers if max_workers is not None else 1
+        self._postprocess_workers=postprocess_workers if postprocess_workers is not None else 0
+        self._postprocess_pool=None
+        self._negative_cache=negative_cache
+        self._adaptive_concurrency=adaptive_concurrency
+        self._limiter=None
+        self._request_timeout_secs=request_timeout
+        self._hedge=hedge
+        self._latencies=deque(maxlen=self.HEDGE_WINDOW)
+        self._hedged=0
+        self._hedge_wins=0
+        self._hedge_pool=None
+        self._hedge_pool_lock=threading.Lock()
+        self._deadline_secs=deadline_secs
+        self._deadline=None
+        self._retry_attempts=retry_attempts if retry_attempts is not None else 0
+        self._retry_budget_secs=retry_budget_secs
+        self._telemetry=dict()
+        self._telemetry_lock=threading.Lock()
+        self._phase='data'
+        self._run_started=tm.time()
+        self.run_report=None
+
+##
+## Harvest telemetry. Every station gets a record of its request latency, bytes received, rows
+## returned, rows after dedup/resample and exception class (if any). At the end of each data aggregation
+## a run report (summary + per station records) is built. It is available as self.run_report and
+## station_telemetry() and can be written next to the CSVs with utilities.writeJson()
+## The metadata pass keeps its own records (phase 'metadata') so it never alters those of the data run
+##
+    source='UNKNOWN' # Overwritten by the subclasses eg NOAA, CONTRAILS, ADCIRC
+
+    def _start_run(self):
+        """
+        Reset the telemetry at the start of a data aggregation
+        """
+        with self._telemetry_lock:
+            self._telemetry=dict()
+        self._phase='data'
+        self._run_started=tm.time()
+        self.run_report=None
+        self._hedged=0
+        self._hedge_wins=0
+        self._start_deadline()
+        if self._adaptive_concurrency:
+            self._limiter=source_limiter(self.source, self._max_workers)
+
+    def _station_telemetry(self, station, phase=None) -> dict:
+        """
+        Return (creating as needed) the telemetry record for a station in phase ('data' or 'metadata').
+        Default is the phase currently running
+        """
+        phase = self._phase if phase is None else phase
+        with self._telemetry_lock:
+            if (phase, station) not in self._telemetry:
+                station_id = station[0] if isinstance(station, tuple) else station
+                self._telemetry[(phase, station)] = {'station': str(station_id), 'phase': phase, 'requests': 0, 'latency_secs': 0.0, 'bytes': 0,
+                                                     'rows_returned': 0, 'rows_processed': 0, 'elapsed_secs': 0.0, 'exception': None, 'retries': 0}
+            return self._telemetry[(phase, station)]
+
+    def _record_request(self, station, started, nbytes=None):
+        """
+        Accumulate a single request into the station telemetry
+
+        Input:
+            station: The station (as passed to fetch_single_product)
+            started: (float) tm.time() value taken just before the request was issued
+            nbytes: (int) Number of bytes received. None if unknown (eg. requests made inside noaa_coops)
+        """
+        latency = tm.time()-started
+        record = self._station_telemetry(station)
+        with self._telemetry_lock:
+            self._latencies.append(latency)
+            record['requests'] += 1
+            record['latency_secs'] += latency
+            if nbytes is not None:
+                record['bytes'] += nbytes
+
+    def _run_station(self, func, station):
+        """
+        Call func(station) recording the elapsed time and the exception class (if any) in the station telemetry
+        Stations listed in the negative cache raise StationSkipped without calling func
+        """
+        record = self._station_telemetry(station)
+        started = tm.time()
+        try:
+            self._check_negative_cache(station)
+            self._check_deadline(station)
+            return func(station)
+        except Exception as ex:
+            if record['exception'] is None:
+                record['exception'] = type(ex).__name__
+            raise
+        finally:
+            with self._telemetry_lock:
+                record['elapsed_secs'] += tm.time()-started
+
+##
+## Tail latency. Every http request has a timeout, clipped to what is left of the optional wall clock
+## budget of the aggregate_* call. With hedging, a request still outstanding after the p95 latency of the
+## source (over the last HEDGE_WINDOW requests) is duplicated and the first answer wins. A hedge shares
+## the request slot of the original and is counted in the run report, as are the hedges that won
+##
+    HEDGE_WINDOW=200 # Number of recent request latencies the p95 is taken over
+    HEDGE_MIN_SAMPLES=20 # No hedging until this many requests have been timed
+    HEDGE_THREADS_PER_WORKER=3 # The original, its hedge and one stalled loser still waiting on its timeout
+
+    def _start_deadline(self):
+        self._deadline = tm.time()+self._deadline_secs if self._deadline_secs is not None else None
+
+    def _remaining_secs(self):
+        """
+        Seconds left of the wall clock budget of the current aggregate_* call. None if there is no budget
+        """
+        return None if self._deadline is None else self._deadline-tm.time()
+
+    def _check_deadline(self, station):
+        """
+        Raise DeadlineExceeded if the wall clock budget has run out before the station was started
+        """
+        remaining = self._remaining_secs()
+        if remaining is not None and remaining <= 0:
+            raise DeadlineExceeded('Station {} not fetched: the {} secs budget ran out'.format(self._station_id(station), self._deadline_secs))
+
+    def _request_timeout(self):
+        """
+        Timeout (secs) for the next http request: request_timeout clipped to the remaining budget
+        """
+        remaining = self._remaining_secs()
+        if remaining is None:
+            return self._request_timeout_secs
+        remaining = max(remaining, 0.001)
+        return remaining if self._request_timeout_secs is None else min(self._request_timeout_secs, remaining)
+
+    def _hedge_delay(self):
+        """
+        The p95 request latency of this source, or None if hedging is off or too few requests were timed
+        """
+        if not self._hedge:
+            return None
+        with self._telemetry_lock:
+            if len(self._latencies) < self.HEDGE_MIN_SAMPLES:
+                return None
+            return float(np.percentile(self._latencies, 95))
+
+    def _note_hedge(self, station, delay):
+        with self._telemetry_lock:
+            self._hedged += 1
+        utilities.log.info('Hedging a request for {} still outstanding after {:.3f} secs (p95)'.format(self._station_id(station), delay))
+
+    def _note_hedge_win(self):
+        with self._telemetry_lock:
+            self._hedge_wins += 1
+
+    def _hedge_executor(self) -> ThreadPoolExecutor:
+        """
+        The thread pool hedged requests run on, created on first use and kept until close().
+        It is bounded by HEDGE_THREADS_PER_WORKER threads per fetch worker, so stalled losers
+        (which keep their thread until their request times out) can never pile up
+        """
+        with self._hedge_pool_lock:
+            if self._hedge_pool is None:
+                workers = self.HEDGE_THREADS_PER_WORKER*max(self._max_workers, self.RETRY_WORKERS)
+                self._hedge_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='hedge')
+            return self._hedge_pool
+
+    def close(self):
+        """
+        Release the hedged request threads. Requests still outstanding are left to time out
+        """
+        with self._hedge_pool_lock:
+            pool, self._hedge_pool = self._hedge_pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def _hedged_call(self, func, station):
+        """
+        Call func(). If it has not returned within the p95 latency, race a duplicate call against it and
+        return the first successful result (raising the last exception if both fail)
+        """
+        delay = self._hedge_delay()
+        if delay is None:
+            return func()
+        pool = self._hedge_executor()
+        futures = [pool.submit(func)]
+        done, _ = wait(futures, timeout=delay)
+        if not done:
+            self._note_hedge(station, delay)
+            futures.append(pool.submit(func))
+        error = None
+        try:
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as ex:
+                    error = ex
+                    continue
+                if future is not futures[0]:
+                    self._note_hedge_win()
+                return result
+            raise error
+        finally:
+            for future in futures:
+                future.cancel() # Only a duplicate still queued behind stalled requests is affected
+
+    def _http_get(self, url, station):
+        """
+        requests.get with the request timeout, hedged if enabled. Only the request whose response is used
+        (the winner of a hedge) is recorded in the station telemetry
+
+        Return:
+            The requests response
+        """
+        def get():
+            started = tm.time()
+            return requests.get(url, timeout=self._request_timeout()), started
+        response, started = self._hedged_call(get, station)
+        self._record_request(station, started, len(response.content))
+        return response
+
+    @contextmanager
+    def _request_slot(self):
+        """
+        Hold one of the source's adaptive concurrency slots around a single request and report its
+        latency and any congestion signal back to the limiter. A no-op unless adaptive_concurrency is set
+        """
+        if self._limiter is None:
+            yield
+            return
+        started = self._limiter.acquire()
+        congestion = None
+        try:
+            yield
+        except Exception as ex:
+            congestion = congestion_reason(ex)
+            raise
+        finally:
+            self._limiter.release(started, congestion)
+
+    @asynccontextmanager
+    async def _async_request_slot(self):
+        """
+        Event loop analog of _request_slot
+        """
+        if self._limiter is None:
+            yield
+            return
+        started = await self._limiter.acquire_async()
+        congestion = None
+        try:
+            yield
+        except Exception as ex:
+            congestion = congestion_reason(ex)
+            raise
+        finally:
+            await self._limiter.release_async(started, congestion)
+
+    def _build_run_report(self, excludedStations) -> dict:
+        """
+        Summarize the current run and the per station telemetry (in station order)
+        """
+        stations = [self._station_telemetry(station, 'data') for station in self._stations]
+        report = {'source': self.source,
+                  'product': getattr(self, '_product', None),
+                  'started': dt.datetime.fromtimestamp(self._run_started, dt.timezone.utc).strftime('%Y-%m-%dT%H:%M:%S'),
+                  'wall_time_secs': tm.time()-self._run_started,
+                  'max_workers': self._max_workers,
+                  'stations_requested': len(self._stations),
+                  'stations_included': len(self._stations)-len(excludedStations),
+                  'stations_excluded': len(excludedStations),
+                  'requests': sum(record['requests'] for record in stations),
+                  'bytes': sum(record['bytes'] for record in stations),
+                  'hedged_requests': self._hedged,
+                  'hedge_wins': self._hedge_wins,
+                  'stations_retried': sum(record['retries'] > 0 for record in stations),
+                  'stations_recovered': sum(record['retries'] > 0 and record['exception'] is None for record in stations),
+                  'deadline_secs': self._deadline_secs,
+                  'stations': stations}
+        if self._limiter is not None:
+            report['concurrency'] = self._limiter.report()
+        return report
+
+    def station_telemetry(self, phase='data') -> pd.DataFrame:
+        """
+        Return the per station telemetry of the most recent run with stations as index
+
+        Input:
+            phase: (str) 'data' (default) for the data aggregation or 'metadata' for the metadata fetch
+        """
+        df = pd.DataFrame([self._station_telemetry(station, phase) for station in self._stations])
+        return df.set_index('station')
+
+    def _station_id(self, station) -> str:
+        return str(station[0] if isinstance(station, tuple) else station)
+
+    def _check_negative_cache(self, station):
+        """
+        Raise StationSkipped if the negative cache says this station is not worth requesting
+        """
+        if self._negative_cache is not None and self._negative_cache.should_skip(self.source, getattr(self, '_product', None), self._station_id(station)):
+            raise StationSkipped('Station {} is in the negative cache'.format(self._station_id(station)))
+
+    def _update_negative_cache(self, outcomes):
+        """
+        Record the (station, exception) outcomes of a data aggregation in the negative cache and save it.
+        Stations that were skipped are left untouched
+        """
+        if self._negative_cache is None:
+            return
+        outcomes = [(self._station_id(station), None if ex is None else type(ex).__name__)
+                    for station, ex in outcomes if not isinstance(ex, StationSkipped)]
+        nskipped = len(self._stations)-len(outcomes)
+        nfailed = self._negative_cache.update(self.source, getattr(self, '_product', None), outcomes)
+        utilities.log.info('Negative cache: {} stations skipped, {} failures recorded'.format(nskipped, nfailed))
+        try:
+            self._negative_cache.save()
+        except Exception as e:
+            utilities.log.error('Negative cache: failed to save: {}'.format(e))
+
+    def _map_stations(self, func, ordered=True, stations=None, workers=None):
+        """
+        Apply func(station) to every station and yield the results in the order of self._stations.
+        If max_workers > 1 the calls are fanned out over a bounded thread pool, else they run serially.
+        Exceptions are caught per station and handed back to the caller so that
+        one bad station never aborts the others.
+
+        Input:
+            ordered: (bool) If False results are yielded as they complete and at most max_workers
+                stations are submitted at a time, so finished results never pile up in memory
+            stations: The stations to map over. Default self._stations
+            workers: (int) Number of threads. Default max_workers
+
+        Return:
+            generator of tuples (station, result, exception). One of result/exception is None
+        """
+        stations = self._stations if stations is None else stations
+        workers = self._max_workers if workers is None else workers
+        if workers <= 1:
+            for station in stations:
+                utilities.log.info(station)
+                try:
+                    yield station, self._run_station(func, station), None
+                except Exception as ex:
+                    yield station, None, ex
+            return
+        utilities.log.info('Fetching {} stations using {} workers'.format(len(stations), workers))
+        if not ordered:
+            yield from self._map_stations_as_completed(func, stations, workers)
+            return
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(self._run_station, func, station) for station in stations]
+            for number, station in enumerate(stations):
+                future, futures[number] = futures[number], None # Do not keep results the caller has been handed
+                try:
+                    yield station, future.result(), None
+                except Exception as ex:
+                    yield station, None, ex
+
+    def _map_stations_as_completed(self, func, stations, workers):
+        """
+        Threaded, unordered variant of _map_stations. A new station is only submitted once a
+        previous one has been handed to the caller
+        """
+        pending = dict()
+        stations = iter(stations)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            while True:
+                for station in stations:
+                    pending[pool.submit(self._run_station, func, station)] = station
+                    if len(pending) >= workers:
+                        break
+                if len(pending)==0:
+                    return
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    station = pending.pop(future)
+                    try:
+                        yield station, future.result(), None
+                    except Exception as ex:
+                        yield station, None, ex
+
+##
+## End of run retries. A transient COOPS/Contrails blip should not cost a station for the whole run.
+## Failed stations are held back until every station has been tried, then re-fetched (concurrently,
+## with exponential backoff between rounds) within retry_budget_secs. Skipped stations are never retried
+##
+    RETRY_BACKOFF_SECS=2.0 # Wait before the first retry round. Doubles every round
+    RETRY_WORKERS=4 # Minimum number of threads used for a retry round
+
+    def _retry_backoff(self, attempt, budget_end):
+        """
+        Seconds to wait before retry round attempt. None if that would overrun the retry budget
+        """
+        wait_secs = self.RETRY_BACKOFF_SECS*2**(attempt-1)
+        if tm.time()+wait_secs >= budget_end:
+            utilities.log.info('Retry budget of {} secs spent before round {}'.format(self._retry_budget_secs, attempt))
+            return None
+        return wait_secs
+
+    @contextmanager
+    def _retry_deadline(self):
+        """
+        Clip the run deadline to the retry budget for the enclosed retry rounds
+
+        Return:
+            The time the retry budget runs out
+        """
+        budget_end = tm.time()+self._retry_budget_secs
+        saved_deadline = self._deadline
+        self._deadline = budget_end if saved_deadline is None else min(saved_deadline, budget_end)
+        try:
+            yield budget_end
+        finally:
+            self._deadline = saved_deadline
+
+    def _note_retry(self, station, ex):
+        """
+        Account for a retry of station. ex is the exception of the retry or None if it recovered
+        """
+        record = self._station_telemetry(station)
+        with self._telemetry_lock:
+            record['retries'] += 1
+            record['exception'] = None if ex is None else type(ex).__name__
+        if ex is None:
+            utilities.log.info('Retry: recovered station {}'.format(self._station_id(station)))
+
+    def _with_retries(self, results, func):
+        """
+        Pass the (station, result, exception) tuples of _map_stations through, holding back the failed stations.
+        Once results is exhausted they are re-fetched with func for up to retry_attempts rounds. Recovered
+        stations are yielded when they succeed, the others at the end with their last exception
+        """
+        failed = list()
+        for station, result, ex in results:
+            if ex is None or isinstance(ex, StationSkipped) or self._retry_attempts <= 0:
+                yield station, result, ex
+            else:
+                failed.append((station, ex))
+        with self._retry_deadline() as budget_end:
+            for attempt in range(1, self._retry_attempts+1):
+                wait_secs = self._retry_backoff(attempt, budget_end) if len(failed) > 0 else None
+                if wait_secs is None:
+                    break
+                tm.sleep(wait_secs)
+                utilities.log.info('Retry round {}: {} stations'.format(attempt, len(failed)))
+                previous = dict(failed)
+                failed = list()
+                for station, result, ex in self._map_stations(func, ordered=False, stations=list(previous),
+                                                              workers=max(self._max_workers, self.RETRY_WORKERS)):
+                    if isinstance(ex, DeadlineExceeded): # Not retried after all
+                        failed.append((station, previous[station]))
+                        continue
+                    self._note_retry(station, ex)
+                    if ex is None:
+                        yield station, result, None
+                    else:
+                        failed.append((station, ex))
+        for station, ex in failed:
+            yield station, None, ex
+
+    def _fetch_and_process_station(self, station)->pd.DataFrame:
+        """
+        Fetch a single station product then interpolate and resample it
+        """
+        dx = self._checked_station_frame(station, self.fetch_single_product(station, self._periods))
+        return self._process_station_frame(station, dx)
+
+    def _checked_station_frame(self, station, dx):
+        """
+        The fetch_single_product of the sources catch their own errors and return np.nan (or an empty frame).
+        Raise in that case, so the failure is seen (and retried) where the fetch is made rather than later
+        by the post processing
+
+        Return:
+            dx, when it is a non empty dataframe
+        """
+        if not isinstance(dx, pd.DataFrame) or dx.empty:
+            raise ValueError('No data returned for station {}'.format(station))
+        return dx
+
+    def _process_station_frame(self, station, dx):
+        """
+        Interpolate and resample a single fetched station product. Row counts go to the station telemetry
+        If a post processing pool is running the work is submitted there and a Future of the frame is returned
+        at once, so the calling (fetch) thread moves on to the next station. See _postprocessed()
+
+        Return:
+            The processed frame, or a Future of it when postprocess_workers > 0
+        """
+        record = self._station_telemetry(station)
+        record['rows_returned'] = len(dx) if isinstance(dx, pd.DataFrame) else 0
+        def count_rows(dx_out):
+            record['rows_processed'] = len(dx_out)
+            return dx_out
+        if self._postprocess_pool is not None:
+            return chain_future(self._postprocess_pool.submit(stations_postprocess, dx, self._resampling_mins, self._resample_method, self._max_gap), count_rows)
+        return count_rows(stations_postprocess(dx, sample_mins=self._resampling_mins, method=self._resample_method, max_gap=self._max_gap))
+
+    def _resolve_station_frame(self, station, dx, ex):
+        """
+        Wait for a pending post processing result. A failure excludes the station like a failed fetch
+        """
+        if not isinstance(dx, Future):
+            return station, dx, ex
+        try:
+            return station, dx.result(), None
+        except Exception as e:
+            self._station_telemetry(station)['exception'] = type(e).__name__
+            return station, None, e
+
+    def _postprocessed(self, results):
+        """
+        Pass the (station, result, exception) tuples through, in the same order, once their post processing is done.
+        Results still in the post processing pool are held back (at most 2 per process, beyond that
+        the caller waits) so the fetches keep going while earlier stations are interpolated and resampled
+        """
+        pending = deque()
+        lookahead = max(2*self._postprocess_workers, 2)
+        for result in results:
+            pending.append(result)
+            while len(pending) > 0 and (len(pending) > lookahead or not isinstance(pending[0][1], Future) or pending[0][1].done()):
+                yield self._resolve_station_frame(*pending.popleft())
+        while len(pending) > 0:
+            yield self._resolve_station_frame(*pending.popleft())
+
+    async def _process_station_frame_async(self, station, dx)->pd.DataFrame:
+        """
+        Event loop analog of _process_station_frame. With a post processing pool the loop is not blocked
+        """
+        if self._postprocess_pool is None:
+            return self._process_station_frame(station, dx)
+        record = self._station_telemetry(station)
+        record['rows_returned'] = len(dx) if isinstance(dx, pd.DataFrame) else 0
+        loop = asyncio.get_running_loop()
+        dx_out = await loop.run_in_executor(self._postprocess_pool, stations_postprocess, dx, self._resampling_mins, self._resample_method, self._max_gap)
+        record['rows_processed'] = len(dx_out)
+        return dx_out
+
+    @contextmanager
+    def _postprocessing(self):
+        """
+        Run the enclosed aggregation with a process pool for the post processing, if postprocess_workers > 0
+        """
+        if self._postprocess_workers <= 0:
+            yield
+            return
+        utilities.log.info('Post processing stations using {} processes'.format(self._postprocess_workers))
+        with ProcessPoolExecutor(max_workers=self._postprocess_workers) as pool:
+            self._postprocess_pool = pool
+            try:
+                yield
+            finally:
+                self._postprocess_pool = None
 
     def aggregate_station_data(self)->pd.DataFrame:
         """
         Loop over the list of stations and fetch the products. Then concatenate them info single dataframe
+        Stations are fetched concurrently if max_workers > 1. The column order always follows the input station list
+
+        nans are kept (float64). The GLOBAL_FILL_VALUE is applied when the data are written
+        """
+        self._start_run()
+        with self._postprocessing():
+            return self._aggregate_station_results(self._postprocessed(self._with_retries(self._map_stations(self._fetch_and_process_station), self._fetch_and_process_station)))
+
+    def aggregate_station_data_spilled(self)->spilled_station_data:
+        """
+        Memory bounded alternative to aggregate_station_data. The frames are collected in a spilled_station_data
+        that moves them to local disk once they exceed memory_budget. Write it with spilled_station_data.write_long()
+        (or build the dataframe with to_frame()) then close() it
+
+        Return:
+            spilled_station_data, whether or not the budget was exceeded
+        """
+        self._start_run()
+        with self._postprocessing():
+            return self._aggregate_station_results(self._postprocessed(self._with_retries(self._map_stations(self._fetch_and_process_station), self._fetch_and_process_station)), spill=True)
 
-        nans now get converted to the value in GLOBAL_FILL_VALUE
+    def iter_station_frames(self, ordered=False):
         """
-        aggregateData = list()
+        Streaming alternative to aggregate_station_data. Yields each fetched, interpolated and resampled
+        station frame as soon as it is available instead of holding every station until the end.
+        Pair with write_station_frames() to keep peak memory at roughly one station (per worker) of data.
+        Stations that fail are logged and skipped. self.run_report is built once the generator is exhausted
+
+        Input:
+            ordered: (bool) Yield in the order of the input station list. Default False yields
+                in completion order (only differs when max_workers > 1)
+
+        Return:
+            generator of tuples (station, frame). frame is TIME vs a single station column
+        """
+        self._start_run()
         excludedStations=list()
         template = "An exception of type {0} occurred. Arguments:\n{1!r}"
-        for station in self._stations:
-            utilities.log.info(station)    
-            try:
-                dx = self.fetch_single_product(station, self._periods)
-                dx_int = stations_interpolate(dx)
-                aggregateData.append(stations_resample(dx_int, sample_mins=self._resampling_mins))
-                #aggregateData.append(resample_and_interpolate(dx))
-                #tm.sleep(2) # sleep 2 secs
-                #print('Iterate: Kept station is {}'.format(station))
-            except Exception as ex:
+        outcomes=list()
+        with self._postprocessing():
+            for station, dx, ex in self._postprocessed(self._with_retries(self._map_stations(self._fetch_and_process_station, ordered=ordered), self._fetch_and_process_station)):
+                outcomes.append((station, ex))
+                if ex is None:
+                    yield station, dx
+                else:
+                    excludedStations.append(station)
+                    message = template.format(type(ex).__name__, ex.args)
+                    utilities.log.warn('Error Value: Probably the station simply had no data; Skip {}, msg {}'.format(station, message))
+        self._update_negative_cache(outcomes)
+        utilities.log.info('{} Stations were excluded'.format(len(excludedStations)))
+        self.run_report = self._build_run_report(excludedStations)
+        utilities.log.info('Run: {} requests, {} bytes, {:.2f} secs'.format(self.run_report['requests'], self.run_report['bytes'], self.run_report['wall_time_secs']))
+
+    def _aggregate_station_results(self, results, spill=False)->pd.DataFrame:
+        """
+        Collect the per station (station, frame, exception) results, in station order,
+        and concatenate the good ones into a single dataframe. Shared by the threaded and async paths
+
+        With spill the frames are collected in a spilled_station_data (under memory_budget), which is returned
+        instead of a dataframe (see spilled_station_data.write_long/to_frame)
+        """
+        aggregateData = spilled_station_data(self._memory_budget if self._memory_budget is not None else math.inf) if spill else list()
+        excludedStations=list()
+        outcomes=list()
+        positions=list() # Stations recovered by a retry round arrive late. Put them back in station order
+        station_order = {station: number for number, station in enumerate(self._stations)}
+        template = "An exception of type {0} occurred. Arguments:\n{1!r}"
+        for station, dx, ex in results:
+            outcomes.append((station, ex))
+            if ex is None:
+                aggregateData.append(dx)
+                positions.append(station_order.get(station, len(station_order)))
+            else:
                 excludedStations.append(station)
                 message = template.format(type(ex).__name__, ex.args)
                 utilities.log.warn('Error Value: Probably the station simply had no data; Skip {}, msg {}'.format(station, message))
@@ -143,42 +1164,209 @@ class fetch_station_data(object):
             #sys.exit(1) # Keep processing the remaining list
         utilities.log.info('{} Stations were excluded'.format(len(excludedStations)))
         utilities.log.info('{} Stations included'.format(len(aggregateData)))
+        self._update_negative_cache(outcomes)
+        self.run_report = self._build_run_report(excludedStations)
+        utilities.log.info('Run: {} requests, {} bytes, {:.2f} secs'.format(self.run_report['requests'], self.run_report['bytes'], self.run_report['wall_time_secs']))
+        if positions != sorted(positions):
+            order = np.argsort(positions, kind='stable')
+            if isinstance(aggregateData, spilled_station_data):
+                aggregateData.reorder(order)
+            else:
+                aggregateData = [aggregateData[number] for number in order]
+        if spill:
+            return aggregateData
+        if len(aggregateData)==0: # The layout of stations_aggregate, without any station
+            return pd.DataFrame(index=pd.DatetimeIndex([], name='TIME'), columns=pd.Index([], dtype=object), dtype=float)
+        df_data = None
         try:
-            df_data = pd.concat(aggregateData, axis=1)
-            idx = df_data.index
             utilities.log.info('Check for time duplicates')
-            if idx.duplicated().any():
-                utilities.log.info("Duplicated data times found . will keep first value(s) only")
-                df_data = df_data.loc[~df_data.index.duplicated(keep='first')]
-            if len(idx) != len(df_data.index):
-                utilities.log.warning('had duplicate times {} {}'.format(len(idx),len(df_data.index)))
+            df_data = stations_aggregate(aggregateData)
             # I have seen lots of nans coming from ADCIRC
             #df_data.dropna(how='all', axis=1, inplace=True)
-            df_data = replace_and_fill(df_data)
         except Exception as e:
             utilities.log.error('Aggregate: error: {}'.format(e))
             ##df_data=np.nan
-        print(df_data)
+        utilities.log.debug('Aggregate: {}'.format(df_data))
         return df_data
 
+##
+## Asyncio harvest engine. A single event loop multiplexes every station request (and every
+## Contrails daily sub-window) over one shared aiohttp session. The number of requests on the wire
+## is bounded by a semaphore. Subclasses supply fetch_single_product_async(), otherwise the blocking
+## fetch_single_product() runs in the default executor of the loop.
+##
+    async def _async_get(self, url, params=None, station=None) -> bytes:
+        """
+        Issue a single GET on the shared session. Blocks while max_in_flight requests are outstanding
+        If station is given the request is recorded in its telemetry (only the winner of a hedge)
+
+        Return:
+            The response body as bytes
+        """
+        async with self._in_flight, self._async_request_slot():
+            content, started = await self._async_hedged_get(url, params, station)
+        if station is not None:
+            self._record_request(station, started, len(content))
+        return content
+
+    async def _async_hedged_get(self, url, params=None, station=None) -> tuple:
+        """
+        Event loop analog of _hedged_call around _async_get_once
+
+        Return:
+            tuple (response body, tm.time() at which the used request was issued)
+        """
+        delay = self._hedge_delay()
+        if delay is None:
+            return await self._async_get_once(url, params)
+        tasks = [asyncio.ensure_future(self._async_get_once(url, params))]
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if not done:
+            self._note_hedge(station, delay)
+            tasks.append(asyncio.ensure_future(self._async_get_once(url, params)))
+        try:
+            error = None
+            pending = set(tasks)
+            while len(pending) > 0:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        error = task.exception()
+                        continue
+                    if task is not tasks[0]:
+                        self._note_hedge_win()
+                    return task.result()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _async_get_once(self, url, params=None) -> tuple:
+        """
+        A single GET (with the request timeout) on the shared session
+
+        Return:
+            tuple (response body, tm.time() at which the request was issued)
+        """
+        started = tm.time()
+        timeout = self._request_timeout()
+        async with self._session.get(url, params=params, timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+            response.raise_for_status()
+            content = await response.read()
+        return content, started
+
+    async def fetch_single_product_async(self, station, periods) -> pd.DataFrame:
+        """
+        Async analog of fetch_single_product. Subclasses with a native async fetch overwrite this.
+        By default the blocking fetch_single_product runs in the default executor of the loop
+        and still counts against max_in_flight
+        """
+        loop = asyncio.get_running_loop()
+        async with self._in_flight:
+            return await loop.run_in_executor(None, self.fetch_single_product, station, periods)
+
+    async def _fetch_and_process_station_async(self, station):
+        """
+        Fetch a single station product on the event loop then interpolate and resample it
+
+        Return:
+            tuple (station, frame, exception). One of frame/exception is None
+        """
+        record = self._station_telemetry(station)
+        started = tm.time()
+        try:
+            self._check_negative_cache(station)
+            self._check_deadline(station)
+            dx = self._checked_station_frame(station, await self.fetch_single_product_async(station, self._periods))
+            return station, await self._process_station_frame_async(station, dx), None
+        except Exception as ex:
+            record['exception'] = type(ex).__name__
+            return station, None, ex
+        finally:
+            record['elapsed_secs'] += tm.time()-started
+
+    async def _retry_failed_async(self, results) -> list():
+        """
+        Event loop analog of _with_retries. The failed entries of results (a list in station order)
+        are re-fetched concurrently and replaced in place when they recover
+        """
+        failed = [number for number, (station, dx, ex) in enumerate(results) if ex is not None and not isinstance(ex, StationSkipped)]
+        if self._retry_attempts <= 0:
+            return results
+        with self._retry_deadline() as budget_end:
+            for attempt in range(1, self._retry_attempts+1):
+                wait_secs = self._retry_backoff(attempt, budget_end) if len(failed) > 0 else None
+                if wait_secs is None:
+                    break
+                await asyncio.sleep(wait_secs)
+                utilities.log.info('Retry round {}: {} stations'.format(attempt, len(failed)))
+                retried = await asyncio.gather(*[self._fetch_and_process_station_async(results[number][0]) for number in failed])
+                previous, failed = failed, list()
+                for number, (station, dx, ex) in zip(previous, retried):
+                    if isinstance(ex, DeadlineExceeded): # Not retried after all
+                        self._station_telemetry(station)['exception'] = type(results[number][2]).__name__
+                        failed.append(number)
+                        continue
+                    self._note_retry(station, ex)
+                    results[number] = (station, dx, ex)
+                    if ex is not None:
+                        failed.append(number)
+        return results
+
+    async def aggregate_station_data_async(self, max_in_flight=16)->pd.DataFrame:
+        """
+        Async analog of aggregate_station_data. All stations are requested from a single event loop
+        with at most max_in_flight requests outstanding at any time. Results are identical
+        to the serial path (column order, excluded stations, per station exception isolation)
+
+        Usage: df_data = asyncio.run(fetcher.aggregate_station_data_async(max_in_flight=32))
+        """
+        utilities.log.info('Async fetching {} stations with at most {} requests in flight'.format(len(self._stations), max_in_flight))
+        self._start_run()
+        if self._limiter is not None:
+            self._limiter.start_run(max_in_flight)
+        self._in_flight = asyncio.Semaphore(max_in_flight)
+        connector = aiohttp.TCPConnector(limit=max_in_flight)
+        with self._postprocessing():
+            async with aiohttp.ClientSession(connector=connector) as session:
+                self._session = session
+                try:
+                    results = await asyncio.gather(*[self._fetch_and_process_station_async(station) for station in self._stations])
+                    results = await self._retry_failed_async(results)
+                finally:
+                    self._session = None
+        return self._aggregate_station_results(results)
+
 # TODO Need to sync with df_data
     def aggregate_station_metadata(self)->pd.DataFrame:
         """
         Loop over the list of stations and fetch the metadata. Then concatenate info single dataframe
         Transpose final data to have stations as index
 
-        nans now get converted to the value in GLOBAL_FILL_VALUE
+        nans are kept. The GLOBAL_FILL_VALUE is applied when the metadata are written
+        """
+        self._start_deadline()
+        with self._telemetry_lock:
+            self._telemetry = {key: record for key, record in self._telemetry.items() if key[0]!='metadata'}
+        self._phase = 'metadata'
+        try:
+            return self._aggregate_metadata_results(self._map_stations(self.fetch_single_metadata))
+        finally:
+            self._phase = 'data'
+
+    def _aggregate_metadata_results(self, results)->pd.DataFrame:
+        """
+        Collect the per station (station, metadata, exception) results, in station order,
+        and concatenate the good ones into a single dataframe with stations as index
         """
         aggregateMetaData = list()
         excludedStations = list()
         template = "A metadata exception of type {0} occurred. Arguments:\n{1!r}"
-        for station in self._stations:
-            try:
-                dx = self.fetch_single_metadata(station)
+        for station, dx, ex in results:
+            if ex is None:
                 aggregateMetaData.append(dx)
-                #tm.sleep(2) # sleep 2 secs
                 utilities.log.info('Iterate: Kept station is {}'.format(station))
-            except Exception as ex:
+            else:
                 excludedStations.append(station)
                 message = template.format(type(ex).__name__, ex.args)
                 utilities.log.warn('Error Value: Metadata: {}, msg {}'.format(station, message))
@@ -186,11 +1374,68 @@ class fetch_station_data(object):
             utilities.log.warn('Metadata: No site data was found for the given site_id list. Perhaps the server is down Exit')
             #sys.exit(1) # Process remaining list
         utilities.log.info('{} Metadata Stations were excluded'.format(len(excludedStations)))
+        if len(aggregateMetaData)==0:
+            return pd.DataFrame()
         df_meta = pd.concat(aggregateMetaData, axis=1).T
         #df_meta.dropna(how='all', axis=1, inplace=True)
-        df_meta = replace_and_fill(df_meta)
         return df_meta
 
+    def fetch_single_station(self, station, periods):
+        """
+        Fetch both the product and the metadata for a single station. Subclasses overwrite this
+        to share per station handles/responses between the two fetches
+
+        Return:
+            tuple (product dataframe, metadata dataframe)
+        """
+        return self.fetch_single_product(station, periods), self.fetch_single_metadata(station)
+
+    def _fetch_and_process_station_with_metadata(self, station):
+        """
+        Fetch a single station product and metadata in one pass. Then interpolate and resample the product
+        """
+        dx, df_meta = self.fetch_single_station(station, self._periods)
+        dx = self._process_station_frame(station, self._checked_station_frame(station, dx))
+        if isinstance(dx, Future):
+            return chain_future(dx, lambda frame: (frame, df_meta))
+        return dx, df_meta
+
+    def aggregate(self):
+        """
+        Single pass alternative to calling aggregate_station_data() followed by aggregate_station_metadata().
+        Each station is visited once and its product and metadata are fetched together.
+        A station that fails either fetch is excluded from both results so the station
+        membership of the data columns and the metadata index is always the same.
+
+        Return:
+            tuple (df_data, df_meta)
+        """
+        return self._aggregate(spill=False)
+
+    def aggregate_spilled(self):
+        """
+        Memory bounded alternative to aggregate(). See aggregate_station_data_spilled()
+
+        Return:
+            tuple (spilled_station_data, df_meta)
+        """
+        return self._aggregate(spill=True)
+
+    def _aggregate(self, spill):
+        self._start_run()
+        metadata = list()
+        def split_results():
+            # Hand the data frames on as they arrive (they may be spilled) and keep the (small) metadata
+            for station, dx, ex in self._postprocessed(self._with_retries(self._map_stations(self._fetch_and_process_station_with_metadata), self._fetch_and_process_station_with_metadata)):
+                metadata.append((station, dx[1] if ex is None else None, ex))
+                yield station, dx[0] if ex is None else None, ex
+        with self._postprocessing():
+            df_data = self._aggregate_station_results(split_results(), spill=spill)
+        station_order = {station: number for number, station in enumerate(self._stations)}
+        metadata.sort(key=lambda result: station_order.get(result[0], len(station_order))) # Retried stations arrive late
+        df_meta = self._aggregate_metadata_results(metadata)
+        return df_data, df_meta
+
 #####################################################################################
 ##
 ## Fetching the ADCIRC NODE data from TDS
@@ -205,6 +1450,135 @@ class fetch_station_data(object):
 ## For the fort.63, we are extracting time series from specific node numbers.  
 ## Unless the lon,lat point is very close to the specified node, these will be slightly different.
 
+## netCDF4/HDF5 are not thread safe. When stations are fetched concurrently (max_workers > 1)
+## all dataset access is serialized through this lock.
+NETCDF_LOCK = threading.RLock()
+
+class netcdf_dataset_cache(object):
+    """
+    A bounded LRU cache of open nc4.Dataset handles keyed by url. Every url is opened once and the handle is
+    shared by all the readers. The least recently used handle is closed when more than max_open are open,
+    and all remaining handles are closed by close() (or when the cache is garbage collected or the process exits).
+    So long backfills do not leak file descriptors or OPeNDAP connections.
+
+    A handle is only valid while NETCDF_LOCK is held: get() must be called, and the handle used, under the lock.
+
+    Input:
+        max_open: (int) Maximum number of handles kept open
+    """
+    def __init__(self, max_open=8):
+        self._max_open=max(1, max_open)
+        self._handles=OrderedDict()
+        self.opened=0
+        self.evicted=0
+        self._finalizer=weakref.finalize(self, netcdf_dataset_cache._close_all, self._handles)
+
+    def __len__(self):
+        return len(self._handles)
+
+    def __contains__(self, url):
+        return url in self._handles
+
+    def get(self, url) -> nc4.Dataset:
+        """
+        Return the open dataset of url, opening it (and evicting the least recently used handle) as needed.
+        Raises OSError, like nc4.Dataset, if the url cannot be opened
+        """
+        with NETCDF_LOCK:
+            nc = self._handles.get(url)
+            if nc is not None:
+                self._handles.move_to_end(url)
+                return nc
+            nc = nc4.Dataset(url)
+            self.opened += 1
+            self._handles[url] = nc
+            while len(self._handles) > self._max_open:
+                old_url, old = self._handles.popitem(last=False)
+                self.evicted += 1
+                utilities.log.debug('Closing least recently used dataset {}'.format(old_url))
+                old.close()
+            return nc
+
+    @staticmethod
+    def _close_all(handles):
+        with NETCDF_LOCK:
+            while len(handles) > 0:
+                url, nc = handles.popitem()
+                try:
+                    nc.close()
+                except Exception as e:
+                    utilities.log.debug('Closing {} failed: {}'.format(url, e))
+
+    def close(self):
+        """
+        Close every open handle. The cache can still be used afterwards
+        """
+        netcdf_dataset_cache._close_all(self._handles)
+
+def plan_hyperslabs(nodes, max_gap=1000) -> list():
+    """
+    Plan the reads of scattered node columns as a few hyperslabs. The nodes are sorted and two neighbours
+    share a hyperslab when fewer than max_gap unrequested nodes lie between them. A hyperslab whose nodes are
+    evenly spaced is read strided, so it holds no unrequested nodes at all
+
+    Return:
+        list of slice objects, in node order
+    """
+    nodes = np.unique(np.asarray(nodes, dtype=int))
+    if len(nodes)==0:
+        return list()
+    breaks = np.flatnonzero(np.diff(nodes) > max_gap+1)+1
+    slabs = list()
+    for group in np.split(nodes, breaks):
+        steps = np.unique(np.diff(group))
+        step = int(steps[0]) if len(steps)==1 else 1
+        slabs.append(slice(int(group[0]), int(group[-1])+1, step))
+    return slabs
+
+ADCIRC_GRID_COORDS=dict() # (grid, instance (fort.61 only), nodes) -> {'source': str, 'coords': {node: (lon, lat)}}. Never change
+
+NODE_DISTANCE_WARN_KM=5.0 # fort.63 stations further than this from their nearest wet node are logged
+
+##
+## Url availability. Instead of fully opening every url (DDS and DAS over OPeNDAP) one after the other, the urls
+## can be probed concurrently with a single small request each: the OPeNDAP .dds of http(s) urls, or an exists check
+## for local files. Outcomes are cached for the life of the process (the run)
+##
+URL_PROBES=dict() # url -> bool
+URL_PROBES_LOCK=threading.Lock()
+
+def probe_url(url, timeout=10) -> bool:
+    """
+    True if url is available. http(s) urls are OPeNDAP endpoints: their .dds must answer 200 within timeout secs
+    """
+    if not url.startswith(('http://','https://')):
+        return os.path.exists(url)
+    try:
+        response = requests.get(url+'.dds', timeout=timeout)
+        return response.status_code==200
+    except requests.exceptions.RequestException as e:
+        utilities.log.info('URL probe failed {}: {}'.format(url, e))
+        return False
+
+def probe_urls(urls, workers=8, timeout=10) -> list():
+    """
+    Probe urls concurrently (at most workers at a time), reusing the outcome of urls probed earlier in the run
+
+    Return:
+        The available urls, in input order
+    """
+    with URL_PROBES_LOCK:
+        todo = [url for url in dict.fromkeys(urls) if url not in URL_PROBES]
+    if len(todo) > 0:
+        started = tm.time()
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(todo)))) as pool:
+            outcomes = list(pool.map(lambda url: probe_url(url, timeout), todo))
+        with URL_PROBES_LOCK:
+            URL_PROBES.update(zip(todo, outcomes))
+        utilities.log.info('Probed {} urls ({} available) in {:.2f} secs'.format(len(todo), sum(outcomes), tm.time()-started))
+    with URL_PROBES_LOCK:
+        return [url for url in urls if URL_PROBES[url]]
+
 class adcirc_fetch_data(fetch_station_data):
     """
     Fetching WL data from ADCIRC can be done in one of two ways. The default approach is based
@@ -221,7 +1595,28 @@ class adcirc_fetch_data(fetch_station_data):
         periods: list of valid ADCIRC urls tuples (*63.nc,*.61.nc) for aggregation 
         fort63_style: (bool) If True use the fort.63-based approach
                     If True then station_id_list: a CSV file containing columns of, at least, stationid and nodeid. 
+        bulk_read: (bool) Read time and the whole zeta[:, :] of each url once and slice every station from
+                    that shared array, instead of one open and one zeta[:,node] request per station per url.
+                    For fort63_style only the nodes of the stations are read, as the few hyperslabs planned
+                    by plan_hyperslabs()
+        interpolate: (bool) fort63_style: instead of the value of a single node, interpolate each station (columns
+                    lon, lat) within its containing mesh element with barycentric weights, like the fort.61 values.
+                    The element nodes and weights come from the node_index and the nodes are read as in bulk_read
+        read_gap: (int) fort63_style bulk reads: the most unrequested nodes read to join two requested nodes in
+                    one hyperslab (each costs time x 8 bytes). Trades bytes for requests
+        max_open_datasets: (int) Number of url handles kept open in the fetcher's netcdf_dataset_cache. Each url
+                    is opened once and shared by the url pruning, station lookup, data and metadata reads.
+                    Call close() (or let the fetcher be collected) to release them
+        probe_workers: (int) If > 0 the urls are checked concurrently with probe_urls() (a .dds request each)
+                    instead of being opened one after the other. 0 (default) opens them
+        probe_timeout: (float) Seconds a url probe may take before the url is considered missing
+        station_index: A utilities.station_index.fort61_station_index. The fort.61 column of every station is
+                    looked up there instead of decoding station_name for every url. Default: an in memory index
+        node_index: A utilities.node_index.grid_node_index. For fort63_style, the stations are mapped to the nearest
+                    wet node of their lon/lat (columns lon, lat) instead of using the Node column. Also used
+                    (in memory) when station_id_list has no Node column
     """
+    source='ADCIRC'
     # dict( persistant tag: source speciific tag )
     products={ 'water_level':'water_level'  # 6 min
             }
@@ -229,16 +1624,31 @@ class adcirc_fetch_data(fetch_station_data):
     def _remove_empty_url_pointers(self, in_periods):
         """
         Loop through the entire list and remove any entries that thorw a File Not Found error
+        With probe_workers > 0 the urls are probed concurrently instead
         """
+        if self._probe_workers > 0:
+            new_periods=probe_urls(in_periods, workers=self._probe_workers, timeout=self._probe_timeout)
+            for url in in_periods:
+                if url not in new_periods:
+                    utilities.log.info('URL not found: Remove url {}'.format(url))
+            return new_periods
         new_periods=list()
         for url in in_periods:
             try:
-                nc = nc4.Dataset(url)
+                with NETCDF_LOCK:
+                    self._datasets.get(url)
                 new_periods.append(url)
             except OSError as e:
                 utilities.log.info('URL not found: Remove url {}'.format(url))
         return new_periods
 
+    def close(self):
+        """
+        Close the cached dataset handles
+        """
+        self._datasets.close()
+        super().close()
+
     def type_ADCIRC_cast(self, url, df):
         """
         Compute the URL starttime value to the time range in df. Ascertain if this
@@ -271,7 +1681,7 @@ class adcirc_fetch_data(fetch_station_data):
 #TODO change name periods to urls
     def __init__(self, station_id_list, periods=None, product='water_level',
                 datum='MSL', gridname='None', castType='None', resample_mins=15,
-                fort63_style=False):
+                fort63_style=False, bulk_read=False, max_open_datasets=8, probe_workers=0, probe_timeout=10, station_index=None, node_index=None, interpolate=False, read_gap=1000, max_workers=1, postprocess_workers=0, negative_cache=None, resample_method='first', max_gap_mins=None, memory_budget=None, request_timeout=60, hedge=False, deadline_secs=None, retry_attempts=0, retry_budget_secs=300):
         self._product=product
         #self._interval=interval 
         self._units='metric'
@@ -283,10 +1693,27 @@ class adcirc_fetch_data(fetch_station_data):
         if gridname=='None':
             utilities.log.info('ADCIRC: gridname not specified. Will result in poor metadata NAME value') 
         self._gridname=gridname
-
+        if interpolate and not fort63_style:
+            utilities.log.warn('ADCIRC: interpolate applies to fort63_style only: ignored')
+        self._interpolate=interpolate and fort63_style
+        self._weights=dict() # station -> barycentric weights of its element nodes
+        self._coords=None # station -> LAT/LON/OWNER, see _station_coords()
+        self._bulk_read=bulk_read or self._interpolate
+        self._fort63_style=fort63_style
+        self._read_gap=read_gap
+        self._read_plan={'read_gap': read_gap, 'hyperslabs': 0, 'nodes_requested': 0, 'nodes_read': 0}
+        self._bulk_data=dict() # url -> the shared arrays of a bulk read
+        self._datasets=netcdf_dataset_cache(max_open_datasets)
+        self._probe_workers=probe_workers if probe_workers is not None else 0
+        self._probe_timeout=probe_timeout
+        self._station_index=station_index if station_index is not None else fort61_station_index()
+        self._node_index=node_index
+
+        # Prune the missing urls first (concurrently with probe_workers) so the station lookup never opens them
+        periods = self._remove_empty_url_pointers(periods)
         if fort63_style:
             utilities.log.info('Fetch station ids using fort.63 style')
-            available_stations = self._fetch_adcirc_nodes_from_fort63_input_file(station_id_list)
+            available_stations = self._fetch_adcirc_nodes_from_fort63_input_file(station_id_list, periods)
         else:
             utilities.log.info('Fetch station ids using fort.61 style')
             available_stations = self._fetch_adcirc_nodes_from_fort61_input_file(station_id_list, periods)
@@ -294,15 +1721,17 @@ class adcirc_fetch_data(fetch_station_data):
             utilities.log.error('No valid fort.61 files were found: Abort')
             #sys.exit(1)
         utilities.log.info('List of ADCIRC generated stations {}'.format(available_stations))
-        periods = self._remove_empty_url_pointers(periods)
-        super().__init__(available_stations, periods, resample_mins=resample_mins) # Pass in the full dict
+        # No adaptive concurrency: the netCDF reads are serialized by NETCDF_LOCK so there is nothing for the AIMD limiter to adapt
+        super().__init__(available_stations, periods, resample_mins=resample_mins, max_workers=max_workers, postprocess_workers=postprocess_workers, negative_cache=negative_cache, resample_method=resample_method, max_gap_mins=max_gap_mins, memory_budget=memory_budget, adaptive_concurrency=False, request_timeout=request_timeout, hedge=hedge, deadline_secs=deadline_secs, retry_attempts=retry_attempts, retry_budget_secs=retry_budget_secs) # Pass in the full dict
 
-    def _fetch_adcirc_nodes_from_fort63_input_file(self, station_df) -> list():
+    def _fetch_adcirc_nodes_from_fort63_input_file(self, station_df, periods=None) -> list():
         """
         have one or more of the requested urls. So we keep checking urls for stations until no more
         urls exist. If none, then die.
 
         The Node index is DEPRECATED by one to better share subsequent code
+        With a node_index (or without a Node column) the nodes are instead the nearest wet nodes of the
+        station lon/lat, found in the grid_node_index of the first url that can be opened
 
         Input:
             station_csv <str>. A list of station ids/Nodes in DataFrame format
@@ -311,6 +1740,10 @@ class adcirc_fetch_data(fetch_station_data):
         Return: list of tuples (stationid,nodeid). Superfluous stationids are ignored
         """
         utilities.log.info('Attempt to find ADCIRC fort_63 stations/Nodes')
+        if self._interpolate:
+            return self._fetch_adcirc_elements(station_df, periods)
+        if self._node_index is not None or 'Node' not in station_df.columns:
+            return self._fetch_adcirc_nearest_nodes(station_df, periods)
         try:
             idx=list()
             utilities.log.info('Fetch stations fort63 style: {} ')
@@ -323,55 +1756,124 @@ class adcirc_fetch_data(fetch_station_data):
             utilities.log.error('fort_63_style. Input file problematic {} {}: Abort'.format(station_df, e))
             sys.exit(1)
 
+    def _fetch_adcirc_nearest_nodes(self, station_df, periods) -> list():
+        """
+        Resolve the station lon/lat (columns lon, lat) to the nearest wet grid nodes
+
+        Return: list of tuples (stationid,nodeid), nodeid 0 based
+        """
+        node_index = self._node_index if self._node_index is not None else grid_node_index()
+        for url63 in periods if periods is not None else list():
+            try:
+                with NETCDF_LOCK:
+                    nc = self._datasets.get(url63)
+                    nodes, distance = node_index.nearest(self._url_grid(url63), nc, station_df['lon'].values, station_df['lat'].values)
+            except OSError:
+                utilities.log.warn("Could not open/read a specific fort.63 URL. Try next iteration {}".format(url63))
+                continue
+            station_ids = station_df['stationid'].astype(str).tolist()
+            for station, node, km in zip(station_ids, nodes, distance):
+                if km > NODE_DISTANCE_WARN_KM:
+                    utilities.log.warn('Nearest wet node {} of station {} is {:.1f} km away'.format(node, station, km))
+            return list(zip(station_ids, nodes.tolist()))
+        utilities.log.error('fort_63_style. No fort.63 url could be opened to find the nearest nodes: Abort')
+        sys.exit(1)
+
+    def _fetch_adcirc_elements(self, station_df, periods) -> list():
+        """
+        Locate the mesh element containing each station lon/lat (columns lon, lat) and keep the barycentric
+        weights of its three nodes. Stations outside the mesh are dropped
+
+        Return: list of tuples (stationid,(node1,node2,node3)), nodes 0 based
+        """
+        node_index = self._node_index if self._node_index is not None else grid_node_index()
+        for url63 in periods if periods is not None else list():
+            try:
+                with NETCDF_LOCK:
+                    nc = self._datasets.get(url63)
+                    vertices, weights, inside = node_index.elements(self._url_grid(url63), nc, station_df['lon'].values, station_df['lat'].values)
+            except OSError:
+                utilities.log.warn("Could not open/read a specific fort.63 URL. Try next iteration {}".format(url63))
+                continue
+            idx = list()
+            for station, nodes, w, found in zip(station_df['stationid'].astype(str), vertices.tolist(), weights, inside):
+                if not found:
+                    utilities.log.info('{} is outside the fort.63 mesh'.format(station))
+                    continue
+                self._weights[station] = np.asarray(w)
+                idx.append((station, tuple(nodes)))
+            return idx
+        utilities.log.error('fort_63_style. No fort.63 url could be opened to locate the station elements: Abort')
+        sys.exit(1)
+
+    def _url_layout(self, url) -> tuple:
+        """
+        The grid and instance a url is cached under (ADCIRC_GRID_COORDS, station and node indexes). An ASGS url
+        of the gridname of the fetcher (.../gridname/machine/instance/ensemble/fort.6x.nc) gives the gridname and
+        its instance, shared by every cycle. Any other url (gridname not given, local or non ASGS paths) gives
+        a digest of its full directory and no instance, so unrelated files never share an entry
+
+        Return:
+            tuple (grid, instance)
+        """
+        words = url.split('/')
+        if len(words) >= 5 and str(self._gridname).lower() not in ('none', '') and words[-5].lower()==str(self._gridname).lower():
+            return self._gridname, words[-3]
+        return 'url-{}'.format(hashlib.sha1(os.path.dirname(url).encode('utf-8')).hexdigest()[:16]), None
+
+    def _url_grid(self, url) -> str:
+        return self._url_layout(url)[0]
+
+    def _station_index_key(self, url, stations) -> str:
+        """
+        The station index key of a url: its grid and instance (see _url_layout) and the requested stations
+        """
+        grid, instance = self._url_layout(url)
+        return fort61_station_index.key(grid, instance, stations)
+
     def _fetch_adcirc_nodes_from_fort61_input_file(self, stations, periods) -> list(): 
         """
-        periods contains all the possible urls. We do this because TDS may or may not actually
-        have one or more of the requested urls. So we keep checking urls for stations until no more
-        urls exist. If none, then die.
+        periods contains the available urls (see _remove_empty_url_pointers). The urls of a run share
+        one station layout, so they are tried in turn until one can be read and the rest are not opened.
+        If none, then die.
+        The station_name columns are looked up in the fetcher's fort61_station_index and only decoded
+        when the index has no entry matching the file station count
 
         Input:
             station <str>. A list of (eg NOAA/Contrails) station ids
-            periods <list>. The list of url-61 values. 
+            periods <list>. The list of available url-61 values. 
 
-        Return: list of tuples (stationid,nodeid). Superfluous stationids are ignored
+        Return: list of tuples (stationid,nodeid) in station order. Superfluous stationids are ignored
         """
         utilities.log.info('Attempt to find ADCIRC stations')
         full_idx=list()
+        builds=self._station_index.builds
         for url61 in periods:
             utilities.log.info('Fetch stations: {} '.format(url61))
             try:
-                ds = xr.open_dataset(url61)
-                ds = ds.transpose()
-                ds.attrs = []
-                sn = ds['station_name'].values
-                snn = []
-                for i in range(len(sn)): # This gets the stationids IN THE FILE not necc what we requested.
-                    ts = str(sn[i].strip().decode("utf-8"))
-                    #print(ts)
-                    snn.append(str(ts.split(' ')[0])) # Strips off actual name leaving only the leading id
-                # Get intersection of input station ids and available ids
-                snn_pruned=[str(x) for x in stations if x in snn]
-                idx = list() # Build a list of tuples (stationid,nodeid)
-                for ss in stations: # Loop over stations to maintain order
-                    s = ss # Supposed to pull out the first word
-                    # Cnvert to a try clause
-                    if s in snn_pruned:
-                        utilities.log.debug("{} is in list.".format(s))
-                        idx.append( (s,snn.index(s)) )
-                    else:
+                with NETCDF_LOCK:
+                    nc = self._datasets.get(url61)
+                    nstations = len(nc.dimensions['station'])
+                    key = self._station_index_key(url61, stations)
+                    columns = self._station_index.lookup(key, nstations) # Cheap check against the file station count
+                    if columns is None: # This gets the stationids IN THE FILE not necc what we requested.
+                        utilities.log.info('Build the fort.61 station index of {}'.format(url61))
+                        columns = self._station_index.build(key, nc.variables['station_name'][:], stations)
+                idx = [(s, columns[str(s)]) for s in stations if str(s) in columns] # Loop over stations to maintain order
+                for s in stations:
+                    if str(s) not in columns:
                         utilities.log.info("{} not in fort.61.nc station_name list".format(s))
-                        ##sys.exit(1)
-                # Remove duplicate tuples that were found across multiple URLs in the periods
-                # return idx # Need this to get around loop structure in aggregate etch 
             except OSError:
                 utilities.log.warn("Could not open/read a specific fort.61 URL. Try next iteration {}".format(url61))
+                continue
             except Exception:
                 utilities.log.error('Could not find ANY fort.61 urls from which to get stations lists')
                 utilities.log.info('Bottomed out in _fetch_adcirc_nodes_from_fort61_input_file')
                 raise
-            full_idx+=idx
-        # Remove any duplicate tuples eg if len(periods) > 1
-        full_idx = list(set([i for i in full_idx]))
+            full_idx = idx
+            break
+        if self._station_index.builds > builds:
+            self._station_index.save() # No lock: concurrent jobs saving the index file are last writer wins
         return full_idx
         #return np.nan
 
@@ -400,17 +1902,27 @@ class adcirc_fetch_data(fetch_station_data):
         datalist=list()
         typeCast_status=list() # Check each period to see if this was a nowcast or forecast type fetch. If mixed then abort
         for url in periods: # If a period is SHORT no data may be found esp for Contrails
-            try:
-                nc = nc4.Dataset(url)
-            except OSError as e:
-                utilities.log.error('URL not found should never happen here. Should have been prefiltered')
-                sys.exit(1)
-            # we need to test access to the netCDF variables, due to infrequent issues with
-            # netCDF files written with v1.8 of HDF5.
-            if "zeta" not in nc.variables.keys():
-                print("zeta not found in netCDF for {}.".format(url))
-                # okay to have a missing one  do not exit # sys.exit(1)
-            else:
+            if self._bulk_read:
+                bulk = self._bulk_url_data(url, station_tuple)
+                if bulk is None:
+                    continue
+                dx = pd.DataFrame(self._bulk_values(bulk, 'zeta', station_tuple), index=bulk['times'], columns=[station])
+                typeCast_status.append(bulk['typeCast'])
+                datalist.append(dx)
+                continue
+            with NETCDF_LOCK: # netCDF4/HDF5 are not thread safe
+                started = tm.time()
+                try:
+                    nc = self._datasets.get(url)
+                except OSError as e:
+                    utilities.log.error('URL not found should never happen here. Should have been prefiltered')
+                    sys.exit(1)
+                # we need to test access to the netCDF variables, due to infrequent issues with
+                # netCDF files written with v1.8 of HDF5.
+                if "zeta" not in nc.variables.keys():
+                    print("zeta not found in netCDF for {}.".format(url))
+                    # okay to have a missing one  do not exit # sys.exit(1)
+                    continue
                 time_var = nc.variables['time']
                 t = nc4.num2date(time_var[:], time_var.units)
                 data = np.empty([len(t), 0])
@@ -419,14 +1931,15 @@ class adcirc_fetch_data(fetch_station_data):
                 except IndexError as e:
                     utilities.log.error('Error: This is usually caused by accessing non-hsofs data but forgetting to specify the proper --grid {}'.format(e))
                     #sys.exit()
-                np.place(data, data < -1000, np.nan)
-                dx = pd.DataFrame(data, columns=[str(node)], index=t)
-                dx.columns=[station]
-                dx.index.name='TIME'
-                typeCast_status.append(self.type_ADCIRC_cast(url, dx))
-                # Now some fudging to account for Pandas timestamp capability changes
-                dx.index = pd.to_datetime(dx.index.astype(str)) # New pandas can only do this to strings now
-                datalist.append(dx)
+                self._record_request(station_tuple, started, data.nbytes + time_var.size*time_var.dtype.itemsize)
+            np.place(data, data < -1000, np.nan)
+            dx = pd.DataFrame(data, columns=[str(node)], index=t)
+            dx.columns=[station]
+            dx.index.name='TIME'
+            typeCast_status.append(self.type_ADCIRC_cast(url, dx))
+            # Now some fudging to account for Pandas timestamp capability changes
+            dx.index = pd.to_datetime(dx.index.astype(str)) # New pandas can only do this to strings now
+            datalist.append(dx)
         try:
             df_data = pd.concat(datalist)
         except Exception as e:
@@ -439,6 +1952,91 @@ class adcirc_fetch_data(fetch_station_data):
         utilities.log.info('ADCIRC type determined to be {}'.format(self._typeCast))
         return df_data
 
+    def _start_run(self):
+        super()._start_run()
+        with NETCDF_LOCK:
+            self._bulk_data=dict() # Each data aggregation reads the urls afresh
+            self._read_plan={'read_gap': self._read_gap, 'hyperslabs': 0, 'nodes_requested': 0, 'nodes_read': 0}
+
+    def _bulk_url_data(self, url, station_tuple):
+        """
+        Return the time index, the whole zeta array (nans for dry/missing values), the node x/y and the
+        cast type of a url, reading them in a single pass the first time the url is requested.
+        For fort63_style only the station nodes are read (one request per planned hyperslab) and
+        'columns' maps each node to its zeta/x/y column.
+        The reads are recorded against the station that triggered them
+
+        Return:
+            dict, or None if the url has no zeta variable
+        """
+        with NETCDF_LOCK:
+            if url in self._bulk_data:
+                return self._bulk_data[url]
+            started = tm.time()
+            try:
+                nc = self._datasets.get(url)
+            except OSError as e:
+                utilities.log.error('URL not found should never happen here. Should have been prefiltered')
+                sys.exit(1)
+            if "zeta" not in nc.variables.keys():
+                print("zeta not found in netCDF for {}.".format(url))
+                self._bulk_data[url] = None
+                return None
+            time_var = nc.variables['time']
+            t = nc4.num2date(time_var[:], time_var.units)
+            source = nc.source
+            if self._fort63_style:
+                self._record_request(station_tuple, started, time_var.size*time_var.dtype.itemsize)
+                zeta, x, y, columns = self._read_hyperslabs(nc, station_tuple)
+            else:
+                zeta = nc['zeta'][:,:]
+                x = nc.variables['x'][:]
+                y = nc.variables['y'][:]
+                columns = dict()
+                self._record_request(station_tuple, started, zeta.nbytes + time_var.size*time_var.dtype.itemsize + x.nbytes + y.nbytes)
+            zeta = ma.filled(zeta, np.nan)
+            zeta[zeta < -1000] = np.nan
+            times = pd.to_datetime(pd.Index(t).astype(str)) # New pandas can only do this to strings now
+            times.name = 'TIME'
+            bulk = {'times': times, 'zeta': zeta, 'x': ma.filled(x, np.nan), 'y': ma.filled(y, np.nan), 'columns': columns,
+                    'source': source, 'typeCast': self.type_ADCIRC_cast(url, pd.DataFrame(index=times))}
+            utilities.log.info('ADCIRC bulk read of {} times x {} stations from {}'.format(zeta.shape[0], zeta.shape[1], url))
+            self._bulk_data[url] = bulk
+            return bulk
+
+    def _read_hyperslabs(self, nc, station_tuple):
+        """
+        Read zeta and x/y of the station nodes as the hyperslabs planned by plan_hyperslabs() and scatter the
+        columns back so that only the requested nodes are kept. Each hyperslab is one request. Called with the lock held
+
+        Return:
+            tuple (zeta, x, y, dict of node -> column)
+        """
+        nodes = sorted(set(n for station, node in self._stations for n in (node if isinstance(node, tuple) else (node,))))
+        slabs = plan_hyperslabs(nodes, self._read_gap)
+        blocks, xs, ys, read = list(), list(), list(), list()
+        for slab in slabs:
+            started = tm.time()
+            blocks.append(nc['zeta'][:,slab])
+            xs.append(nc.variables['x'][slab])
+            ys.append(nc.variables['y'][slab])
+            self._record_request(station_tuple, started, blocks[-1].nbytes + xs[-1].nbytes + ys[-1].nbytes)
+            read.extend(range(slab.start, slab.stop, slab.step))
+        position = dict(zip(read, range(len(read))))
+        keep = [position[node] for node in nodes]
+        self._read_plan['hyperslabs'] += len(slabs)
+        self._read_plan['nodes_requested'] += len(nodes)
+        self._read_plan['nodes_read'] += len(read)
+        utilities.log.info('ADCIRC read {} nodes as {} hyperslabs ({} nodes read)'.format(len(nodes), len(slabs), len(read)))
+        return (ma.concatenate(blocks, axis=1)[:,keep], ma.concatenate(xs)[keep], ma.concatenate(ys)[keep],
+                dict(zip(nodes, range(len(nodes)))))
+
+    def _build_run_report(self, excludedStations) -> dict:
+        report = super()._build_run_report(excludedStations)
+        if self._read_plan['hyperslabs'] > 0:
+            report['read_plan'] = dict(self._read_plan)
+        return report
+
 ##
 ## The nodelat/nodelon objects are masked arrays. For a single node (as used here)
 ## the ma.getdata() returns an ndarray of shape=() but with the a single value.
@@ -451,35 +2049,106 @@ class adcirc_fetch_data(fetch_station_data):
         Input:
             station <str>. A valid station id
 
+        The coordinates come from _station_coords(): no per station read
+
         Return:
             dataframe of time (timestamps) vs values for the requested nodes 
         """
         station=station_tuple[0]
-        node=station_tuple[1]
-        meta=dict()
-        periods=self._periods
+        coords=self._station_coords().get(station, dict())
+        return self._build_station_metadata(station, coords)
 
-        for url in periods:
-            nc = nc4.Dataset(url)
-            # we need to test access to the netCDF variables, due to infrequent issues with
-            # netCDF files written with v1.8 of HDF5.
-            try:
-                nodelon=nc.variables['x'][node]
-                nodelat=nc.variables['y'][node]
-                break; # If we found it no need to check other urls
-            except IndexError as e:
-                utilities.log.error('Meta Error:{}'.format(e))
-                #sys.exit()
-        lat = float(ma.getdata(nodelat))
-        lon = float(ma.getdata(nodelon))
-        meta['LAT'] = lat 
-        meta['LON'] = lon 
+    def _grid_coords_key(self, url, nc) -> tuple:
+        """
+        fort.63 node coordinates only depend on the grid. fort.61 station columns also depend on the instance
+        """
+        grid, instance = self._url_layout(url)
+        return (grid, None if self._fort63_style else instance, len(nc.variables['x']))
+
+    def _station_coords(self) -> dict:
+        """
+        The LAT/LON/OWNER of every station, built at once. The x/y of all the station nodes are read in one go
+        (the whole, small, arrays of a fort.61 file or the hyperslabs planned over the fort.63 nodes) from the first
+        url that opens and kept in ADCIRC_GRID_COORDS, so other fetchers of the same grid need no read at all.
+        Interpolated stations get the weighted lon/lat of their element nodes
+
+        Return:
+            dict of station id -> dict of LAT, LON, OWNER. Stations whose node is not in the grid are left out
+        """
+        with NETCDF_LOCK:
+            if self._coords is not None:
+                return self._coords
+            nodes = sorted(set(n for station, node in self._stations for n in (node if isinstance(node, tuple) else (node,))))
+            grid = None
+            for url in self._periods:
+                try:
+                    nc = self._datasets.get(url)
+                except OSError:
+                    continue
+                grid = ADCIRC_GRID_COORDS.setdefault(self._grid_coords_key(url, nc), {'source': nc.source, 'coords': dict()})
+                missing = [node for node in nodes if node not in grid['coords']]
+                if len(missing) > 0:
+                    self._read_grid_coords(nc, missing, grid['coords'])
+                break
+            coords = dict()
+            for station, node in self._stations:
+                try:
+                    lonlat = np.array([grid['coords'][n] for n in (node if isinstance(node, tuple) else (node,))])
+                except (KeyError, TypeError):
+                    utilities.log.error('Meta Error: no coordinates for station {} node {}'.format(station, node))
+                    continue
+                lon, lat = self._weights[station] @ lonlat if isinstance(node, tuple) else lonlat[0]
+                coords[station] = {'LAT': float(lat), 'LON': float(lon), 'OWNER': grid['source']}
+            self._coords = coords
+            return coords
+
+    def _read_grid_coords(self, nc, nodes, grid_coords):
+        """
+        Read the x/y of nodes into grid_coords (node -> (lon, lat)). Called with the lock held
+        """
+        size = len(nc.variables['x'])
+        valid = [node for node in nodes if 0 <= node < size]
+        if len(valid) < len(nodes):
+            utilities.log.error('Meta Error: nodes {} are not in the grid ({} nodes)'.format(sorted(set(nodes)-set(valid)), size))
+        if self._fort63_style:
+            slabs = plan_hyperslabs(valid, self._read_gap)
+            read = [node for slab in slabs for node in range(slab.start, slab.stop, slab.step)]
+            x = ma.concatenate([nc.variables['x'][slab] for slab in slabs]+[np.empty(0)])
+            y = ma.concatenate([nc.variables['y'][slab] for slab in slabs]+[np.empty(0)])
+        else:
+            read = list(range(size))
+            x = nc.variables['x'][:]
+            y = nc.variables['y'][:]
+        position = dict(zip(read, range(len(read))))
+        x = ma.filled(x, np.nan)
+        y = ma.filled(y, np.nan)
+        for node in valid:
+            grid_coords[node] = (float(x[position[node]]), float(y[position[node]]))
+
+    def _bulk_values(self, bulk, name, station_tuple):
+        """
+        The zeta (times) or x/y values of a station from the arrays of a bulk read. An interpolated station is the
+        weighted sum of its element nodes (nan if any of them is dry)
+        """
+        station, node = station_tuple
+        if isinstance(node, tuple):
+            columns = [bulk['columns'][n] for n in node]
+            return bulk[name][...,columns] @ self._weights[station]
+        return bulk[name][...,bulk['columns'].get(node, node)]
+
+    def _build_station_metadata(self, station, coords) -> pd.DataFrame:
+        """
+        Build the metadata frame of a single station from previously read node coordinates
+        """
+        meta=dict()
+        meta['LAT'] = coords['LAT']
+        meta['LON'] = coords['LON']
         # meta['NAME']= nc.agrid # Long form of grid name description # Or possible use nc.version
         meta['NAME']='_'.join([self._gridname.upper(),self._castType.upper()]) # These values come from the calling routine and should be usually nowcast, forecast
         #meta['VERSION'] = nc.version
         meta['UNITS'] ='meters'
         meta['TZ'] = GLOBAL_TIMEZONE # Can look in nc.comments
-        meta['OWNER'] = nc.source
+        meta['OWNER'] = coords['OWNER']
         meta['STATE'] = np.nan 
         meta['COUNTY'] = np.nan 
         df_meta=pd.DataFrame.from_dict(meta, orient='index')
@@ -505,6 +2174,7 @@ class noaanos_fetch_data(fetch_station_data):
         the units for how the data were stored not fetched. So it wouid be easay for the calling program to get confused.
         Let the caller choose to update units and modify the df_meta structure prior to DB uploads
     """
+    source='NOAA'
     # dict( persistant tag: source specific tag )
     # products defines current products (as keys) and uses the value as a column header in the returned data set
     products={ 'water_level':'water_level',  # 6 min
@@ -513,8 +2183,13 @@ class noaanos_fetch_data(fetch_station_data):
                'hourly_height':'water_level', # hourly
                'wind':'spd'}
 
+    # The CO-OPS data API used directly by the async engine (noaa_coops is requests based)
+    DATAGETTER_URL='https://api.tidesandcurrents.noaa.gov/api/prod/datagetter'
+    # Max number of days CO-OPS will return in a single request. 6min products are limited to 31 days
+    MAX_BLOCK_DAYS={'water_level':31, 'predictions':31, 'air_pressure':31, 'hourly_height':365, 'wind':31}
+
     def __init__(self, station_id_list, periods, product='water_level', interval=None, units='metric', 
-                datum='MSL', resample_mins=15):
+                datum='MSL', resample_mins=15, max_workers=1, postprocess_workers=0, negative_cache=None, resample_method='first', max_gap_mins=None, memory_budget=None, adaptive_concurrency=False, request_timeout=60, hedge=False, deadline_secs=None, retry_attempts=0, retry_budget_secs=300):
         """
         An interval value of None default to 6 mins. If choosing Tidal or Hourhy Height specify interval as h
         """
@@ -528,7 +2203,7 @@ class noaanos_fetch_data(fetch_station_data):
             self._interval=interval
         self._units='metric' # Redundant cleanup TODO
         self._datum=datum
-        super().__init__(station_id_list, periods, resample_mins=resample_mins)
+        super().__init__(station_id_list, periods, resample_mins=resample_mins, max_workers=max_workers, postprocess_workers=postprocess_workers, negative_cache=negative_cache, resample_method=resample_method, max_gap_mins=max_gap_mins, memory_budget=memory_budget, adaptive_concurrency=adaptive_concurrency, request_timeout=request_timeout, hedge=hedge, deadline_secs=deadline_secs, retry_attempts=retry_attempts, retry_budget_secs=retry_budget_secs)
 
     def check_duplicate_time_entries(self, station, stationdata):
         """
@@ -554,7 +2229,7 @@ class noaanos_fetch_data(fetch_station_data):
 # The weirdness with tstart/tend. Prior work by us indicated noaa coops reqs time formats of %Y%m%d %H:%M')
 # Even though their website says otherwise (as of Oct 2021)
 
-    def fetch_single_product(self, station, time_range) -> pd.DataFrame:
+    def fetch_single_product(self, station, time_range, location=None) -> pd.DataFrame:
         """
         For a single NOAA NOS site_id, process all the tuples from the input periods list
         and aggregate them into a dataframe with index pd.timestamps and a single column
@@ -566,6 +2241,7 @@ class noaanos_fetch_data(fetch_station_data):
         Input:
             station <str>. A valid station id
             time_range <tuple>. Start and end times (<str>,<str>) denoting time ranges
+            location <coops.Station>. An optional, already constructed, station handle
 
         Return:
             dataframe of time (timestamps) vs values for the requested station
@@ -576,14 +2252,21 @@ class noaanos_fetch_data(fetch_station_data):
         timeout =  pd.Timestamp(tend).strftime('%Y%m%d %H:%M')
         try:
             stationdata = pd.DataFrame()
-            location = coops.Station(station)
-            dx = location.get_data(begin_date=timein,
-                                            end_date=timeout,
-                                            product=self._product,
-                                            datum=self._datum,
-                                            units=self._units,
-                                            interval=self._interval, # If none defaults to 6min
-                                            time_zone=GLOBAL_TIMEZONE)[self.products[self._product]].to_frame()
+            if location is None:
+                with self._request_slot():
+                    started = tm.time()
+                    location = coops.Station(station)
+                    self._record_request(station, started)
+            with self._request_slot():
+                started = tm.time()
+                dx = location.get_data(begin_date=timein,
+                                                end_date=timeout,
+                                                product=self._product,
+                                                datum=self._datum,
+                                                units=self._units,
+                                                interval=self._interval, # If none defaults to 6min
+                                                time_zone=GLOBAL_TIMEZONE)[self.products[self._product]].to_frame()
+                self._record_request(station, started) # noaa_coops does not expose the bytes received
             df_data, multivalue = self.check_duplicate_time_entries(station, dx)
             # Put checks in here in case we want to exclude these stations with multiple values
             df_data.reset_index(inplace=True)
@@ -607,14 +2290,100 @@ class noaanos_fetch_data(fetch_station_data):
             df_data = np.nan
         return df_data
 
+    def return_list_of_block_timeranges(self, time_range) -> list():
+        """
+        Split the input time range into the contiguous blocks accepted by a single CO-OPS request
+
+        Input:
+            time_range <tuple>. Start and end times (<str>,<str>)
+        Return:
+            List of (begin,end) tuples of pd.Timestamps
+        """
+        tstart,tend = pd.Timestamp(time_range[0]), pd.Timestamp(time_range[1])
+        block = pd.Timedelta(days=self.MAX_BLOCK_DAYS.get(self._product, 31))
+        blocks = list()
+        while tstart < tend:
+            blocks.append( (tstart, min(tstart+block, tend)) )
+            tstart = tstart + block
+        return blocks if len(blocks) > 0 else [(tstart,tend)]
+
+    def _datagetter_query(self, station, begin, end) -> dict:
+        """
+        The CO-OPS datagetter query equivalent to what noaa_coops builds for get_data()
+        """
+        indict = {'begin_date': begin.strftime('%Y%m%d %H:%M'), 'end_date': end.strftime('%Y%m%d %H:%M'),
+                  'station': station, 'product': self._product, 'datum': self._datum,
+                  'units': self._units, 'time_zone': GLOBAL_TIMEZONE, 'format': 'json',
+                  'application': 'DataHarvesterSources'}
+        if self._interval is not None:
+            indict['interval'] = self._interval
+        return indict
+
+    def _parse_datagetter_response(self, station, content) -> pd.DataFrame:
+        """
+        Convert a CO-OPS json response into a dataframe with a date_time index and a column named
+        by self.products[self._product] (same layout as noaa_coops get_data())
+        """
+        json_dict = json.loads(content)
+        if 'error' in json_dict:
+            raise ValueError('CO-OPS API returned an error for {}: {}'.format(station, json_dict['error'].get('message')))
+        payload = json_dict['predictions'] if self._product=='predictions' else json_dict['data']
+        dx = pd.DataFrame(payload)
+        dx = pd.DataFrame({self.products[self._product]: pd.to_numeric(dx['v'], errors='coerce').values},
+                          index=pd.to_datetime(dx['t']))
+        dx.index.name='date_time'
+        return dx
+
+    async def fetch_single_product_async(self, station, time_range) -> pd.DataFrame:
+        """
+        Async analog of fetch_single_product. CO-OPS is queried directly over the shared session,
+        one request per CO-OPS block (usually only one)
+
+        Input:
+            station <str>. A valid station id
+            time_range <tuple>. Start and end times (<str>,<str>) denoting time ranges
+
+        Return:
+            dataframe of time (timestamps) vs values for the requested station
+        """
+        tstart,tend=time_range
+        utilities.log.info('NOAA/NOS:Iterate: start time is {}, end time is {}, station is {}'.format(tstart,tend,station))
+        try:
+            blocks = await asyncio.gather(*[self._async_get(self.DATAGETTER_URL, params=self._datagetter_query(station, begin, end), station=station)
+                                            for begin,end in self.return_list_of_block_timeranges(time_range)])
+            dx = pd.concat([self._parse_datagetter_response(station, content) for content in blocks])
+            df_data, multivalue = self.check_duplicate_time_entries(station, dx)
+            df_data.columns=[station]
+            df_data.index.name='TIME'
+            df_data=df_data.astype(float)
+        except Exception as e:
+            utilities.log.error('NOAA/NOS data error: {} was {}'.format(e, self._product))
+            df_data = np.nan
+        return df_data
+
+    def fetch_single_station(self, station, time_range):
+        """
+        Fetch product and metadata for a single station sharing one coops.Station handle.
+        Constructing the Station is itself a metadata request, so this halves the NOAA requests
+
+        Return:
+            tuple (product dataframe, metadata dataframe)
+        """
+        with self._request_slot():
+            started = tm.time()
+            location = coops.Station(station)
+            self._record_request(station, started)
+        return self.fetch_single_product(station, time_range, location=location), self.fetch_single_metadata(station, location=location)
+
 # TODO The NOAA metadata scheme is Horrible for what we need. This example is very tentative 
-    def fetch_single_metadata(self, station) -> pd.DataFrame:
+    def fetch_single_metadata(self, station, location=None) -> pd.DataFrame:
         """
         For a single NOAA site_id fetch the associated metadata.
         The choice of data is highly subjective at this time.
 
         Input:
              A valid station id <str>
+             location <coops.Station>. An optional, already constructed, station handle
         Return:
              dataframe of preselected metadata for a single station in the (keys,values) orientation
 
@@ -625,7 +2394,11 @@ class noaanos_fetch_data(fetch_station_data):
         """
         meta=dict()
         try:
-            location = coops.Station(station)
+            if location is None:
+                with self._request_slot():
+                    started = tm.time()
+                    location = coops.Station(station)
+                    self._record_request(station, started)
         except Exception as e:
             utilities.log.error('NOAA/NOS meta error: {}'.format(e))
         meta['LAT'] = location.metadata['lat'] if location.metadata['lat']!='' else np.nan
@@ -660,6 +2433,7 @@ class contrails_fetch_data(fetch_station_data):
         config: a dict containing values for domain <str>, method <str>, systemkey <str>
         a valid PRODUCT id <str>: See CLASSDICT definitions for specifics
     """
+    source='CONTRAILS'
     # dict( persistant tag: source speciific tag )
 
 # See Tom's email Regarding coastal versus river class values
@@ -696,7 +2470,7 @@ class contrails_fetch_data(fetch_station_data):
     # We expect the calling metyhod to have resolved the different MAP terms for a given source
     # Currently only tested with the NCEM owner
 
-    def __init__(self, station_id_list, periods, config, product='river_water_level', owner='NCEM', resample_mins=15):
+    def __init__(self, station_id_list, periods, config, product='river_water_level', owner='NCEM', resample_mins=15, max_workers=1, postprocess_workers=0, negative_cache=None, resample_method='first', max_gap_mins=None, memory_budget=None, adaptive_concurrency=False, request_timeout=60, hedge=False, deadline_secs=None, retry_attempts=0, retry_budget_secs=300):
         self._owner=owner
         try:
             self._product=self.products[product] # product
@@ -708,7 +2482,7 @@ class contrails_fetch_data(fetch_station_data):
         utilities.log.info('CONTRAILS Fetching product {}'.format(self._product))
         self._systemkey=config['systemkey']
         self._domain=config['domain']
-        super().__init__(station_id_list, periods, resample_mins=resample_mins)
+        super().__init__(station_id_list, periods, resample_mins=resample_mins, max_workers=max_workers, postprocess_workers=postprocess_workers, negative_cache=negative_cache, resample_method=resample_method, max_gap_mins=max_gap_mins, memory_budget=memory_budget, adaptive_concurrency=adaptive_concurrency, request_timeout=request_timeout, hedge=hedge, deadline_secs=deadline_secs, retry_attempts=retry_attempts, retry_budget_secs=retry_budget_secs)
 
     # Customized splitting of the timeranger into a list of day-centric tuples.
     # So far this only applied to CONTRAILS data sources
@@ -799,29 +2573,49 @@ class contrails_fetch_data(fetch_station_data):
         Return:
             dataframe of time (timestamps) vs values for the requested station
         """
-        METHOD = 'GetSensorData'
         datalist=list()
         periods = self.return_list_of_daily_timeranges(time_range)
         for tstart,tend in periods:
             utilities.log.info('Iterate: start time is {}, end time is {}, station is {}'.format(tstart,tend,station))
-            indict = {'method': METHOD, 'class': self.CLASSDICT[self._product],
-                 'system_key': self._systemkey ,'site_id': station,
-                 'tz': GLOBAL_TIMEZONE,
-                 'data_start': tstart,'data_end': tend }
-            url = self.build_url_for_contrails_station(self._domain,self._systemkey,indict)
+            url = self.build_url_for_contrails_station(self._domain,self._systemkey,self._sensor_data_query(station, tstart, tend))
             try:
-                response = requests.get(url)
-                dict_data = xmltodict.parse(response.content)
-                data = dict_data['onerain']['response']['general']
-                dx = pd.DataFrame(data['row']) # Will  be <= 5000
-                dx = dx[['data_time','data_value']]
-                utilities.log.info('Contrails. Converting to meters')
-                dx.columns = ['TIME',station]
-                dx.set_index('TIME',inplace=True)
-                dx.index = pd.to_datetime(dx.index)
-                datalist.append(dx)
+                with self._request_slot():
+                    response = self._http_get(url, station)
+                    response.raise_for_status()
+                datalist.append(self._parse_sensor_data(station, response.content))
             except Exception as e:
                 utilities.log.warn('Contrails response data error: Perhaps empty data contribution: {}'.format(e))
+        return self._concat_sensor_data(datalist)
+
+    def _sensor_data_query(self, station, tstart, tend) -> dict:
+        """
+        The GetSensorData query for a single station and (at most) daily time range
+        """
+        METHOD = 'GetSensorData'
+        indict = {'method': METHOD, 'class': self.CLASSDICT[self._product],
+             'system_key': self._systemkey ,'site_id': station,
+             'tz': GLOBAL_TIMEZONE,
+             'data_start': tstart,'data_end': tend }
+        return indict
+
+    def _parse_sensor_data(self, station, content) -> pd.DataFrame:
+        """
+        Convert a GetSensorData xml response into a dataframe of TIME vs station (in feet)
+        """
+        dict_data = xmltodict.parse(content)
+        data = dict_data['onerain']['response']['general']
+        dx = pd.DataFrame(data['row']) # Will  be <= 5000
+        dx = dx[['data_time','data_value']]
+        utilities.log.info('Contrails. Converting to meters')
+        dx.columns = ['TIME',station]
+        dx.set_index('TIME',inplace=True)
+        dx.index = pd.to_datetime(dx.index)
+        return dx
+
+    def _concat_sensor_data(self, datalist) -> pd.DataFrame:
+        """
+        Join the daily sub-window frames for a single station and convert to meters
+        """
         try:
             # Manually convert all values to meters
             df_data = pd.concat(datalist)
@@ -832,6 +2626,35 @@ class contrails_fetch_data(fetch_station_data):
             df_data=np.nan
         return df_data
 
+    async def _fetch_sensor_data_async(self, station, tstart, tend):
+        """
+        Fetch a single daily sub-window on the shared session. Empty or bad windows return None
+        """
+        utilities.log.info('Iterate: start time is {}, end time is {}, station is {}'.format(tstart,tend,station))
+        url = self.build_url_for_contrails_station(self._domain,self._systemkey,self._sensor_data_query(station, tstart, tend))
+        try:
+            content = await self._async_get(url, station=station)
+            return self._parse_sensor_data(station, content)
+        except Exception as e:
+            utilities.log.warn('Contrails response data error: Perhaps empty data contribution: {}'.format(e))
+            return None
+
+    async def fetch_single_product_async(self, station, time_range) -> pd.DataFrame:
+        """
+        Async analog of fetch_single_product. Every daily sub-window is requested concurrently
+        over the shared session (subject to the max_in_flight limit)
+
+        Input:
+            station <str>. A valid station id
+            time_range <tuple>. Start and end times (<str>,<str>) denoting time ranges
+
+        Return:
+            dataframe of time (timestamps) vs values for the requested station
+        """
+        periods = self.return_list_of_daily_timeranges(time_range)
+        windows = await asyncio.gather(*[self._fetch_sensor_data_async(station, tstart, tend) for tstart,tend in periods])
+        return self._concat_sensor_data([dx for dx in windows if dx is not None])
+
 # Note it is possible to get all station metadata but only a subset of station data
 # According to oneRain the current best way to access the meta data is using or_site_id
 #
@@ -862,7 +2685,9 @@ class contrails_fetch_data(fetch_station_data):
         indict = {'method': METHOD,'tz':GLOBAL_TIMEZONE, 'class': self.CLASSDICT[self._product],
              'system_key': self._systemkey ,'site_id': station }
         url = self.build_url_for_contrails_station(self._domain,self._systemkey,indict)
-        response = requests.get(url)
+        with self._request_slot():
+            response = self._http_get(url, station)
+            response.raise_for_status()
         dict_data = xmltodict.parse(response.content)
         data = dict_data['onerain']['response']['general']['row']
 
@@ -883,7 +2708,8 @@ class contrails_fetch_data(fetch_station_data):
              'system_key': self._systemkey ,'or_site_id': or_site_id }
         url = self.build_url_for_contrails_station(self._domain,self._systemkey,indict)
         try:
-            response = requests.get(url)
+            with self._request_slot():
+                response = self._http_get(url, station)
         except Exception as e:
             utilities.log.error('Contrails response meta error: {}'.format(e))
         dict_data = xmltodict.parse(response.content)
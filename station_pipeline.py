@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+#
+# A staged runner for the fetch_station_data subclasses:
+#
+#    fetch (fetch_workers threads) -> clean (clean_workers threads: interpolate/resample) -> write (one thread)
+#
+# The stages are joined by bounded queues. While station N+1 is being downloaded, station N is being
+# cleaned and station N-1 is being appended to the output csv. When a downstream stage falls behind its
+# input queue fills up and the upstream stage blocks (backpressure), so at most about
+# fetch_workers + clean_workers + 2*queue_size stations are held in memory at any time.
+#
+# With retry_attempts on the fetcher the stations that failed (or returned no data) are held back by the
+# fetch stage and re-fetched (see fetch_station_data._with_retries) once every station has been tried.
+#
+# Usage:
+#    noaanos = noaanos_fetch_data(stations, time_range, 'water_level')
+#    pipeline = station_pipeline(noaanos, fetch_workers=8, clean_workers=2, queue_size=4)
+#    written = pipeline.run('noaa_stationdata.csv')
+#
+
+import queue
+import threading
+import time as tm
+from concurrent.futures import Future
+from fetch_station_data import write_station_frames, StationSkipped
+from utilities.utilities import utilities
+
+_DONE = object() # End of stream marker placed on the queues
+
+class station_pipeline(object):
+    """
+    Input:
+        fetcher: A fetch_station_data subclass instance (its station list, periods, negative cache and
+            post processing settings are used as is)
+        fetch_workers: (int) Number of concurrent fetches. Default: the fetcher max_workers
+        clean_workers: (int) Number of concurrent interpolate/resample workers. With postprocess_workers > 0
+            on the fetcher the work itself runs in its process pool
+        queue_size: (int) Capacity of each of the fetch->clean and clean->write queues
+    """
+    def __init__(self, fetcher, fetch_workers=None, clean_workers=1, queue_size=4):
+        self._fetcher=fetcher
+        self._fetch_workers=max(1, fetch_workers if fetch_workers is not None else fetcher._max_workers)
+        self._clean_workers=max(1, clean_workers)
+        self._queue_size=max(1, queue_size)
+        self.stage_report=None
+
+    def _stage_stats(self, name, workers):
+        return {'stage': name, 'workers': workers, 'busy_secs': 0.0, 'blocked_secs': 0.0, 'max_queued': 0}
+
+    def _put(self, out_queue, item, stats):
+        """
+        Put on a bounded queue, accounting for the time spent blocked by a full queue (backpressure)
+        """
+        started = tm.time()
+        out_queue.put(item)
+        with self._lock:
+            stats['blocked_secs'] += tm.time()-started
+            stats['max_queued'] = max(stats['max_queued'], out_queue.qsize())
+
+    def _fetch_product(self, station):
+        return self._fetcher._checked_station_frame(station, self._fetcher.fetch_single_product(station, self._fetcher._periods))
+
+    def _fetch_stage(self, stations, out_queue, failed, stats):
+        fetcher = self._fetcher
+        while True:
+            try:
+                station = stations.get_nowait()
+            except queue.Empty:
+                return
+            started = tm.time()
+            try:
+                dx = fetcher._run_station(self._fetch_product, station)
+                item = (station, dx, None)
+            except Exception as ex:
+                item = (station, None, ex)
+            with self._lock:
+                stats['busy_secs'] += tm.time()-started
+            if item[2] is not None and fetcher._retry_attempts > 0 and not isinstance(item[2], StationSkipped):
+                with self._lock:
+                    failed.append(item) # Retried once every station has been tried
+                continue
+            self._put(out_queue, item, stats)
+
+    def _retry_stage(self, failed, out_queue, stats):
+        """
+        Run the retry rounds of the fetcher over the stations the fetch stage held back, passing on each
+        station as it recovers (or, at the end, with its last exception)
+        """
+        if len(failed)==0:
+            return
+        started = tm.time()
+        for item in self._fetcher._with_retries(iter(failed), self._fetch_product):
+            with self._lock:
+                stats['busy_secs'] += tm.time()-started
+            self._put(out_queue, item, stats)
+            started = tm.time()
+
+    def _clean_stage(self, in_queue, out_queue, stats):
+        fetcher = self._fetcher
+        while True:
+            item = in_queue.get()
+            if item is _DONE:
+                return
+            station, dx, ex = item
+            started = tm.time()
+            if ex is None:
+                try:
+                    dx = fetcher._process_station_frame(station, dx)
+                    if isinstance(dx, Future): # Processed in the fetcher pool. This stage is the one that waits
+                        dx = dx.result()
+                except Exception as e:
+                    fetcher._station_telemetry(station)['exception'] = type(e).__name__
+                    dx, ex = None, e
+            with self._lock:
+                stats['busy_secs'] += tm.time()-started
+            self._put(out_queue, (station, dx, ex), stats)
+
+    def _write_stream(self, in_queue, outcomes, excludedStations, stats):
+        """
+        Generator feeding write_station_frames from the clean->write queue
+        """
+        template = "An exception of type {0} occurred. Arguments:\n{1!r}"
+        while True:
+            item = in_queue.get()
+            if item is _DONE:
+                return
+            station, dx, ex = item
+            outcomes.append((station, ex))
+            if ex is not None:
+                excludedStations.append(station)
+                message = template.format(type(ex).__name__, ex.args)
+                utilities.log.warn('Error Value: Probably the station simply had no data; Skip {}, msg {}'.format(station, message))
+                continue
+            started = tm.time()
+            yield station, dx
+            stats['busy_secs'] += tm.time()-started
+
+    def run(self, filename, product='WATER_LEVEL') -> list():
+        """
+        Fetch, clean and append every station to filename (long format, see write_station_frames)
+        The fetcher run_report is built at the end and includes a per stage summary under 'pipeline'
+
+        Return:
+            list of the stations written (in completion order)
+        """
+        fetcher = self._fetcher
+        fetcher._start_run()
+        self._lock = threading.Lock()
+        utilities.log.info('Pipeline: {} stations, {} fetch workers, {} clean workers, queues of {}'.format(
+                           len(fetcher._stations), self._fetch_workers, self._clean_workers, self._queue_size))
+        stations = queue.Queue()
+        for station in fetcher._stations:
+            stations.put(station)
+        fetched = queue.Queue(maxsize=self._queue_size)
+        cleaned = queue.Queue(maxsize=self._queue_size)
+        stats = [self._stage_stats('fetch', self._fetch_workers), self._stage_stats('clean', self._clean_workers),
+                 self._stage_stats('write', 1)]
+        outcomes = list()
+        excludedStations = list()
+        failed = list()
+        with fetcher._postprocessing():
+            fetchers = [threading.Thread(target=self._fetch_stage, args=(stations, fetched, failed, stats[0]), daemon=True)
+                        for i in range(self._fetch_workers)]
+            cleaners = [threading.Thread(target=self._clean_stage, args=(fetched, cleaned, stats[1]), daemon=True)
+                        for i in range(self._clean_workers)]
+            def close_stages():
+                for thread in fetchers:
+                    thread.join()
+                self._retry_stage(failed, fetched, stats[0])
+                for thread in cleaners:
+                    fetched.put(_DONE)
+                for thread in cleaners:
+                    thread.join()
+                cleaned.put(_DONE)
+            closer = threading.Thread(target=close_stages, daemon=True)
+            for thread in fetchers+cleaners+[closer]:
+                thread.start()
+            written = write_station_frames(self._write_stream(cleaned, outcomes, excludedStations, stats[2]), filename, product=product)
+            closer.join()
+        fetcher._update_negative_cache(outcomes)
+        fetcher.run_report = fetcher._build_run_report(excludedStations)
+        fetcher.run_report['pipeline'] = stats
+        self.stage_report = stats
+        for stage in stats:
+            utilities.log.info('Pipeline {}: {} workers, busy {:.2f} secs, blocked {:.2f} secs, max queued {}'.format(
+                               stage['stage'], stage['workers'], stage['busy_secs'], stage['blocked_secs'], stage['max_queued']))
+        utilities.log.info('Run: {} requests, {} bytes, {:.2f} secs'.format(fetcher.run_report['requests'], fetcher.run_report['bytes'], fetcher.run_report['wall_time_secs']))
+        return written
@@ -0,0 +1,62 @@
+
+#
+# Tune the adaptive (AIMD) concurrency controller against the local stand-in server.
+# The server answers with a base latency plus a penalty per concurrent request (a server that degrades
+# under load) and throttles a fraction of the stations. The controller decisions and run time are printed
+# next to a fixed worker run of the same size
+#
+# Run from the top level directory as: python test/benchmark_aimd.py --max_workers 16 --load_latency 0.02
+#
+
+import os,sys
+import time
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import fetch_station_data
+from fetch_station_data import contrails_fetch_data
+from standin_server import standin_server
+
+def run(server, stations, args, adaptive):
+    fetch_station_data.SOURCE_LIMITERS.clear()
+    config = {'domain': server.url+'/OneRain/DataAPI', 'systemkey': 'standin'}
+    time_range = ('2022-01-01 00:00:00', '2022-01-{:02d} 00:00:00'.format(1+args.days))
+    contrails = contrails_fetch_data(stations, time_range, config, product='river_water_level',
+                                     max_workers=args.max_workers, adaptive_concurrency=adaptive)
+    server.max_in_flight = 0
+    t0 = time.time()
+    contrails.aggregate_station_data()
+    return contrails, time.time()-t0
+
+def main(args):
+    stations = ['S{:04d}'.format(i) for i in range(args.stations)]
+    server = standin_server(latency=args.latency, load_latency=args.load_latency,
+                            bad_stations=stations[::args.throttle_every] if args.throttle_every > 0 else (), error_status=429).start()
+    try:
+        fixed, t_fixed = run(server, stations, args, False)
+        fixed_peak = server.max_in_flight
+        adaptive, t_adaptive = run(server, stations, args, True)
+        adaptive_peak = server.max_in_flight
+    finally:
+        server.stop()
+    report = adaptive.run_report['concurrency']
+    for decision in report['decisions']:
+        print('limit {previous:3d} -> {limit:3d}  in flight {in_flight:3d}  {reason}'.format(**decision))
+    print('fixed {} workers:    {:.2f} secs, peak {} in flight'.format(args.max_workers, t_fixed, fixed_peak))
+    print('adaptive (<= {}):    {:.2f} secs, peak {} in flight, final limit {}, {} of {} requests congested'.format(
+          args.max_workers, t_adaptive, adaptive_peak, report['limit'], report['congested'], report['requests']))
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+    parser = ArgumentParser()
+    parser.add_argument('--stations', action='store', dest='stations', default=24, type=int)
+    parser.add_argument('--days', action='store', dest='days', default=4, type=int,
+                        help='Contrails daily sub-windows (requests) per station')
+    parser.add_argument('--max_workers', action='store', dest='max_workers', default=16, type=int)
+    parser.add_argument('--latency', action='store', dest='latency', default=0.02, type=float,
+                        help='Base seconds per request')
+    parser.add_argument('--load_latency', action='store', dest='load_latency', default=0.02, type=float,
+                        help='Extra seconds per request for every other request in flight')
+    parser.add_argument('--throttle_every', action='store', dest='throttle_every', default=8, type=int,
+                        help='Every n-th station answers 429. 0 disables')
+    args = parser.parse_args()
+    sys.exit(main(args))
@@ -0,0 +1,41 @@
+
+#
+# Benchmark the vectorized gap limited interpolation of stations_interpolate(max_gap=) against the
+# historical scipy path (polynomial order 1, limit 1) on a wide matrix of gappy 6min station data
+#
+# Run from the top level directory as: python test/benchmark_interpolate.py --stations 500 --days 30
+#
+
+import os,sys
+import time
+import numpy as np
+import pandas as pd
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fetch_station_data import stations_aggregate, stations_interpolate
+
+def main(args):
+    rng = np.random.default_rng(0)
+    times = pd.date_range('2022-01-01', periods=args.days*240, freq='6min', name='TIME')
+    frames = list()
+    for i in range(args.stations):
+        values = np.sin(np.arange(len(times))/40.0) + rng.normal(0, 0.05, len(times))
+        values[rng.random(len(times)) < 0.05] = np.nan
+        frames.append(pd.DataFrame({str(i): values}, index=times))
+    df = stations_aggregate(frames)
+    print('{} stations x {} rows of 6min data, {} nans'.format(df.shape[1], df.shape[0], int(df.isna().sum().sum())))
+    t0 = time.time()
+    df_scipy = stations_interpolate(df.copy())
+    t1 = time.time()
+    df_vector = stations_interpolate(df.copy(), max_gap=args.max_gap)
+    t2 = time.time()
+    print('scipy (limit=1 sample):        {:.3f} secs, {} nans left'.format(t1-t0, int(df_scipy.isna().sum().sum())))
+    print('vectorized (max_gap={}): {:.3f} secs, {} nans left (speedup {:.1f}x)'.format(args.max_gap, t2-t1, int(df_vector.isna().sum().sum()), (t1-t0)/(t2-t1)))
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+    parser = ArgumentParser()
+    parser.add_argument('--stations', action='store', dest='stations', default=500, type=int)
+    parser.add_argument('--days', action='store', dest='days', default=30, type=int)
+    parser.add_argument('--max_gap', action='store', dest='max_gap', default='30min', type=str)
+    args = parser.parse_args()
+    sys.exit(main(args))
@@ -0,0 +1,59 @@
+
+#
+# Benchmark the process pool post processing (interpolate/resample) against the inline path
+# on a synthetic multi-year 6 minute backfill. Fetches are simulated with a fixed latency
+#
+# Run from the top level directory as: python test/benchmark_postprocess.py --years 3 --stations 16
+#
+
+import os,sys
+import time
+import numpy as np
+import pandas as pd
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fetch_station_data import fetch_station_data
+
+class benchmark_fetch_data(fetch_station_data):
+    """
+    Every station returns the same length of raw 6min data with a sprinkling of gaps
+    """
+    def __init__(self, stations, periods, latency=0.2, **kwargs):
+        self._latency=latency
+        super().__init__(stations, periods, **kwargs)
+
+    def fetch_single_product(self, station, periods) -> pd.DataFrame:
+        time.sleep(self._latency)
+        rng = np.random.default_rng(int(station))
+        times = pd.date_range('2019-01-01', periods=periods, freq='6min', name='TIME')
+        values = np.sin(np.arange(periods)/40.0) + rng.normal(0, 0.05, periods)
+        values[rng.integers(0, periods, periods//50)] = np.nan
+        return pd.DataFrame({station: values}, index=times)
+
+def run(stations, periods, args, **kwargs):
+    fetcher = benchmark_fetch_data(stations, periods, latency=args.latency, resample_mins=args.resample_mins, max_workers=args.max_workers, **kwargs)
+    t0 = time.time()
+    df = fetcher.aggregate_station_data()
+    return df, time.time()-t0
+
+def main(args):
+    stations = [str(8650000+i) for i in range(args.stations)]
+    periods = int(args.years*365*24*10)
+    print('{} stations x {} rows, resample_mins={}, max_workers={}'.format(len(stations), periods, args.resample_mins, args.max_workers))
+    df_inline, t_inline = run(stations, periods, args)
+    df_pool, t_pool = run(stations, periods, args, postprocess_workers=args.postprocess_workers)
+    pd.testing.assert_frame_equal(df_inline, df_pool)
+    print('inline:            {:.2f} secs'.format(t_inline))
+    print('postprocess_workers={}: {:.2f} secs (speedup {:.2f}x, results identical)'.format(args.postprocess_workers, t_pool, t_inline/t_pool))
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+    parser = ArgumentParser()
+    parser.add_argument('--years', action='store', dest='years', default=3, type=float)
+    parser.add_argument('--stations', action='store', dest='stations', default=16, type=int)
+    parser.add_argument('--latency', action='store', dest='latency', default=0.2, type=float,
+                        help='Simulated seconds per station fetch')
+    parser.add_argument('--resample_mins', action='store', dest='resample_mins', default=0, type=int)
+    parser.add_argument('--max_workers', action='store', dest='max_workers', default=4, type=int)
+    parser.add_argument('--postprocess_workers', action='store', dest='postprocess_workers', default=4, type=int)
+    args = parser.parse_args()
+    sys.exit(main(args))
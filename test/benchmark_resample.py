@@ -0,0 +1,45 @@
+
+#
+# Benchmark the vectorized stations_resample against the per station groupby(pd.Grouper).first()
+# it replaces. Every method is checked against the equivalent pandas groupby on the wide frame
+#
+# Run from the top level directory as: python test/benchmark_resample.py --stations 500 --days 30
+#
+
+import os,sys
+import time
+import numpy as np
+import pandas as pd
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fetch_station_data import stations_aggregate, stations_resample, RESAMPLE_METHODS
+
+def main(args):
+    rng = np.random.default_rng(0)
+    times = pd.date_range('2022-01-01', periods=args.days*240, freq='6min', name='TIME')
+    frames = list()
+    for i in range(args.stations):
+        values = rng.normal(size=len(times))
+        values[rng.random(len(times)) < 0.1] = np.nan
+        frames.append(pd.DataFrame({str(i): values}, index=times))
+    df = stations_aggregate(frames)
+    print('{} stations x {} rows of 6min data resampled to 15min'.format(df.shape[1], df.shape[0]))
+    for method in RESAMPLE_METHODS:
+        t0 = time.time()
+        if method!='nearest':
+            per_station = [getattr(df[[station]].groupby(pd.Grouper(freq='15min')), method)() for station in df.columns]
+        t1 = time.time()
+        df_vector = stations_resample(df, 15, method=method)
+        t2 = time.time()
+        if method=='nearest':
+            print('{:>8}: vectorized {:.3f} secs'.format(method, t2-t1))
+            continue
+        pd.testing.assert_frame_equal(getattr(df.groupby(pd.Grouper(freq='15min')), method)(), df_vector, check_freq=False)
+        print('{:>8}: per station groupby {:.3f} secs, vectorized {:.3f} secs (speedup {:.1f}x, results identical)'.format(method, t1-t0, t2-t1, (t1-t0)/(t2-t1)))
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+    parser = ArgumentParser()
+    parser.add_argument('--stations', action='store', dest='stations', default=500, type=int)
+    parser.add_argument('--days', action='store', dest='days', default=30, type=int)
+    args = parser.parse_args()
+    sys.exit(main(args))
@@ -0,0 +1,129 @@
+
+#
+# A local stand-in for the Contrails (OneRain) and NOAA CO-OPS http endpoints.
+# Used by the offline tests so the harvest engines can be exercised without network access.
+# Responses are deterministic functions of (station, time) so repeated fetches agree.
+#
+# Usage:
+#    server = standin_server(latency=0.01)
+#    server.start()
+#    config = {'domain': server.url+'/OneRain/DataAPI', 'systemkey': 'test'}
+#    ...
+#    server.stop()
+#
+
+import json
+import time
+import threading
+import urllib.parse
+import numpy as np
+import pandas as pd
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+def standin_value(station, timestamp):
+    """
+    A deterministic fake water level for a station at a time
+    """
+    seed = sum(ord(c) for c in str(station))
+    return round(np.sin(timestamp.value/3.6e12 + seed) + seed % 7, 4)
+
+class standin_server(object):
+    """
+    Input:
+        latency: (float) seconds each request sleeps before answering
+        bad_stations: stations whose data requests always answer with error_status
+        error_status: (int) http status returned for bad_stations
+        load_latency: (float) extra seconds each request sleeps for every other request in flight (a server that degrades under load)
+        slow_every: (int) every n-th request sleeps slow_latency instead (a tail of stalled requests). 0 disables
+        slow_latency: (float) seconds a stalled request sleeps
+        flaky_stations: dict of station -> number of its first requests answered with error_status (a transient blip)
+        dds_paths: OPeNDAP paths (eg /thredds/dodsC/.../fort.61.nc) whose .dds answers 200. Other .dds requests get 404
+    """
+    def __init__(self, latency=0.0, bad_stations=(), error_status=500, load_latency=0.0, slow_every=0, slow_latency=5.0, flaky_stations=None, dds_paths=()):
+        self.latency=latency
+        self.load_latency=load_latency
+        self.slow_every=slow_every
+        self.slow_latency=slow_latency
+        self.flaky_stations=dict(flaky_stations or {})
+        self.dds_paths=set(dds_paths)
+        self.bad_stations=set(bad_stations)
+        self.error_status=error_status
+        self.requests=0
+        self.in_flight=0
+        self.max_in_flight=0
+        self._lock=threading.Lock()
+        self._httpd=ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._httpd.daemon_threads=True
+        self.url='http://127.0.0.1:{}'.format(self._httpd.server_address[1])
+
+    def start(self):
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def _handler(self):
+        server=self
+        class handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+            def do_GET(self):
+                with server._lock:
+                    server.requests+=1
+                    server.in_flight+=1
+                    server.max_in_flight=max(server.max_in_flight, server.in_flight)
+                    delay=server.latency+server.load_latency*(server.in_flight-1)
+                    if server.slow_every > 0 and server.requests % server.slow_every==0:
+                        delay=server.slow_latency
+                try:
+                    time.sleep(delay)
+                    parsed=urllib.parse.urlparse(self.path)
+                    if parsed.path.endswith('.dds'):
+                        self.send_response(200 if parsed.path[:-len('.dds')] in server.dds_paths else 404)
+                        self.end_headers()
+                        return
+                    query=dict(urllib.parse.parse_qsl(parsed.query))
+                    station=query.get('site_id', query.get('station', query.get('or_site_id')))
+                    with server._lock:
+                        flaky=server.flaky_stations.get(station, 0) > 0
+                        if flaky:
+                            server.flaky_stations[station]-=1
+                    if station in server.bad_stations or flaky:
+                        self.send_response(server.error_status)
+                        self.end_headers()
+                        return
+                    if parsed.path.endswith('datagetter'):
+                        body=server.coops_data(query)
+                        ctype='application/json'
+                    else:
+                        body=server.onerain(query)
+                        ctype='text/xml'
+                    self.send_response(200)
+                    self.send_header('Content-Type', ctype)
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                finally:
+                    with server._lock:
+                        server.in_flight-=1
+        return handler
+
+    def coops_data(self, query) -> bytes:
+        times=pd.date_range(pd.Timestamp(query['begin_date']), pd.Timestamp(query['end_date']), freq='6min')
+        data=[{'t': t.strftime('%Y-%m-%d %H:%M'), 'v': '{:.3f}'.format(standin_value(query['station'], t)),
+               's': '0.003', 'f': '0,0,0,0', 'q': 'p'} for t in times]
+        return json.dumps({'metadata': {'id': query['station']}, 'data': data}).encode()
+
+    def onerain(self, query) -> bytes:
+        station=query.get('site_id', query.get('or_site_id'))
+        if query['method']=='GetSensorData':
+            times=pd.date_range(pd.Timestamp(query['data_start']).ceil('15min'), pd.Timestamp(query['data_end']), freq='15min')
+            rows=''.join('<row><data_time>{}</data_time><data_value>{}</data_value></row>'.format(
+                         t.strftime('%Y-%m-%d %H:%M:%S'), standin_value(station, t)) for t in times)
+        elif query['method']=='GetSensorMetaData':
+            rows='<row><or_site_id>{0}</or_site_id><or_sensor_id>1</or_sensor_id><sensor_class>{1}</sensor_class><location>Site {0}</location></row>'.format(station, query['class'])
+        else:
+            rows='<row><latitude_dec>35.5</latitude_dec><longitude_dec>-77.5</longitude_dec><location>Site {}</location></row>'.format(station)
+        return '<?xml version="1.0"?><onerain><response><general>{}</general></response></onerain>'.format(rows).encode()
@@ -0,0 +1,111 @@
+
+#
+# Write small ADCIRC style fort.61.nc/fort.63.nc files so the ADCIRC fetcher can be exercised offline.
+# Files are laid out under the ASGS url convention (the cycle time is url.split('/')[-6]):
+#
+#    <root>/2022/nam/2022011600/hsofs/machine.renci.org/hsofs-nam-bob-2021/nowcast/fort.61.nc
+#
+# Usage:
+#    url = write_fort61(tmp_path, '2022011600', ['8651370','8652587'])
+#
+
+import os
+import numpy as np
+import pandas as pd
+import netCDF4 as nc4
+
+def adcirc_url(root, cycle, ensemble='nowcast', filename='fort.61.nc', grid='hsofs', instance='hsofs-nam-bob-2021'):
+    """
+    Return (creating the directories) the path of a file following the ASGS url layout
+    """
+    dirname = os.path.join(str(root), cycle[:4], 'nam', cycle, grid, 'machine.renci.org', instance, ensemble)
+    os.makedirs(dirname, exist_ok=True)
+    return os.path.join(dirname, filename)
+
+def adcirc_value(column, times):
+    """
+    The deterministic fake water level of a fort.61 station or fort.63 node column at the given times
+    """
+    hours = (pd.DatetimeIndex(times)-pd.Timestamp('2022-01-01')).total_seconds().values/3600.0
+    return np.sin(hours/6.0 + column) + (column % 5)*0.1
+
+def _cycle_times(cycle, ensemble, nsteps):
+    start = pd.Timestamp(dt_cycle(cycle))
+    if ensemble=='nowcast':
+        return pd.date_range(end=start, periods=nsteps, freq='h')
+    return pd.date_range(start=start+pd.Timedelta(hours=1), periods=nsteps, freq='h')
+
+def dt_cycle(cycle):
+    return pd.to_datetime(cycle, format='%Y%m%d%H')
+
+def _write_common(nc, times, x, y, nodes_dim):
+    nc.createDimension('time', None)
+    nc.source = 'ASGS synthetic'
+    time = nc.createVariable('time', 'f8', ('time',))
+    time.units = 'seconds since 2022-01-01 00:00:00'
+    time[:] = (times-pd.Timestamp('2022-01-01')).total_seconds().values
+    xv = nc.createVariable('x', 'f8', (nodes_dim,))
+    yv = nc.createVariable('y', 'f8', (nodes_dim,))
+    xv[:] = x
+    yv[:] = y
+
+def write_fort61(root, cycle, stations, ensemble='nowcast', nsteps=6, dry_stations=(), **kwargs):
+    """
+    A fort.61.nc holding stations (in that column order). dry_stations are filled with -99999
+    """
+    path = adcirc_url(root, cycle, ensemble, 'fort.61.nc', **kwargs)
+    times = _cycle_times(cycle, ensemble, nsteps)
+    namelen = 50
+    with nc4.Dataset(path, 'w') as nc:
+        nc.createDimension('station', len(stations))
+        nc.createDimension('namelen', namelen)
+        x = -78.0+0.01*np.arange(len(stations))
+        y = 34.0+0.01*np.arange(len(stations))
+        _write_common(nc, times, x, y, 'station')
+        names = nc.createVariable('station_name', 'S1', ('station','namelen'))
+        names[:] = np.array([list('{} Station {}'.format(station, number).ljust(namelen).encode()) for number, station in enumerate(stations)], dtype='u1').view('S1')
+        zeta = nc.createVariable('zeta', 'f8', ('time','station'), fill_value=-99999.0)
+        data = np.stack([adcirc_value(column, times) for column in range(len(stations))], axis=1)
+        for number, station in enumerate(stations):
+            if station in dry_stations:
+                data[:, number] = -99999.0
+        zeta[:] = data
+    return path
+
+def write_fort63(root, cycle, nx=40, ny=30, ensemble='nowcast', nsteps=6, lon0=-78.0, lat0=34.0, spacing=0.01, **kwargs):
+    """
+    A fort.63.nc on a regular triangulated nx by ny mesh (two triangles per cell). Node n is at
+    (lon0+spacing*(n % nx), lat0+spacing*(n // nx)) and its water level is linear in lon/lat so that
+    barycentric interpolation is exact. Nodes with x >= nx-2 are dry (-99999)
+    """
+    path = adcirc_url(root, cycle, ensemble, 'fort.63.nc', **kwargs)
+    times = _cycle_times(cycle, ensemble, nsteps)
+    ix, iy = np.meshgrid(np.arange(nx), np.arange(ny))
+    ix, iy = ix.ravel(), iy.ravel()
+    x = lon0+spacing*ix
+    y = lat0+spacing*iy
+    elements = list()
+    for j in range(ny-1):
+        for i in range(nx-1):
+            n = j*nx+i
+            elements.append((n, n+1, n+nx+1))
+            elements.append((n, n+nx+1, n+nx))
+    with nc4.Dataset(path, 'w') as nc:
+        nc.createDimension('node', nx*ny)
+        nc.createDimension('nele', len(elements))
+        nc.createDimension('nvertex', 3)
+        _write_common(nc, times, x, y, 'node')
+        element = nc.createVariable('element', 'i4', ('nele','nvertex'))
+        element[:] = np.array(elements)+1 # Fortran (1 based) node numbers as in ADCIRC output
+        zeta = nc.createVariable('zeta', 'f8', ('time','node'), fill_value=-99999.0)
+        data = fort63_value(x, y, times)
+        data[:, ix >= nx-2] = -99999.0
+        zeta[:] = data
+    return path
+
+def fort63_value(lon, lat, times):
+    """
+    The fake (linear in space) fort.63 water level at lon/lat: times x points
+    """
+    hours = (pd.DatetimeIndex(times)-pd.Timestamp('2022-01-01')).total_seconds().values/3600.0
+    return np.outer(np.ones(len(hours)), 10.0*(np.asarray(lon)+78.0)) + np.outer(np.ones(len(hours)), 5.0*(np.asarray(lat)-34.0)) + hours[:,None]*0.01
@@ -0,0 +1,238 @@
+
+#
+# Exercise the ADCIRC fetcher against small synthetic fort.61/fort.63 files written to a temporary directory
+#
+# Run from the top level directory as: python -m pytest test/test_adcirc_offline.py
+#
+
+import os
+import numpy as np
+import pandas as pd
+from fetch_station_data import adcirc_fetch_data
+from synthetic_adcirc import write_fort61, adcirc_value
+
+STATIONS=['8651370','8652587','8654467','8656483','8658163']
+
+def fort61_urls(tmp_path):
+    """
+    Two nowcast cycles of the same grid (same station layout). One station is dry in the first
+    """
+    return [write_fort61(tmp_path, '2022011600', STATIONS+['9999999'], dry_stations=['8654467']),
+            write_fort61(tmp_path, '2022011606', STATIONS+['9999999'])]
+
+def test_bulk_read_matches_per_station(tmp_path):
+    urls = fort61_urls(tmp_path)
+    requested = STATIONS[:4]+['0000000']
+    serial = adcirc_fetch_data(requested, urls, 'water_level', gridname='hsofs', castType='nowcast', resample_mins=0)
+    df_serial, meta_serial = serial.aggregate()
+    bulk = adcirc_fetch_data(requested, urls, 'water_level', gridname='hsofs', castType='nowcast', resample_mins=0, bulk_read=True)
+    df_bulk, meta_bulk = bulk.aggregate()
+    pd.testing.assert_frame_equal(df_serial, df_bulk)
+    pd.testing.assert_frame_equal(meta_serial, meta_bulk)
+    # One read per url instead of one per station per url
+    assert serial.run_report['requests']==len(urls)*len(serial._stations)
+    assert bulk.run_report['requests']==len(urls)
+    assert df_bulk['8654467'].iloc[:6].isna().all()
+
+def test_dataset_handles_are_shared_and_bounded(tmp_path):
+    urls = fort61_urls(tmp_path)
+    adcirc = adcirc_fetch_data(STATIONS, urls, 'water_level', gridname='hsofs', castType='nowcast', resample_mins=0)
+    df_data, df_meta = adcirc.aggregate()
+    # Url pruning, station lookup, data and metadata reads all share one handle per url
+    assert adcirc._datasets.opened==len(urls) and adcirc._datasets.evicted==0
+    handles = [adcirc._datasets.get(url) for url in urls]
+    adcirc.close()
+    assert len(adcirc._datasets)==0 and not any(nc.isopen() for nc in handles)
+    bounded = adcirc_fetch_data(STATIONS, urls, 'water_level', gridname='hsofs', castType='nowcast', resample_mins=0, max_open_datasets=1)
+    df_bounded, meta_bounded = bounded.aggregate()
+    assert len(bounded._datasets)==1 and bounded._datasets.evicted > 0
+    pd.testing.assert_frame_equal(df_data, df_bounded)
+    pd.testing.assert_frame_equal(df_meta, meta_bounded)
+
+def test_parallel_url_probes(tmp_path):
+    import time
+    import fetch_station_data
+    from standin_server import standin_server
+    fetch_station_data.URL_PROBES.clear()
+    remote = ['/thredds/dodsC/2022/nam/20220116{:02d}/hsofs/machine.renci.org/hsofs-nam-bob-2021/nowcast/fort.61.nc'.format(hour) for hour in (0,6,12,18)]
+    server = standin_server(latency=0.3, dds_paths=remote[:3]).start()
+    try:
+        local = fort61_urls(tmp_path)
+        urls = local+[str(tmp_path/'missing'/'fort.61.nc')]+[server.url+path for path in remote]
+        t0 = time.time()
+        available = fetch_station_data.probe_urls(urls, workers=8)
+        elapsed = time.time()-t0
+        assert available==local+[server.url+path for path in remote[:3]]
+        assert elapsed < 0.3*len(remote) # Probed concurrently
+        probes = server.requests
+        fetch_station_data.probe_urls(urls, workers=8)
+        assert server.requests==probes # Outcomes are cached for the run
+        adcirc = adcirc_fetch_data(STATIONS, local+[urls[2]], 'water_level', gridname='hsofs', castType='nowcast', resample_mins=0, probe_workers=4)
+        assert adcirc._periods==local
+        assert adcirc._datasets.opened==1 # The station lookup stops at the first available url
+    finally:
+        server.stop()
+        fetch_station_data.URL_PROBES.clear()
+
+def test_station_index_is_persisted_and_verified(tmp_path):
+    from utilities.station_index import fort61_station_index
+    urls = fort61_urls(tmp_path/'data')
+    indexfile = str(tmp_path/'adcirc_station_index.json')
+    requested = ['9999999']+STATIONS[:3]+['0000000']
+    index = fort61_station_index(indexfile)
+    first = adcirc_fetch_data(requested, urls, 'water_level', gridname='hsofs', castType='nowcast', resample_mins=0, station_index=index)
+    assert first._stations==[('9999999',5),('8651370',0),('8652587',1),('8654467',2)] # In the requested order
+    assert (index.builds, index.hits)==(1, 0) # Decoded once, the second url is not looked at
+    reused = fort61_station_index(indexfile)
+    second = adcirc_fetch_data(requested, urls, 'water_level', gridname='hsofs', castType='nowcast', resample_mins=0, station_index=reused)
+    assert second._stations==first._stations
+    assert (reused.builds, reused.hits)==(0, 1)
+    # A new layout of the grid (another station count) is decoded afresh
+    relayout = write_fort61(tmp_path/'data', '2022011612', ['0000000']+STATIONS+['9999999'])
+    third = adcirc_fetch_data(requested, [relayout], 'water_level', gridname='hsofs', castType='nowcast', resample_mins=0, station_index=reused)
+    assert third._stations==[('9999999',6),('8651370',1),('8652587',2),('8654467',3),('0000000',0)]
+    assert reused.builds==1
+
+def test_non_asgs_paths_do_not_share_a_station_layout(tmp_path):
+    import shutil
+    from utilities.station_index import fort61_station_index
+    # Two local runs whose paths only differ in the last directory, with the same station count but another column order
+    paths = list()
+    for run, layout in (('runA', STATIONS), ('runB', STATIONS[::-1])):
+        os.makedirs(str(tmp_path/'runs'/run))
+        paths.append(shutil.copy(write_fort61(tmp_path/run, '2022011600', layout), str(tmp_path/'runs'/run/'fort.61.nc')))
+    index = fort61_station_index()
+    first = adcirc_fetch_data(STATIONS[:2], [paths[0]], 'water_level', castType='nowcast', resample_mins=0, station_index=index)
+    second = adcirc_fetch_data(STATIONS[:2], [paths[1]], 'water_level', castType='nowcast', resample_mins=0, station_index=index)
+    assert first._stations==[(STATIONS[0],0),(STATIONS[1],1)]
+    assert second._stations==[(STATIONS[0],4),(STATIONS[1],3)]
+    assert index.builds==2
+
+def test_nearest_wet_nodes_from_a_persisted_index(tmp_path):
+    from utilities.node_index import grid_node_index
+    from synthetic_adcirc import write_fort63, fort63_value
+    url = write_fort63(tmp_path/'data', '2022011600', nx=40, ny=30)
+    # Node n is at (-78.0+0.01*(n%40), 34.0+0.01*(n//40)). Columns 38 and 39 are dry
+    stations = pd.DataFrame({'stationid': ['A','B','C'], 'lon': [-77.9502, -77.6101, -77.0], 'lat': [34.0499, 34.1, 34.2]})
+    index = grid_node_index(str(tmp_path/'index'))
+    adcirc = adcirc_fetch_data(stations, [url], 'water_level', gridname='hsofs', castType='nowcast', resample_mins=0, fort63_style=True, node_index=index)
+    assert adcirc._stations==[('A',5*40+5),('B',10*40+37),('C',20*40+37)] # B and C snap to the last wet column
+    assert index.builds==1
+    df_data, df_meta = adcirc.aggregate()
+    np.testing.assert_allclose(df_data['A'].values, fort63_value([-77.95], [34.05], df_data.index)[:,0])
+    reused = grid_node_index(str(tmp_path/'index'))
+    nodes, distance = reused.nearest('hsofs', adcirc._datasets.get(url), stations['lon'].values, stations['lat'].values)
+    assert (reused.builds, reused.loads)==(0, 1)
+    assert isinstance(reused.grid('hsofs', adcirc._datasets.get(url))[1], np.memmap)
+    assert nodes.tolist()==[node for station, node in adcirc._stations]
+    assert distance[0] < 0.1
+    # A loaded index travels to the ensemble worker processes as is
+    import pickle
+    shipped = pickle.loads(pickle.dumps(reused))
+    assert shipped.nearest('hsofs', adcirc._datasets.get(url), stations['lon'].values, stations['lat'].values)[0].tolist()==nodes.tolist()
+    assert (shipped.builds, shipped.loads)==(0, 1)
+
+def test_hyperslab_plan():
+    from fetch_station_data import plan_hyperslabs
+    assert plan_hyperslabs([900, 5, 7, 6, 40, 5000], max_gap=10)==[slice(5,8,1), slice(40,41,1), slice(900,901,1), slice(5000,5001,1)]
+    assert plan_hyperslabs([0, 30, 60, 90, 1000], max_gap=40)==[slice(0,91,30), slice(1000,1001,1)] # Strided, nothing wasted
+    assert plan_hyperslabs([], max_gap=10)==[]
+
+def test_fort63_hyperslab_reads_match_per_station(tmp_path):
+    from synthetic_adcirc import write_fort63
+    urls = [write_fort63(tmp_path, cycle, nx=40, ny=30) for cycle in ('2022011600', '2022011606')]
+    nodes = [5, 9, 11, 400, 800, 1200, 1199] # 1 based as in the station files
+    stations = pd.DataFrame({'stationid': ['S{}'.format(node) for node in nodes], 'Node': nodes})
+    serial = adcirc_fetch_data(stations.copy(), urls, 'water_level', gridname='hsofs', castType='nowcast', resample_mins=0, fort63_style=True)
+    df_serial, meta_serial = serial.aggregate()
+    planned = adcirc_fetch_data(stations.copy(), urls, 'water_level', gridname='hsofs', castType='nowcast', resample_mins=0, fort63_style=True, bulk_read=True, read_gap=10)
+    df_planned, meta_planned = planned.aggregate()
+    pd.testing.assert_frame_equal(df_serial, df_planned)
+    pd.testing.assert_frame_equal(meta_serial, meta_planned)
+    # Per url: the time read and the hyperslabs [4:11], [399:400:1]+... -> nodes 4,8,10 | 399 | 799 | 1198,1199
+    plan = planned.run_report['read_plan']
+    assert plan['hyperslabs']==2*4 and plan['nodes_requested']==2*len(nodes) and plan['nodes_read']==2*(7+1+1+2)
+    assert planned.run_report['requests']==2*(1+4) < serial.run_report['requests']
+    assert planned.run_report['bytes'] > 0
+
+def test_fort63_barycentric_interpolation(tmp_path):
+    from utilities.node_index import grid_node_index
+    from synthetic_adcirc import write_fort63, fort63_value
+    urls = [write_fort63(tmp_path/'data', cycle, nx=40, ny=30) for cycle in ('2022011600', '2022011606')]
+    # Inside the mesh, touching a dry node (column 38) and outside the mesh
+    stations = pd.DataFrame({'stationid': ['A','B','C','D'], 'lon': [-77.9537, -77.8012, -77.6250, -76.0], 'lat': [34.0421, 34.2266, 34.1, 34.1]})
+    index = grid_node_index(str(tmp_path/'index'))
+    adcirc = adcirc_fetch_data(stations, urls, 'water_level', gridname='hsofs', castType='nowcast', resample_mins=0, fort63_style=True, node_index=index, interpolate=True)
+    assert [station for station, nodes in adcirc._stations]==['A','B','C']
+    df_data, df_meta = adcirc.aggregate()
+    # zeta is linear in lon/lat so the interpolation is exact
+    for station, lon, lat in (('A', -77.9537, 34.0421), ('B', -77.8012, 34.2266)):
+        np.testing.assert_allclose(df_data[station].values, fort63_value([lon], [lat], df_data.index)[:,0])
+        np.testing.assert_allclose([df_meta.loc[station,'LON'], df_meta.loc[station,'LAT']], [lon, lat])
+    assert df_data['C'].isna().all()
+    assert adcirc.run_report['read_plan']['hyperslabs'] > 0
+    reused = grid_node_index(str(tmp_path/'index'))
+    again = adcirc_fetch_data(stations, urls, 'water_level', gridname='hsofs', castType='nowcast', resample_mins=0, fort63_style=True, node_index=reused, interpolate=True)
+    assert again._stations==adcirc._stations
+    assert (reused.element_searches, reused.loads)==(0, 1) # Nodes and weights come from the saved station set
+    # Another station set searches the saved centroid tree instead of building one
+    moved = stations.assign(lon=stations['lon']+0.003)
+    adcirc_fetch_data(moved, urls, 'water_level', gridname='hsofs', castType='nowcast', resample_mins=0, fort63_style=True, node_index=reused, interpolate=True)
+    assert (reused.builds, reused.element_searches, reused.loads)==(0, 1, 2)
+    # Points whose containing element is not among the first candidates are searched again with more
+    nc = adcirc._datasets.get(urls[0])
+    rng = np.random.default_rng(7)
+    lons, lats = rng.uniform(-78.0, -77.62, 200), rng.uniform(34.0, 34.29, 200)
+    wide = reused._locate('hsofs', nc, lons, lats)
+    narrow = reused._locate('hsofs', nc, lons, lats, candidates=1)
+    assert wide[2].all() and narrow[2].all()
+    np.testing.assert_allclose(wide[0], narrow[0])
+
+def test_metadata_is_read_once_per_grid(tmp_path, monkeypatch):
+    import fetch_station_data
+    from synthetic_adcirc import write_fort63
+    fetch_station_data.ADCIRC_GRID_COORDS.clear()
+    reads = list()
+    read_grid_coords = adcirc_fetch_data._read_grid_coords
+    monkeypatch.setattr(adcirc_fetch_data, '_read_grid_coords', lambda self, nc, nodes, coords: reads.append(list(nodes)) or read_grid_coords(self, nc, nodes, coords))
+    urls = fort61_urls(tmp_path)
+    nowcast = adcirc_fetch_data(STATIONS[:4], urls, 'water_level', gridname='hsofs', castType='nowcast', resample_mins=0)
+    df_meta = nowcast.aggregate_station_metadata()
+    assert len(reads)==1 # One read for every station
+    np.testing.assert_allclose(df_meta['LON'].astype(float), -78.0+0.01*np.arange(4))
+    np.testing.assert_allclose(df_meta['LAT'].astype(float), 34.0+0.01*np.arange(4))
+    forecast = adcirc_fetch_data(STATIONS[:4], [write_fort61(tmp_path, '2022011606', STATIONS+['9999999'], ensemble='namforecast')], 'water_level', gridname='hsofs', castType='forecast', resample_mins=0)
+    pd.testing.assert_frame_equal(forecast.aggregate_station_metadata().drop(columns='NAME'), df_meta.drop(columns='NAME'))
+    assert len(reads)==1 # Same grid and instance: the coordinates are cached
+    # fort.63: only the station nodes are read, in planned hyperslabs
+    url63 = write_fort63(tmp_path, '2022011600', nx=40, ny=30)
+    nodes = [5, 9, 1200]
+    adcirc = adcirc_fetch_data(pd.DataFrame({'stationid': ['S5','S9','S1200'], 'Node': nodes}), [url63], 'water_level', gridname='hsofs', castType='nowcast', resample_mins=0, fort63_style=True)
+    df_meta = adcirc.aggregate_station_metadata()
+    assert reads[-1]==[4, 8, 1199]
+    np.testing.assert_allclose(df_meta['LON'].astype(float), [-78.0+0.01*((n-1) % 40) for n in nodes])
+    np.testing.assert_allclose(df_meta['LAT'].astype(float), [34.0+0.01*((n-1) // 40) for n in nodes])
+    fetch_station_data.ADCIRC_GRID_COORDS.clear()
+
+def test_concurrent_ensembles_write_the_per_ensemble_files(tmp_path, monkeypatch):
+    import argparse
+    import importlib
+    monkeypatch.setenv('RUNTIMEDIR', str(tmp_path/'out'))
+    fetch_adcirc_data = importlib.import_module('fetch_adcirc_data')
+    monkeypatch.setattr(fetch_adcirc_data, 'rootdir', str(tmp_path/'out'))
+    monkeypatch.setattr(fetch_adcirc_data, 'get_adcirc_stations_fort61_style', lambda: STATIONS[:3])
+    forecast = write_fort61(tmp_path, '2022011600', STATIONS, ensemble='namforecast')
+    write_fort61(tmp_path, '2022011600', STATIONS, ensemble='nowcast')
+    args = argparse.Namespace(sources=False, data_source='ASGS', urls=[forecast], data_product='water_level', convertToNowcast=False,
+                              fort63_style=False, nearest_nodes=False, interpolate=False, node_index=None, bulk_read=True, read_gap=1000,
+                              probe_workers=0, station_index=str(tmp_path/'adcirc_station_index.json'), no_station_index=False,
+                              max_workers=2, postprocess_workers=0)
+    assert fetch_adcirc_data.main_ensembles(args, ['namforecast', 'nowcast'])==0
+    # An ensemble that fails (here: no such urls) is reported and does not stop the others
+    assert fetch_adcirc_data.main_ensembles(args, ['nowcast', 'veerright'])==1
+    written = sorted(os.listdir(str(tmp_path/'out')))
+    for ensemble in ('namforecast', 'nowcast'):
+        assert 'adcirc_stationdata_{}_HSOFS_2022-01-16T00:00:00.csv'.format(ensemble) in written
+        assert 'adcirc_stationdata_meta_{}_HSOFS_2022-01-16T00:00:00.csv'.format(ensemble) in written
+    nowcast = pd.read_csv(str(tmp_path/'out'/'adcirc_stationdata_nowcast_HSOFS_2022-01-16T00:00:00.csv'))
+    assert sorted(nowcast['STATION'].astype(str).unique())==sorted(STATIONS[:3])
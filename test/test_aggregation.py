@@ -0,0 +1,353 @@
+
+#
+# Offline checks of the fetch_station_data aggregation machinery. A small synthetic
+# subclass stands in for the NOAA/Contrails/ADCIRC sources so no network access is needed
+#
+# Run from the top level directory as: python -m pytest test/test_aggregation.py
+#
+
+import time
+import asyncio
+import numpy as np
+import pandas as pd
+from fetch_station_data import fetch_station_data, stations_aggregate, stations_postprocess, stations_resample, stations_interpolate, replace_and_fill, write_station_frames, spilled_station_data
+from utilities.utilities import utilities
+from utilities.negative_cache import negative_cache
+from station_pipeline import station_pipeline
+
+def synthetic_station(station, start='2022-01-14 00:00:00', periods=480, freq='6min', seed=None):
+    """
+    Build a single station dataframe (TIME vs station) of fake water levels
+    """
+    rng = np.random.default_rng(int(station) if seed is None else seed)
+    times = pd.date_range(start, periods=periods, freq=freq)
+    values = np.sin(np.arange(periods)/20.0) + rng.normal(0, 0.05, periods)
+    values[rng.integers(0, periods, periods//20)] = np.nan
+    df = pd.DataFrame({station: values}, index=times)
+    df.index.name='TIME'
+    return df
+
+class synthetic_fetch_data(fetch_station_data):
+    """
+    Returns synthetic data for every station except those listed in bad_stations
+    """
+    def __init__(self, stations, bad_stations=(), bad_metadata=(), delay=0.0, **kwargs):
+        self._bad_stations=set(bad_stations)
+        self._bad_metadata=set(bad_metadata)
+        self._delay=delay
+        super().__init__(stations, None, **kwargs)
+
+    def fetch_single_product(self, station, periods) -> pd.DataFrame:
+        time.sleep(self._delay)
+        if station in self._bad_stations:
+            raise ValueError('No data for station {}'.format(station))
+        # Stagger the start times so the aggregation has to align indexes
+        offset = int(station[-1]) * 3
+        return synthetic_station(station, start=pd.Timestamp('2022-01-14')+pd.Timedelta(minutes=offset))
+
+    def fetch_single_metadata(self, station) -> pd.DataFrame:
+        if station in self._bad_stations or station in self._bad_metadata:
+            raise ValueError('No metadata for station {}'.format(station))
+        df_meta=pd.DataFrame.from_dict({'LAT':35.0,'LON':-76.0,'NAME':station}, orient='index')
+        df_meta.columns = [str(station)]
+        return df_meta
+
+def melt(df):
+    """
+    As fetch_data.format_data_frames: the Harvester default long format
+    """
+    df = df.copy()
+    df.index = df.index.strftime('%Y-%m-%dT%H:%M:%S')
+    df.reset_index(inplace=True)
+    df_out = pd.melt(df, id_vars=['TIME'])
+    df_out.columns=('TIME','STATION','WATER_LEVEL')
+    return df_out.set_index('TIME')
+
+STATIONS=['8651370','8652587','8654467','8656483','8658120','8658163','8661070','8662245']
+BAD=['8654467','8661070']
+
+def test_concurrent_matches_serial():
+    serial = synthetic_fetch_data(STATIONS, bad_stations=BAD, max_workers=1)
+    threaded = synthetic_fetch_data(STATIONS, bad_stations=BAD, delay=0.05, max_workers=4)
+    df_serial = serial.aggregate_station_data()
+    df_threaded = threaded.aggregate_station_data()
+    assert list(df_threaded.columns)==[s for s in STATIONS if s not in BAD]
+    pd.testing.assert_frame_equal(df_serial, df_threaded)
+    pd.testing.assert_frame_equal(serial.aggregate_station_metadata(), threaded.aggregate_station_metadata())
+
+def test_async_engine_runs_blocking_sources():
+    # A source without a native async fetch runs its blocking fetch in the loop's executor
+    serial = synthetic_fetch_data(STATIONS, bad_stations=BAD)
+    engine = synthetic_fetch_data(STATIONS, bad_stations=BAD, delay=0.02)
+    df_async = asyncio.run(engine.aggregate_station_data_async(max_in_flight=4))
+    pd.testing.assert_frame_equal(serial.aggregate_station_data(), df_async)
+    assert engine.run_report['stations_excluded']==len(BAD)
+
+def test_single_pass_aggregate():
+    fetcher = synthetic_fetch_data(STATIONS, bad_stations=BAD, bad_metadata=['8658120'], max_workers=3)
+    df_data, df_meta = fetcher.aggregate()
+    kept = [s for s in STATIONS if s not in BAD+['8658120']]
+    assert list(df_data.columns)==kept
+    assert list(df_meta.index)==kept
+    pd.testing.assert_frame_equal(df_data, fetcher.aggregate_station_data()[kept])
+
+def test_preallocated_aggregate_matches_concat():
+    frames = [synthetic_station(s, start=pd.Timestamp('2022-01-14')+pd.Timedelta(minutes=7*i), periods=300+i)
+              for i,s in enumerate(STATIONS)]
+    # A station with duplicated times (eg overlapping ADCIRC urls) keeps the first value
+    dup = frames[2]
+    frames[2] = pd.concat([dup, dup.iloc[:10]*2.0])
+    df_concat = pd.concat([df.loc[~df.index.duplicated(keep='first')] for df in frames], axis=1)
+    df_matrix = stations_aggregate(frames)
+    pd.testing.assert_frame_equal(df_concat, df_matrix, check_freq=False)
+
+def test_fill_value_applied_at_write(tmp_path):
+    fetcher = synthetic_fetch_data(STATIONS, bad_stations=BAD)
+    df_data, df_meta = fetcher.aggregate()
+    assert (df_data.dtypes==np.float64).all()
+    assert df_data.isna().any().any()
+    # The files on disk match the historical in memory fill with the string sentinel
+    old = tmp_path / 'old.csv'
+    melt(replace_and_fill(df_data)).to_csv(old)
+    new = utilities.writeCsv(melt(df_data), rootdir=str(tmp_path), subdir='', fileroot='new', iometadata='')
+    assert open(new).read()==old.read_text()
+    assert '-99999' in old.read_text()
+
+def test_streamed_frames_match_aggregate(tmp_path):
+    fetcher = synthetic_fetch_data(STATIONS, bad_stations=BAD, delay=0.02, max_workers=3)
+    filename = str(tmp_path / 'streamed.csv')
+    written = write_station_frames(fetcher.iter_station_frames(), filename)
+    assert sorted(written)==sorted(s for s in STATIONS if s not in BAD)
+    assert fetcher.run_report['stations_excluded']==len(BAD)
+    # Same values as the aggregated path, less the union grid padding
+    df_stream = pd.read_csv(filename, index_col='TIME', dtype={'STATION': str}, na_values=['-99999'])
+    df_wide = df_stream.pivot(columns='STATION', values='WATER_LEVEL')
+    df_wide.index = pd.to_datetime(df_wide.index)
+    df_data = synthetic_fetch_data(STATIONS, bad_stations=BAD).aggregate_station_data()
+    for station in written:
+        pd.testing.assert_series_equal(df_wide[station].dropna(), df_data[station].dropna(), check_names=False, check_freq=False, check_index_type=False)
+
+def test_process_pool_postprocessing_matches_inline():
+    inline = synthetic_fetch_data(STATIONS, bad_stations=BAD, resample_mins=0)
+    pooled = synthetic_fetch_data(STATIONS, bad_stations=BAD, resample_mins=0, max_workers=4, postprocess_workers=2)
+    pd.testing.assert_frame_equal(inline.aggregate_station_data(), pooled.aggregate_station_data())
+    df_data, df_meta = pooled.aggregate()
+    pd.testing.assert_frame_equal(df_data, inline.aggregate()[0])
+    assert (pooled.station_telemetry().drop(BAD)['rows_processed'] > 0).all()
+
+def test_fetch_overlaps_postprocessing(monkeypatch):
+    import threading
+    import fetch_station_data
+    from concurrent.futures import ThreadPoolExecutor
+    # Post processing is held until the last station has been fetched. Fetches that waited on it would never get there
+    released = threading.Event()
+    waits = list()
+    def gated_postprocess(df, *args, **kwargs):
+        waits.append(released.wait(10))
+        return stations_postprocess(df, *args, **kwargs)
+    monkeypatch.setattr(fetch_station_data, 'stations_postprocess', gated_postprocess)
+    monkeypatch.setattr(fetch_station_data, 'ProcessPoolExecutor', ThreadPoolExecutor)
+    class gated_fetch_data(synthetic_fetch_data):
+        def fetch_single_product(self, station, periods):
+            dx = super().fetch_single_product(station, periods)
+            if station==STATIONS[-1]:
+                released.set()
+            return dx
+    fetcher = gated_fetch_data(STATIONS, bad_stations=BAD, postprocess_workers=4)
+    df_data = fetcher.aggregate_station_data()
+    assert waits==[True]*(len(STATIONS)-len(BAD))
+    monkeypatch.undo()
+    pd.testing.assert_frame_equal(df_data, synthetic_fetch_data(STATIONS, bad_stations=BAD).aggregate_station_data())
+    assert (fetcher.station_telemetry().drop(BAD)['rows_processed'] > 0).all()
+
+def test_metadata_pass_keeps_its_own_telemetry():
+    fetcher = synthetic_fetch_data(STATIONS, bad_stations=BAD, bad_metadata=['8658120'])
+    fetcher.aggregate_station_data()
+    data_records = [dict(record) for record in fetcher.run_report['stations']]
+    fetcher.aggregate_station_metadata()
+    # The run report and the data telemetry are left as the data run built them
+    assert fetcher.run_report['stations']==data_records
+    assert pd.isna(fetcher.station_telemetry().loc['8658120', 'exception'])
+    metadata = fetcher.station_telemetry(phase='metadata')
+    assert (metadata['phase']=='metadata').all()
+    assert metadata.loc['8658120', 'exception']=='ValueError'
+    assert (metadata['rows_returned']==0).all()
+
+def test_negative_cache_skips_dead_stations(tmp_path):
+    cachefile = str(tmp_path / 'negative_cache.json')
+    first = synthetic_fetch_data(STATIONS, bad_stations=BAD, negative_cache=negative_cache(cachefile))
+    df_first = first.aggregate_station_data()
+    # The next run does not request the dead stations at all
+    second = synthetic_fetch_data(STATIONS, bad_stations=BAD, negative_cache=negative_cache(cachefile))
+    pd.testing.assert_frame_equal(df_first, second.aggregate_station_data())
+    assert list(second.station_telemetry().loc[BAD, 'exception'])==['StationSkipped']*len(BAD)
+    # A forced re-probe requests them again and doubles their skip interval
+    third = synthetic_fetch_data(STATIONS, bad_stations=BAD, negative_cache=negative_cache(cachefile, reprobe=True))
+    third.aggregate_station_data()
+    assert list(third.station_telemetry().loc[BAD, 'exception'])==['ValueError']*len(BAD)
+    cache = negative_cache(cachefile, ttl_hours=1, max_ttl_hours=3)
+    key = negative_cache.key('UNKNOWN', None, BAD[0])
+    assert cache._entries[key]['failures']==2
+    cache.record_failure('UNKNOWN', None, BAD[0], now=0.0)
+    assert cache._entries[key]['next_probe']==3*3600.0 # 1h*2**2 capped at 3h
+    assert not cache.should_skip('UNKNOWN', None, BAD[0], now=3*3600.0+1)
+
+def test_no_station_succeeds():
+    fetcher = synthetic_fetch_data(STATIONS[:3], bad_stations=STATIONS[:3])
+    df_data = fetcher.aggregate_station_data()
+    assert isinstance(df_data, pd.DataFrame) and df_data.empty
+    assert isinstance(df_data.index, pd.DatetimeIndex) and df_data.index.name=='TIME'
+    assert fetcher.run_report['stations_excluded']==3
+    df_data, df_meta = synthetic_fetch_data(STATIONS[:3], bad_stations=STATIONS[:3]).aggregate()
+    assert df_data.empty and df_meta.empty
+    assert asyncio.run(synthetic_fetch_data(STATIONS[:3], bad_stations=STATIONS[:3]).aggregate_station_data_async()).empty
+
+def test_negative_cache_ignores_outages(tmp_path):
+    cachefile = str(tmp_path / 'negative_cache.json')
+    fetcher = synthetic_fetch_data(STATIONS[:2], bad_stations=STATIONS[:2], negative_cache=negative_cache(cachefile))
+    assert list(fetcher.iter_station_frames())==[]
+    assert not negative_cache(cachefile).should_skip('UNKNOWN', None, STATIONS[0])
+
+def test_vectorized_resample_matches_groupby():
+    frames = [synthetic_station(s, start=pd.Timestamp('2022-01-14 03:17')+pd.Timedelta(minutes=7*i), periods=300+i)
+              for i,s in enumerate(STATIONS)]
+    df = stations_aggregate(frames)
+    df.iloc[40:90, 1] = np.nan # A gap longer than a bin
+    for method in ['first','mean','median','max','min']:
+        expected = getattr(df.groupby(pd.Grouper(freq='15min')), method)()
+        pd.testing.assert_frame_equal(expected, stations_resample(df, 15, method=method), check_freq=False)
+    shuffled = df.sample(frac=1.0, random_state=3)
+    pd.testing.assert_frame_equal(shuffled.groupby(pd.Grouper(freq='15min')).first(), stations_resample(shuffled, 15), check_freq=False)
+    # nearest takes the valid value closest to the bin center
+    times = pd.DatetimeIndex(['2022-01-14 00:01','2022-01-14 00:06','2022-01-14 00:08','2022-01-14 00:12'], name='TIME')
+    df = pd.DataFrame({'a': [1.0, 2.0, 3.0, 4.0], 'b': [1.0, np.nan, np.nan, 4.0]}, index=times)
+    df_near = stations_resample(df, 15, method='nearest')
+    assert df_near.loc['2022-01-14 00:00','a']==3.0 and df_near.loc['2022-01-14 00:00','b']==4.0
+
+def test_gap_limited_interpolation():
+    frames = [synthetic_station(s, periods=400) for s in STATIONS]
+    df = stations_aggregate(frames)
+    df.iloc[100:104, 0] = np.nan # 30min between the bracketing samples
+    df.iloc[200:215, 1] = np.nan # 96min
+    df.iloc[:5, 2] = np.nan      # Leading nans are never filled
+    filled = stations_interpolate(df.copy(), max_gap='30min')
+    # Reference: time weighted linear fill per column, then put back the gaps that are too long
+    expected = df.interpolate(method='time', limit_area='inside')
+    for station in df.columns:
+        times = df.index[df[station].notna()]
+        spans = pd.Series(times[1:]-times[:-1], index=times[:-1]).reindex(df.index).ffill()
+        expected.loc[df[station].isna() & (spans > pd.Timedelta('30min')), station] = np.nan
+    pd.testing.assert_frame_equal(expected, filled, check_freq=False)
+    assert filled.iloc[100:104, 0].notna().all() and filled.iloc[200:215, 1].isna().all()
+    assert filled.iloc[:5, 2].isna().all()
+    # Isolated single sample gaps match the historical scipy fill
+    single = synthetic_station('8651370', periods=400).fillna(0.0)
+    single.iloc[3::7] = np.nan
+    legacy = stations_interpolate(single.copy())
+    pd.testing.assert_frame_equal(legacy, stations_interpolate(single.copy(), max_gap='12min'), check_freq=False)
+
+def test_staged_pipeline_matches_streaming(tmp_path):
+    streamed = str(tmp_path / 'streamed.csv')
+    serial = synthetic_fetch_data(STATIONS, bad_stations=BAD)
+    write_station_frames(serial.iter_station_frames(ordered=True), streamed)
+    piped = str(tmp_path / 'piped.csv')
+    fetcher = synthetic_fetch_data(STATIONS, bad_stations=BAD, delay=0.02)
+    pipeline = station_pipeline(fetcher, fetch_workers=3, clean_workers=2, queue_size=1)
+    written = pipeline.run(piped)
+    assert sorted(written)==sorted(s for s in STATIONS if s not in BAD)
+    df_streamed = pd.read_csv(streamed, dtype={'STATION': str}).sort_values(['STATION','TIME']).reset_index(drop=True)
+    df_piped = pd.read_csv(piped, dtype={'STATION': str}).sort_values(['STATION','TIME']).reset_index(drop=True)
+    pd.testing.assert_frame_equal(df_streamed, df_piped)
+    assert fetcher.run_report['stations_excluded']==len(BAD)
+    # Bounded queues never hold more than queue_size stations
+    assert [stage['stage'] for stage in fetcher.run_report['pipeline']]==['fetch','clean','write']
+    assert all(stage['max_queued'] <= 1 for stage in pipeline.stage_report)
+
+def test_staged_pipeline_retries_failed_stations(tmp_path):
+    import fetch_station_data
+    class flaky_fetch_data(synthetic_fetch_data):
+        # The first request of each flaky station fails
+        def __init__(self, stations, flaky=(), **kwargs):
+            self._flaky=set(flaky)
+            super().__init__(stations, **kwargs)
+        def fetch_single_product(self, station, periods):
+            if station in self._flaky:
+                self._flaky.discard(station)
+                raise ConnectionError('Transient failure of {}'.format(station))
+            return super().fetch_single_product(station, periods)
+    saved_backoff = fetch_station_data.fetch_station_data.RETRY_BACKOFF_SECS
+    fetch_station_data.fetch_station_data.RETRY_BACKOFF_SECS=0.01
+    try:
+        fetcher = flaky_fetch_data(STATIONS, flaky=STATIONS[:2], bad_stations=BAD, retry_attempts=1)
+        written = station_pipeline(fetcher, fetch_workers=2).run(str(tmp_path / 'piped.csv'))
+    finally:
+        fetch_station_data.fetch_station_data.RETRY_BACKOFF_SECS=saved_backoff
+    # The flaky stations were retried and written after the others. The dead ones were retried and excluded
+    assert sorted(written)==sorted(s for s in STATIONS if s not in BAD)
+    assert sorted(written[-2:])==sorted(STATIONS[:2])
+    report = fetcher.run_report
+    assert report['stations_retried']==len(BAD)+2 and report['stations_recovered']==2
+    assert report['stations_excluded']==len(BAD)
+
+class nan_on_first_fetch_data(synthetic_fetch_data):
+    """
+    As the NOAA/Contrails sources: a failed fetch is caught and returned as np.nan. The first fetch of each flaky station fails
+    """
+    def __init__(self, stations, flaky=(), **kwargs):
+        self._flaky=set(flaky)
+        super().__init__(stations, **kwargs)
+
+    def fetch_single_product(self, station, periods):
+        if station in self._flaky:
+            self._flaky.discard(station)
+            return np.nan
+        return super().fetch_single_product(station, periods)
+
+def test_staged_pipeline_retries_stations_without_data(tmp_path):
+    import fetch_station_data
+    saved_backoff = fetch_station_data.fetch_station_data.RETRY_BACKOFF_SECS
+    fetch_station_data.fetch_station_data.RETRY_BACKOFF_SECS=0.01
+    try:
+        fetcher = nan_on_first_fetch_data(STATIONS, flaky=STATIONS[:2], bad_stations=BAD, retry_attempts=1)
+        written = station_pipeline(fetcher, fetch_workers=2).run(str(tmp_path / 'piped.csv'))
+    finally:
+        fetch_station_data.fetch_station_data.RETRY_BACKOFF_SECS=saved_backoff
+    assert sorted(written)==sorted(s for s in STATIONS if s not in BAD)
+    report = fetcher.run_report
+    assert report['stations_retried']==len(BAD)+2 and report['stations_recovered']==2
+
+def test_retries_with_process_pool_postprocessing():
+    import fetch_station_data
+    saved_backoff = fetch_station_data.fetch_station_data.RETRY_BACKOFF_SECS
+    fetch_station_data.fetch_station_data.RETRY_BACKOFF_SECS=0.01
+    try:
+        # The missing data is seen before the frame goes to the pool, so the station is retried
+        fetcher = nan_on_first_fetch_data(STATIONS, flaky=STATIONS[:2], bad_stations=BAD, retry_attempts=1, postprocess_workers=2)
+        df_data = fetcher.aggregate_station_data()
+        df_both, df_meta = nan_on_first_fetch_data(STATIONS, flaky=STATIONS[:2], bad_stations=BAD, retry_attempts=1, postprocess_workers=2).aggregate()
+    finally:
+        fetch_station_data.fetch_station_data.RETRY_BACKOFF_SECS=saved_backoff
+    expected = synthetic_fetch_data(STATIONS, bad_stations=BAD).aggregate_station_data()
+    pd.testing.assert_frame_equal(expected, df_data)
+    pd.testing.assert_frame_equal(expected, df_both)
+    assert fetcher.run_report['stations_recovered']==2
+
+def test_memory_budget_spill_matches_in_memory(tmp_path):
+    in_memory = synthetic_fetch_data(STATIONS, bad_stations=BAD)
+    df_data, df_meta = in_memory.aggregate()
+    spilling = synthetic_fetch_data(STATIONS, bad_stations=BAD, max_workers=3, memory_budget=0.01)
+    spilled, df_meta_spilled = spilling.aggregate_spilled()
+    assert isinstance(spilled, spilled_station_data) and spilled.spilled
+    pd.testing.assert_frame_equal(df_meta, df_meta_spilled)
+    pd.testing.assert_frame_equal(df_data, spilled.to_frame())
+    # The streamed melt gives the same file as the in memory melt
+    expected = utilities.writeCsv(melt(df_data), rootdir=str(tmp_path), subdir='', fileroot='in_memory', iometadata='')
+    streamed = spilled.write_long(str(tmp_path / 'spilled.csv'))
+    assert open(streamed).read()==open(expected).read()
+    spilled.close()
+    # The plain aggregation always returns a dataframe, whatever the budget
+    pd.testing.assert_frame_equal(df_data, synthetic_fetch_data(STATIONS, bad_stations=BAD, memory_budget=0.01).aggregate_station_data())
+    # A generous budget never spills
+    unspilled = synthetic_fetch_data(STATIONS, bad_stations=BAD, memory_budget=100).aggregate_station_data_spilled()
+    assert not unspilled.spilled
+    pd.testing.assert_frame_equal(df_data, unspilled.to_frame())
@@ -0,0 +1,163 @@
+
+#
+# Exercise the asyncio harvest engine against a local stand-in for the Contrails and CO-OPS servers
+#
+# Run from the top level directory as: python -m pytest test/test_async_fetch.py
+#
+
+import asyncio
+import pandas as pd
+from fetch_station_data import noaanos_fetch_data, contrails_fetch_data
+from standin_server import standin_server, standin_value
+
+CONTRAILS_STATIONS=['30069','30054','WNRN7','GTNN7','30033','EWPN7']
+NOAA_STATIONS=['8651370','8652587','8654467','8656483']
+TIME_RANGE=('2022-01-13 00:00:00','2022-01-16 00:00:00')
+
+def test_contrails_async_matches_serial():
+    server = standin_server(latency=0.02, bad_stations=['GTNN7']).start()
+    try:
+        config = {'domain': server.url+'/OneRain/DataAPI', 'systemkey': 'standin'}
+        serial = contrails_fetch_data(CONTRAILS_STATIONS, TIME_RANGE, config, product='river_water_level')
+        df_serial = serial.aggregate_station_data()
+        server.max_in_flight = 0
+        engine = contrails_fetch_data(CONTRAILS_STATIONS, TIME_RANGE, config, product='river_water_level')
+        df_async = asyncio.run(engine.aggregate_station_data_async(max_in_flight=4))
+    finally:
+        server.stop()
+    assert 'GTNN7' not in df_async.columns
+    pd.testing.assert_frame_equal(df_serial, df_async)
+    # Four daily sub-windows per station were multiplexed, but never more than the limit at once
+    assert server.max_in_flight == 4
+
+def test_noaa_async():
+    server = standin_server(latency=0.01).start()
+    try:
+        noaanos = noaanos_fetch_data(NOAA_STATIONS, TIME_RANGE, product='water_level', resample_mins=0)
+        noaanos.DATAGETTER_URL = server.url+'/api/prod/datagetter'
+        df_async = asyncio.run(noaanos.aggregate_station_data_async(max_in_flight=2))
+    finally:
+        server.stop()
+    assert list(df_async.columns)==NOAA_STATIONS
+    assert df_async.index[0]==pd.Timestamp(TIME_RANGE[0]) and df_async.index[-1]==pd.Timestamp(TIME_RANGE[1])
+    time = df_async.index[17]
+    assert abs(float(df_async.loc[time, '8654467']) - standin_value('8654467', time)) < 1e-3
+    assert server.max_in_flight <= 2
+
+def test_contrails_run_report():
+    server = standin_server(bad_stations=['GTNN7']).start()
+    try:
+        config = {'domain': server.url+'/OneRain/DataAPI', 'systemkey': 'standin'}
+        contrails = contrails_fetch_data(CONTRAILS_STATIONS, TIME_RANGE, config, product='river_water_level', max_workers=3)
+        df_data, df_meta = contrails.aggregate()
+    finally:
+        server.stop()
+    report = contrails.run_report
+    assert report['source']=='CONTRAILS' and report['stations_excluded']==1
+    # Every request the server answered, including the failing ones, is accounted for
+    assert report['requests']==server.requests
+    telemetry = contrails.station_telemetry()
+    assert telemetry.loc['GTNN7','exception'] is not None
+    assert (telemetry.drop('GTNN7')['bytes'] > 0).all()
+    assert (telemetry.drop('GTNN7')['rows_processed'] > 0).all()
+
+def test_adaptive_concurrency_backs_off():
+    import fetch_station_data
+    fetch_station_data.SOURCE_LIMITERS.clear()
+    server = standin_server(latency=0.02, bad_stations=['GTNN7','30033'], error_status=429).start()
+    try:
+        config = {'domain': server.url+'/OneRain/DataAPI', 'systemkey': 'standin'}
+        serial = contrails_fetch_data(CONTRAILS_STATIONS, TIME_RANGE, config, product='river_water_level')
+        df_serial = serial.aggregate_station_data()
+        server.max_in_flight = 0
+        contrails = contrails_fetch_data(CONTRAILS_STATIONS, TIME_RANGE, config, product='river_water_level', max_workers=6, adaptive_concurrency=True)
+        df_adaptive = contrails.aggregate_station_data()
+    finally:
+        server.stop()
+    pd.testing.assert_frame_equal(df_serial, df_adaptive)
+    report = contrails.run_report['concurrency']
+    assert report['source']=='CONTRAILS' and report['max_limit']==6
+    # Throttled requests halve the limit, and every decision is recorded with its reason
+    assert report['congested'] > 0
+    assert any(d['reason']=='http 429' and d['limit'] < d['previous'] for d in report['decisions'])
+    assert server.max_in_flight <= 6
+
+def test_aimd_limiter_latency():
+    from utilities.aimd_limiter import aimd_limiter
+    limiter = aimd_limiter('STANDIN', max_limit=8, initial_limit=2)
+    for i in range(40): # Fast responses: additive increase up to the ceiling
+        limiter.release(limiter.acquire()-0.01)
+    assert limiter.limit==8
+    started = limiter.acquire()-1.0 # A slow response (well above 4x the baseline) halves the limit once
+    limiter.release(started)
+    assert limiter.limit==4
+    assert limiter.decisions[-1]['reason'].startswith('latency')
+    limiter.release(limiter.acquire(), congestion='http 503') # Issued after the last decrease
+    assert limiter.limit==2
+
+def test_hedged_requests_cut_the_tail():
+    time_range = ('2022-01-03 00:00:00','2022-01-23 00:00:00')
+    server = standin_server(latency=0.01, slow_every=25, slow_latency=1.0).start() # 4% of the requests stall
+    try:
+        config = {'domain': server.url+'/OneRain/DataAPI', 'systemkey': 'standin'}
+        plain = contrails_fetch_data(CONTRAILS_STATIONS, time_range, config, product='river_water_level')
+        df_plain = plain.aggregate_station_data()
+        plain_requests, server.requests = server.requests, 0
+        hedged = contrails_fetch_data(CONTRAILS_STATIONS, time_range, config, product='river_water_level', hedge=True)
+        df_hedged = hedged.aggregate_station_data()
+        hedged.close()
+        hedged_requests = server.requests
+    finally:
+        server.stop()
+    pd.testing.assert_frame_equal(df_plain, df_hedged)
+    assert plain.run_report['hedged_requests']==0 and plain.run_report['hedge_wins']==0
+    report = hedged.run_report
+    # Every hedge is at most one extra request (a duplicate is dropped if the original answers before it is sent),
+    # and the duplicates of stalled requests answered first
+    assert report['hedged_requests'] > 0
+    assert plain_requests < hedged_requests <= plain_requests+report['hedged_requests']
+    assert 0 < report['hedge_wins'] <= report['hedged_requests']
+    # The telemetry only counts the request whose response was used
+    assert report['requests']==plain.run_report['requests'] and report['bytes']==plain.run_report['bytes']
+
+def test_request_timeout_and_deadline():
+    server = standin_server(latency=0.1, slow_every=3, slow_latency=3.0).start()
+    try:
+        config = {'domain': server.url+'/OneRain/DataAPI', 'systemkey': 'standin'}
+        contrails = contrails_fetch_data(CONTRAILS_STATIONS, TIME_RANGE, config, product='river_water_level',
+                                         request_timeout=0.5, deadline_secs=1.0)
+        df_data = contrails.aggregate_station_data()
+    finally:
+        server.stop()
+    # Stalled requests were abandoned (a timed out request is never recorded) and the stations not started within the budget were excluded
+    report = contrails.run_report
+    assert server.requests > report['requests']
+    assert report['deadline_secs']==1.0 and report['stations_excluded'] > 0
+    assert 'DeadlineExceeded' in [station['exception'] for station in report['stations']]
+    assert len(df_data.columns) > 0
+
+def test_retry_recovers_transient_failures():
+    import fetch_station_data
+    fetch_station_data.fetch_station_data.RETRY_BACKOFF_SECS=0.05
+    server = standin_server(bad_stations=['GTNN7'], flaky_stations={'30054': 4, 'WNRN7': 8}).start()
+    try:
+        config = {'domain': server.url+'/OneRain/DataAPI', 'systemkey': 'standin'}
+        contrails = contrails_fetch_data(CONTRAILS_STATIONS, TIME_RANGE, config, product='river_water_level', max_workers=2, retry_attempts=2)
+        df_data, df_meta = contrails.aggregate()
+        noaanos = noaanos_fetch_data(NOAA_STATIONS, TIME_RANGE, product='water_level', resample_mins=0, retry_attempts=1)
+        noaanos.DATAGETTER_URL = server.url+'/api/prod/datagetter'
+        server.flaky_stations['8652587'] = 1
+        df_async = asyncio.run(noaanos.aggregate_station_data_async(max_in_flight=2))
+    finally:
+        server.stop()
+        fetch_station_data.fetch_station_data.RETRY_BACKOFF_SECS=2.0
+    # Both flaky stations came back (the second one took two rounds) in their usual column order. The dead one did not
+    assert list(df_data.columns)==[station for station in CONTRAILS_STATIONS if station!='GTNN7']
+    assert list(df_meta.index)==list(df_data.columns)
+    report = contrails.run_report
+    assert report['stations_retried']==3 and report['stations_recovered']==2
+    records = {record['station']: record for record in report['stations']}
+    assert records['WNRN7']['retries']==2 and records['WNRN7']['exception'] is None
+    assert records['GTNN7']['retries']==2 and records['GTNN7']['exception'] is not None
+    assert list(df_async.columns)==NOAA_STATIONS
+    assert noaanos.run_report['stations_recovered']==1
@@ -289,13 +289,13 @@ df_contrails_meta = contrails.aggregate_station_metadata()
 df_contrails_data_out,df_contrails_meta = format_data_frames(df_contrails_data,df_contrails_meta)
 
 # NOWCAST ADCIRC
-adcirc = adcirc_fetch_data(adcirc_stations, urls, 'water_level')
+adcirc = adcirc_fetch_data(adcirc_stations, urls, 'water_level', probe_workers=8)
 df_adcirc_data = adcirc.aggregate_station_data()
 df_adcirc_meta = adcirc.aggregate_station_metadata()
 df_adcirc_data_out,df_adcirc_meta = format_data_frames(df_adcirc_data,df_adcirc_meta)
 
 # FORECAST ADCIRC
-adcirc_fc = adcirc_fetch_data(adcirc_stations, urls_fc, 'water_level')
+adcirc_fc = adcirc_fetch_data(adcirc_stations, urls_fc, 'water_level', probe_workers=8)
 df_adcirc_fc_data = adcirc.aggregate_station_data()
 df_adcirc_fc_meta = adcirc.aggregate_station_metadata()
 df_adcirc_fc_data_out,df_adcirc_fc_meta = format_data_frames(df_adcirc_fc_data,df_adcirc_fc_meta)
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+
+#############################################################
+#
+# RENCI 2022
+# An adaptive (AIMD) limit on the number of requests in flight to a single data source
+#############################################################
+
+import time
+import asyncio
+import threading
+from collections import deque
+from utilities.utilities import utilities
+
+class aimd_limiter(object):
+    """
+    Additive increase, multiplicative decrease of the number of requests a source may have in flight.
+
+    Every request that completes without a congestion signal adds increase/limit to the limit, so
+    the limit grows by about increase for every window of successful requests. A congestion signal
+    (http 429/5xx, a timeout, a refused connection or a latency above the target) multiplies the
+    limit by decrease. Only one decrease is applied per window: signals from requests that were issued
+    before the last decrease are counted but otherwise ignored.
+
+    Without a latency_target the target is latency_factor times the lowest smoothed latency seen so far.
+
+    Every change of the (integer) limit is logged and kept in self.decisions so the controller can be
+    tuned against a stand-in server that injects latency and errors.
+
+    Input:
+        source: (str) Name used in the log messages eg NOAA, CONTRAILS, ADCIRC
+        max_limit: (int) Upper bound on the limit. Usually the size of the thread pool in use
+        min_limit: (int) Lower bound on the limit
+        initial_limit: (int) Starting limit. Default: half of max_limit
+        increase: (float) Additive increase per window of successful requests
+        decrease: (float) Multiplicative decrease on congestion
+        latency_target: (float) Seconds above which a request counts as congested. Default: adaptive
+        latency_factor: (float) With an adaptive target, the multiple of the baseline latency tolerated
+    """
+    def __init__(self, source, max_limit, min_limit=1, initial_limit=None, increase=1.0, decrease=0.5,
+                 latency_target=None, latency_factor=4.0):
+        self.source=source
+        self.min_limit=max(1, min_limit)
+        self.max_limit=max(self.min_limit, max_limit)
+        initial_limit=max(self.min_limit, self.max_limit//2) if initial_limit is None else initial_limit
+        self._limit=float(min(max(initial_limit, self.min_limit), self.max_limit))
+        self._increase=increase
+        self._decrease=decrease
+        self._latency_target=latency_target
+        self._latency_factor=latency_factor
+        self._latency=None # Smoothed (EWMA) latency
+        self._baseline=None
+        self._last_decrease=0.0
+        self._in_flight=0
+        self._cond=threading.Condition()
+        self._async_cond=None
+        self.requests=0
+        self.congested=0
+        self.decisions=deque(maxlen=1000)
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    def start_run(self, max_limit):
+        """
+        Called at the start of every run. Sets the ceiling (the run may use a different number of workers),
+        clipping the current limit, and drops the event loop state of a previous async run
+        """
+        with self._cond:
+            self.max_limit=max(self.min_limit, max_limit)
+            self._limit=min(self._limit, float(self.max_limit))
+            self._async_cond=None
+            self._cond.notify_all()
+
+    def _try_acquire(self) -> bool:
+        if self._in_flight < self.limit:
+            self._in_flight+=1
+            return True
+        return False
+
+    def acquire(self) -> float:
+        """
+        Block until a slot is free
+
+        Return:
+            The time the slot was granted, to be passed to release()
+        """
+        with self._cond:
+            self._cond.wait_for(self._try_acquire)
+        return time.time()
+
+    def release(self, started, congestion=None):
+        """
+        Free a slot and feed back the outcome of the request
+
+        Input:
+            started: (float) as returned by acquire()
+            congestion: (str) Reason the request signals congestion (eg. 'http 503', 'timeout') or None
+        """
+        now=time.time()
+        with self._cond:
+            self._in_flight-=1
+            self._update(started, now-started, congestion, now)
+            self._cond.notify_all()
+
+    async def acquire_async(self) -> float:
+        """
+        Event loop analog of acquire(). A limiter must not be shared by threads and an event loop at the same time
+        """
+        if self._async_cond is None:
+            self._async_cond=asyncio.Condition()
+        async with self._async_cond:
+            await self._async_cond.wait_for(self._try_acquire)
+        return time.time()
+
+    async def release_async(self, started, congestion=None):
+        now=time.time()
+        self._in_flight-=1
+        self._update(started, now-started, congestion, now)
+        async with self._async_cond:
+            self._async_cond.notify_all()
+
+    def _update(self, started, latency, congestion, now):
+        """
+        Apply the AIMD rule for one completed request. Called with the lock held
+        """
+        self.requests+=1
+        self._latency=latency if self._latency is None else 0.8*self._latency+0.2*latency
+        if congestion is None:
+            target=self._latency_target
+            if target is None and self._baseline is not None:
+                target=self._latency_factor*self._baseline
+            if target is not None and self._latency > target:
+                congestion='latency {:.3f} > {:.3f} secs'.format(self._latency, target)
+            self._baseline=self._latency if self._baseline is None else min(self._baseline, self._latency)
+        old=self.limit
+        if congestion is not None:
+            self.congested+=1
+            if started < self._last_decrease:
+                return # Already backed off for this window
+            self._limit=max(float(self.min_limit), self._limit*self._decrease)
+            self._last_decrease=now
+        else:
+            self._limit=min(float(self.max_limit), self._limit+self._increase/self._limit)
+        if self.limit!=old:
+            reason=congestion if congestion is not None else 'latency {:.3f} secs'.format(self._latency)
+            self.decisions.append({'time': now, 'limit': self.limit, 'previous': old, 'in_flight': self._in_flight, 'reason': reason})
+            utilities.log.info('AIMD {}: limit {} -> {} ({}, {} in flight)'.format(self.source, old, self.limit, reason, self._in_flight))
+
+    def report(self) -> dict:
+        """
+        Summary of the controller state for the run report
+        """
+        return {'source': self.source, 'limit': self.limit, 'min_limit': self.min_limit, 'max_limit': self.max_limit,
+                'requests': self.requests, 'congested': self.congested,
+                'smoothed_latency_secs': self._latency, 'decisions': list(self.decisions)}
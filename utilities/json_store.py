@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+
+#############################################################
+#
+# RENCI 2022
+# Load and atomically save the small json files kept between runs (station index, negative cache, element weights)
+#############################################################
+
+import os
+import json
+from utilities.utilities import utilities
+
+def load_json(filename, description='Json file'):
+    """
+    Read a json file kept between runs
+
+    Input:
+        filename: (str) Full path of the json file
+        description: (str) What the file holds, for the log
+
+    Return:
+        The decoded content, or None if the file does not exist or could not be read
+    """
+    if not os.path.exists(filename):
+        return None
+    try:
+        with open(filename, 'r') as fp:
+            return json.load(fp)
+    except (IOError, ValueError) as e:
+        utilities.log.warn('{} {} could not be read: {}'.format(description, filename, e))
+        return None
+
+def save_json(filename, content, indent=None) -> str:
+    """
+    Write content to filename, creating its directory as needed. The json is written to a temporary file
+    (named after the process) that is then renamed over filename, so concurrent jobs reading it never see
+    a partial file. Concurrent writers do not merge: the last one to finish wins
+
+    Return:
+        filename
+    """
+    dirname=os.path.dirname(filename)
+    if dirname and not os.path.exists(dirname):
+        os.makedirs(dirname, exist_ok=True)
+    tmpname='{}.{}.tmp'.format(filename, os.getpid())
+    with open(tmpname, 'w') as fp:
+        json.dump(content, fp, indent=indent)
+    os.replace(tmpname, filename)
+    return filename
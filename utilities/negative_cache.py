@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+#############################################################
+#
+# RENCI 2022
+# A persistent negative cache of stations that keep returning no data
+#############################################################
+
+import time
+from utilities.utilities import utilities
+from utilities.json_store import load_json, save_json
+
+class negative_cache(object):
+    """
+    Remember (source, product, station) keys whose fetch failed so later runs can skip them.
+    A station that fails is skipped for ttl_hours. Each further consecutive failure doubles that
+    interval (up to max_ttl_hours). Once the interval has elapsed the station is probed again and a single
+    success removes it from the cache.
+
+    Failures are only recorded for a run in which at least one station succeeded, so a server outage
+    does not mark every station as dead.
+
+    The cache is a small json file written by save() (see utilities.json_store.save_json)
+
+    Input:
+        filename: (str) Full path of the json cache file. Created as needed
+        ttl_hours: (float) Skip interval after the first failure
+        max_ttl_hours: (float) Upper bound on the skip interval
+        reprobe: (bool) Do not skip anything this run (failures/successes are still recorded)
+    """
+    def __init__(self, filename, ttl_hours=6, max_ttl_hours=24*7, reprobe=False):
+        self._filename=filename
+        self._ttl_secs=ttl_hours*3600.0
+        self._max_ttl_secs=max_ttl_hours*3600.0
+        self._reprobe=reprobe
+        self._entries=load_json(filename, 'Negative cache') or dict()
+        utilities.log.info('Negative cache {} holds {} stations'.format(filename, len(self._entries)))
+
+    @staticmethod
+    def key(source, product, station) -> str:
+        return '|'.join([str(source), str(product), str(station)])
+
+    def should_skip(self, source, product, station, now=None) -> bool:
+        """
+        True if the station failed recently enough that it should not be requested this run
+        """
+        if self._reprobe:
+            return False
+        entry=self._entries.get(self.key(source, product, station))
+        if entry is None:
+            return False
+        now = time.time() if now is None else now
+        return now < entry['next_probe']
+
+    def record_failure(self, source, product, station, exception=None, now=None):
+        """
+        Add or extend a station entry. The skip interval doubles for every consecutive failure
+        """
+        now = time.time() if now is None else now
+        key=self.key(source, product, station)
+        failures=self._entries.get(key, {}).get('failures', 0)+1
+        interval=min(self._ttl_secs*2**(failures-1), self._max_ttl_secs)
+        self._entries[key]={'failures': failures, 'last_failure': now, 'next_probe': now+interval,
+                            'exception': exception}
+
+    def record_success(self, source, product, station):
+        """
+        Forget a station that returned data
+        """
+        self._entries.pop(self.key(source, product, station), None)
+
+    def update(self, source, product, outcomes, now=None) -> int:
+        """
+        Record the outcome of a run
+
+        Input:
+            outcomes: list of tuples (station, exception class name or None)
+
+        Return:
+            Number of failures recorded
+        """
+        if not any(exception is None for station, exception in outcomes):
+            utilities.log.warn('Negative cache: no station succeeded, failures not recorded (server likely down)')
+            return 0
+        nfailed=0
+        for station, exception in outcomes:
+            if exception is None:
+                self.record_success(source, product, station)
+            else:
+                self.record_failure(source, product, station, exception, now=now)
+                nfailed+=1
+        return nfailed
+
+    def save(self):
+        """
+        Write the cache to disk
+        """
+        return save_json(self._filename, self._entries, indent=2)
@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+
+#############################################################
+#
+# RENCI 2022
+# A persistent spatial (KD-tree) index of the wet nodes of an ADCIRC grid
+#############################################################
+
+import os
+import pickle
+import hashlib
+import threading
+import numpy as np
+import numpy.ma as ma
+from scipy.spatial import cKDTree
+from utilities.utilities import utilities
+from utilities.json_store import load_json, save_json
+
+EARTH_RADIUS_KM=6371.0
+
+def lonlat_to_xyz(lons, lats) -> np.ndarray:
+    """
+    Points on the unit sphere so that euclidean (chord) distances order like great circle distances
+    """
+    lons=np.radians(np.asarray(lons, dtype=float))
+    lats=np.radians(np.asarray(lats, dtype=float))
+    return np.column_stack([np.cos(lats)*np.cos(lons), np.cos(lats)*np.sin(lons), np.sin(lats)])
+
+def barycentric_weights(px, py, tx, ty) -> np.ndarray:
+    """
+    Barycentric weights of the points px/py in the triangles of vertex coordinates tx/ty (shape (..., 3)).
+    All three weights are >= 0 when a point is inside its triangle
+
+    Return:
+        ndarray of shape (..., 3)
+    """
+    x1, x2, x3 = tx[...,0], tx[...,1], tx[...,2]
+    y1, y2, y3 = ty[...,0], ty[...,1], ty[...,2]
+    det = (y2-y3)*(x1-x3) + (x3-x2)*(y1-y3)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        w1 = ((y2-y3)*(px-x3) + (x3-x2)*(py-y3))/det
+        w2 = ((y3-y1)*(px-x3) + (x1-x3)*(py-y3))/det
+    return np.stack([w1, w2, 1.0-w1-w2], axis=-1)
+
+class grid_node_index(object):
+    """
+    Resolve station lon/lat to the nearest wet node of an ADCIRC grid, for any grid, instead of relying on a
+    hand maintained Node column.
+
+    The index of a grid is built once from the x/y node arrays of a fort.63 file. A node is wet when zeta
+    at the first time step of that file is not missing. The tree (cKDTree over the nodes on the unit sphere)
+    is pickled and the node ids and lon/lat are saved as .npy files under dirname/<grid>_<nodes>/.
+    On reuse the tree is unpickled and the arrays are memory mapped, so a few million node grid loads in a
+    fraction of a second and a station list is resolved in milliseconds.
+
+    The containing element of stations (for barycentric interpolation) is found by elements(), searching a
+    second tree over the element centroids. That tree and the element node numbers are kept, like the node
+    tree, in <grid>_<nodes>/centroids.pickle and elements.npy. The three nodes and weights of a station set
+    are kept in <grid>_<nodes>/weights_<fingerprint>.json
+
+    The index (and the grids it has loaded) can be pickled, eg to the worker processes of fetch_adcirc_data.main_ensembles()
+
+    Input:
+        dirname: (str) Directory holding the persisted indexes. Created as needed. None keeps them in memory
+    """
+    MAX_CANDIDATES=256 # Elements tried for a point before it is considered outside the mesh
+
+    def __init__(self, dirname=None):
+        self._dirname=dirname
+        self._grids=dict() # (grid, nodes) -> (tree, node ids, lon, lat)
+        self._element_trees=dict() # (grid, nodes) -> (centroid tree, 0 based element nodes)
+        self._lock=threading.Lock()
+        self._weights=dict() # (grid, nodes, fingerprint) -> (vertices, weights, inside)
+        self.builds=0
+        self.loads=0
+        self.element_searches=0
+
+    def __getstate__(self):
+        state=self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock=threading.Lock()
+
+    def _path(self, grid, nnodes) -> str:
+        return os.path.join(self._dirname, '{}_{}'.format(grid, nnodes))
+
+    def _load(self, path, names=('nodes', 'lon', 'lat'), treename='tree'):
+        try:
+            with open(os.path.join(path, treename+'.pickle'), 'rb') as fp:
+                tree=pickle.load(fp)
+            arrays=[np.load(os.path.join(path, name+'.npy'), mmap_mode='r') for name in names]
+        except (IOError, ValueError, pickle.UnpicklingError) as e:
+            utilities.log.warn('Node index {} ({}) could not be read, rebuilding: {}'.format(path, treename, e))
+            return None
+        self.loads+=1
+        return (tree,)+tuple(arrays)
+
+    def _save(self, path, tree, arrays, treename='tree'):
+        """
+        Write (atomically) the arrays (dict of name -> array) then the tree, whose presence marks a complete index
+        """
+        os.makedirs(path, exist_ok=True)
+        tmpname='{}.tmp'.format(os.getpid())
+        for name, array in arrays.items():
+            with open(os.path.join(path, name+tmpname), 'wb') as fp:
+                np.save(fp, array)
+            os.replace(os.path.join(path, name+tmpname), os.path.join(path, name+'.npy'))
+        with open(os.path.join(path, treename+tmpname), 'wb') as fp:
+            pickle.dump(tree, fp, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(os.path.join(path, treename+tmpname), os.path.join(path, treename+'.pickle'))
+
+    def _build(self, nc):
+        x=ma.filled(nc.variables['x'][:], np.nan)
+        y=ma.filled(nc.variables['y'][:], np.nan)
+        wet=np.isfinite(x) & np.isfinite(y)
+        if 'zeta' in nc.variables:
+            zeta=nc.variables['zeta'][0,:]
+            wet&=~ma.getmaskarray(zeta) & (ma.filled(zeta, -99999.0) > -1000)
+        nodes=np.flatnonzero(wet)
+        tree=cKDTree(lonlat_to_xyz(x[nodes], y[nodes]))
+        self.builds+=1
+        return tree, nodes, x[nodes], y[nodes]
+
+    def grid(self, grid, nc):
+        """
+        Return:
+            tuple (tree, node ids, node lon, node lat) of the wet nodes of grid, loading or building (from the open
+            fort.63 dataset nc) it as needed
+        """
+        nnodes=len(nc.dimensions['node'])
+        key=(grid, nnodes)
+        with self._lock:
+            if key in self._grids:
+                return self._grids[key]
+            entry=None
+            if self._dirname is not None and os.path.exists(os.path.join(self._path(grid, nnodes), 'tree.pickle')):
+                entry=self._load(self._path(grid, nnodes))
+            if entry is None:
+                utilities.log.info('Build the node index of grid {} ({} nodes)'.format(grid, nnodes))
+                entry=self._build(nc)
+                if self._dirname is not None:
+                    self._save(self._path(grid, nnodes), entry[0], {'nodes': entry[1], 'lon': entry[2], 'lat': entry[3]})
+            self._grids[key]=entry
+            return entry
+
+    def nearest(self, grid, nc, lons, lats):
+        """
+        Find the nearest wet node of every lon/lat
+
+        Return:
+            tuple (ndarray of 0 based node ids, ndarray of distances in km)
+        """
+        tree, nodes, lon, lat=self.grid(grid, nc)
+        chord, position=tree.query(lonlat_to_xyz(lons, lats))
+        distance=2.0*EARTH_RADIUS_KM*np.arcsin(np.minimum(chord/2.0, 1.0))
+        return np.asarray(nodes[position]), distance
+
+    def _element_tree(self, grid, nc):
+        """
+        The tree over the element centroids of grid and the element nodes, loaded or built (from the open
+        fort.63 dataset nc) as needed. Called with the lock held
+
+        Return:
+            tuple (centroid tree, ndarray (elements, 3) of 0 based node ids)
+        """
+        nnodes=len(nc.dimensions['node'])
+        key=(grid, nnodes)
+        if key in self._element_trees:
+            return self._element_trees[key]
+        entry=None
+        if self._dirname is not None and os.path.exists(os.path.join(self._path(grid, nnodes), 'centroids.pickle')):
+            entry=self._load(self._path(grid, nnodes), names=('elements',), treename='centroids')
+        if entry is None:
+            utilities.log.info('Build the element index of grid {} ({} nodes)'.format(grid, nnodes))
+            x=ma.filled(nc.variables['x'][:], np.nan)
+            y=ma.filled(nc.variables['y'][:], np.nan)
+            elements=np.asarray(nc.variables['element'][:], dtype=int)-1 # Fortran (1 based) node numbers
+            entry=(cKDTree(np.column_stack([x[elements].mean(axis=1), y[elements].mean(axis=1)])), elements)
+            self.builds+=1
+            if self._dirname is not None:
+                self._save(self._path(grid, nnodes), entry[0], {'elements': elements}, treename='centroids')
+        self._element_trees[key]=entry
+        return entry
+
+    def _locate(self, grid, nc, lons, lats, candidates=8):
+        """
+        Search the elements whose centroids are nearest to each point for one that contains it. The points
+        not contained in any candidate are searched again with twice as many candidates, up to MAX_CANDIDATES
+        """
+        tree, elements=self._element_tree(grid, nc)
+        x=ma.filled(nc.variables['x'][:], np.nan)
+        y=ma.filled(nc.variables['y'][:], np.nan)
+        lons=np.asarray(lons, dtype=float)
+        lats=np.asarray(lats, dtype=float)
+        vertices=np.zeros((len(lons), 3), dtype=int)
+        weights=np.zeros((len(lons), 3))
+        inside=np.zeros(len(lons), dtype=bool)
+        todo=np.arange(len(lons))
+        most=min(self.MAX_CANDIDATES, len(elements))
+        candidates=min(candidates, most)
+        while len(todo) > 0:
+            distance, nearest=tree.query(np.column_stack([lons[todo], lats[todo]]), k=candidates)
+            found=elements[nearest.reshape(len(todo), candidates)] # points x candidates x 3
+            found_weights=barycentric_weights(lons[todo][:,None], lats[todo][:,None], x[found], y[found])
+            contains=np.all(found_weights >= -1.0e-9, axis=-1)
+            first=np.argmax(contains, axis=1)
+            rows=np.arange(len(todo))
+            vertices[todo]=found[rows, first]
+            weights[todo]=found_weights[rows, first]
+            inside[todo]=contains[rows, first]
+            todo=todo[~inside[todo]]
+            if candidates >= most:
+                break
+            candidates=min(2*candidates, most)
+        self.element_searches+=1
+        return vertices, weights, inside
+
+    def elements(self, grid, nc, lons, lats):
+        """
+        Find the mesh element containing every lon/lat and the barycentric weights of its three nodes.
+        The result is cached (and persisted) per grid and station set
+
+        Return:
+            tuple (ndarray (points, 3) of 0 based node ids, ndarray (points, 3) of weights, ndarray of bool: inside the mesh)
+        """
+        nnodes=len(nc.dimensions['node'])
+        points=np.column_stack([np.asarray(lons, dtype=float), np.asarray(lats, dtype=float)])
+        fingerprint=hashlib.sha1(np.ascontiguousarray(points).tobytes()).hexdigest()
+        key=(grid, nnodes, fingerprint)
+        with self._lock:
+            if key in self._weights:
+                return self._weights[key]
+            filename=None
+            if self._dirname is not None:
+                filename=os.path.join(self._path(grid, nnodes), 'weights_{}.json'.format(fingerprint))
+            entry=None
+            saved=load_json(filename, 'Element weights') if filename is not None else None
+            if saved is not None:
+                try:
+                    entry=(np.array(saved['vertices'], dtype=int).reshape(-1,3), np.array(saved['weights']).reshape(-1,3), np.array(saved['inside'], dtype=bool))
+                    self.loads+=1
+                except (KeyError, ValueError) as e:
+                    utilities.log.warn('Element weights {} could not be read, searching again: {}'.format(filename, e))
+            if entry is None:
+                utilities.log.info('Locate the elements of {} stations in grid {}'.format(len(points), grid))
+                entry=self._locate(grid, nc, points[:,0], points[:,1])
+                if filename is not None:
+                    save_json(filename, {'vertices': entry[0].tolist(), 'weights': entry[1].tolist(), 'inside': entry[2].tolist()})
+            self._weights[key]=entry
+            return entry
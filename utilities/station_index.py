@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+
+#############################################################
+#
+# RENCI 2022
+# A persistent index of the fort.61 column of every ADCIRC station
+#############################################################
+
+import hashlib
+import numpy as np
+import numpy.ma as ma
+from utilities.utilities import utilities
+from utilities.json_store import load_json, save_json
+
+def decode_station_ids(names) -> np.ndarray:
+    """
+    Vectorized decoding of a fort.61 station_name variable into the leading station ids.
+    Names look like '8651370 Duck, NC' padded with blanks/nulls
+
+    Input:
+        names: the station_name values. Either a (station, namelen) char array, as read by netCDF4,
+            or one string/bytes per station
+    Return:
+        ndarray of str, one station id per fort.61 column
+    """
+    names=ma.filled(names, b'') if ma.isMaskedArray(names) else np.asarray(names)
+    if names.dtype.kind in 'OU': # netCDF4 already joined the chars (_Encoding attribute)
+        names=np.char.encode(names.astype(str), 'utf-8')
+    if names.ndim==2:
+        names=np.ascontiguousarray(names).view('S{}'.format(names.shape[1])).ravel()
+    ids=np.char.partition(np.char.strip(names), b' ')[:,0]
+    return np.char.decode(ids, 'utf-8')
+
+class fort61_station_index(object):
+    """
+    Remember which fort.61 column holds each requested station. The station layout is identical for every
+    cycle of a given grid/instance so the station_name variable only needs decoding once. An entry is keyed
+    by (grid, instance, fingerprint of the requested station list) and stores the number of stations of the
+    file it was built from: a file with another station count is decoded afresh (and replaces the entry).
+
+    The index is a small json file written by save() (see utilities.json_store.save_json)
+
+    Input:
+        filename: (str) Full path of the json index file. Created as needed. None keeps the index in memory
+    """
+    def __init__(self, filename=None):
+        self._filename=filename
+        self._entries=dict()
+        self.hits=0
+        self.builds=0
+        if filename is not None:
+            self._entries=load_json(filename, 'Station index') or dict()
+            utilities.log.info('Station index {} holds {} layouts'.format(filename, len(self._entries)))
+
+    @staticmethod
+    def key(grid, instance, stations) -> str:
+        fingerprint=hashlib.sha1('\n'.join(str(s) for s in stations).encode('utf-8')).hexdigest()
+        return '|'.join([str(grid), str(instance), fingerprint])
+
+    def lookup(self, key, nstations):
+        """
+        Return:
+            dict of station id -> fort.61 column, or None if there is no entry built from a file of nstations stations
+        """
+        entry=self._entries.get(key)
+        if entry is None or entry['nstations']!=nstations:
+            return None
+        self.hits+=1
+        return entry['columns']
+
+    def build(self, key, names, stations) -> dict:
+        """
+        Decode station_name and record the column of each of stations present in the file (first occurrence)
+
+        Return:
+            dict of station id -> fort.61 column
+        """
+        ids=decode_station_ids(names)
+        unique, first=np.unique(ids, return_index=True)
+        columns=dict(zip(unique.tolist(), first.tolist()))
+        columns={str(s): columns[str(s)] for s in stations if str(s) in columns}
+        self._entries[key]={'nstations': len(ids), 'columns': columns}
+        self.builds+=1
+        return columns
+
+    def save(self):
+        """
+        Write the index to disk. A no-op for an in memory index.
+        A copy of the entries is written, so fetchers sharing the index can keep building entries meanwhile
+        """
+        if self._filename is None:
+            return None
+        return save_json(self._filename, dict(self._entries), indent=2)
@@ -16,6 +16,8 @@ from argparse import ArgumentParser
 
 LOGGER = None
 
+GLOBAL_FILL_VALUE='-99999' # Missing values (nans) are written to disk as this value
+
 class Utilities:
     """
     """
@@ -145,20 +147,37 @@ class Utilities:
             #    print("Successfully created the directory %s " % fulldir)
         return os.path.join(fulldir, fname)
 
-    def writeCsv(self, df, rootdir='.',subdir='obspkl',fileroot='filename',iometadata='Nometadata'):
+    def writeCsv(self, df, rootdir='.',subdir='obspkl',fileroot='filename',iometadata='Nometadata',na_rep=GLOBAL_FILL_VALUE):
         """
         Write out current self.excludeList to disk as a csv
         output to rootdir/obspkl/.
+        nans are written as na_rep (default GLOBAL_FILL_VALUE) so frames can stay numeric in memory
         """
         newfilename=None
         try:
             mdir = rootdir
             newfilename = self.getSubdirectoryFileName(mdir, subdir, fileroot+iometadata+'.csv')
-            df.to_csv(newfilename)
+            df.to_csv(newfilename, na_rep=na_rep)
             print('Wrote CSV file {}'.format(newfilename))
         except IOError:
             raise IOerror("Failed to write file %s" % (newfilename))
         return newfilename
 
+    def writeJson(self, dictdata, rootdir='.',subdir='obspkl',fileroot='filename',iometadata='Nometadata'):
+        """
+        Write out a dict (eg a harvest run report) to disk as json
+        output to rootdir/subdir/.
+        """
+        newfilename=None
+        try:
+            mdir = rootdir
+            newfilename = self.getSubdirectoryFileName(mdir, subdir, fileroot+iometadata+'.json')
+            with open(newfilename, 'w') as fp:
+                json.dump(dictdata, fp, indent=2, default=str)
+            print('Wrote JSON file {}'.format(newfilename))
+        except IOError:
+            raise IOError("Failed to write file %s" % (newfilename))
+        return newfilename
+
 utilities = Utilities()
 